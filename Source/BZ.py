@@ -38,6 +38,10 @@ class BZ:
         self.vertices=vert
         self.bz_vert=vertices
 
+        # Outward normals of the faces and a point on each
+        self.normals=np.array([face[1] for face in vertices])
+        self.origins=np.array([face[0][0] for face in vertices])
+
         #Set the spacegroup
         self.sg=ase.spacegroup.get_spacegroup(cell)
         prim_cell=cell.get_cell()#primitive_from_conventional_cell(cell).get_cell()
@@ -70,4 +74,7 @@ class BZ:
         self.bz_labels=special_point_names
         self.bz_path=np.array(bz_path)
 
-
+    def signed_distance(self,points):
+        '''Largest signed distance of each point from the planes of the BZ faces, negative inside the zone'''
+        d=np.matmul(points,self.normals.T)-np.sum(self.normals*self.origins,axis=1)
+        return np.max(d,axis=1)
@@ -0,0 +1 @@
+from Source.analysis import analyse
@@ -0,0 +1,128 @@
+import json
+import time
+import numpy as np
+from scipy.spatial import Delaunay
+from Source import bands
+from Source import tetra
+
+spin_names=["up","down"]
+
+
+def mesh(bs,bril_zone,prim=False):
+    '''Tetrahedral mesh of the unfolded kpoints, the Delaunay tessellation from scipy used by castep2fs and analyse.
+    Returns the points, the (n_cells,4) cells and the mask of the cells inside the zone, None for the primitive cell.
+    Duplicated kpoints are left out of the cells.'''
+    points=np.array(bs.kpoints)
+    cells=Delaunay(points).simplices
+    in_zone=None if prim else bril_zone.signed_distance(np.mean(points[cells],axis=1))<=0
+    return points,cells,in_zone
+
+
+def summary(seed,bs,points,cells,offset,in_zone=None,dope=None,smear=0.,ef_shift=0.,occupation=None):
+    '''Band ranges, occupied volumes (% of the zone), electron and hole counts and the Luttinger count of the
+    Fermi surface bands at the isovalue offset. Returns the summary as a dict and the occupations (band,spin),
+    which are only worked out if not given.'''
+    spin_degen=3-bs.nspins
+    result={"seed":seed,
+            "units":{"energy":"eV","volume":"% of the zone","carriers":"electrons per cell"},
+            "fermi_energy":float(bs.Ef*27.2114),
+            "isovalue":float(offset),
+            "doping":None if dope is None else {"electrons":float(dope),"smearing":float(smear),"fermi_shift":float(ef_shift)},
+            "electrons":float(bs.electrons+(dope if dope is not None else 0.)),
+            "nspins":int(bs.nspins),
+            "metal":bool(bs.metal),
+            "bands":[],
+            "luttinger":np.nan}
+    if not bs.metal:
+        return result,np.zeros((0,bs.nspins))
+
+    # Occupied volumes from the tetrahedron method, only counting cells inside the zone
+    if occupation is None:
+        occupation=tetra.occupations(points,cells,bs.energy,offset,weights=in_zone)
+    luttinger=0.
+    for s in range(bs.nspins):
+        for i in range(bs.n_fermi[s]):
+            result["bands"].append({"band":int(bs.ids[i,s]),
+                                    "spin":spin_names[s],
+                                    "min":float(np.min(bs.energy[i,:,s])),
+                                    "max":float(np.max(bs.energy[i,:,s])),
+                                    "bandwidth":float(np.max(bs.energy[i,:,s])-np.min(bs.energy[i,:,s])),
+                                    "volume":float(100*occupation[i,s]),
+                                    "electrons":float(spin_degen*occupation[i,s]),
+                                    "holes":float(spin_degen*(1-occupation[i,s]))})
+        luttinger+=spin_degen*(bs.n_occupied[s]+np.sum(occupation[0:bs.n_fermi[s],s]))
+    result["luttinger"]=float(luttinger)
+    return result,occupation
+
+
+def print_summary(result):
+    '''Print the band and carrier tables of a summary'''
+    print("+=========================================================+")
+    print("| Electron   Spin   Min. (eV)  Max. (eV)   Bandwidth (eV) |")
+    print("+=========================================================+")
+    for b in result["bands"]:
+        print("|    {:04d}    {:>4s}     {:6.3f}     {:6.3f}         {:6.3f}    |".format(b["band"],b["spin"],b["min"],b["max"],b["bandwidth"]))
+    print("+=========================================================+")
+    print("|                    C A R R I E R S                      |")
+    print("+=========================================================+")
+    print("| Electron   Spin   Volume (%)    Electrons      Holes    |")
+    print("+=========================================================+")
+    for b in result["bands"]:
+        print("|    {:04d}    {:>4s}    {:7.3f}       {:7.4f}      {:7.4f}   |".format(b["band"],b["spin"],b["volume"],b["electrons"],b["holes"]))
+    print("+=========================================================+")
+    print("| Luttinger count: {:9.4f}        Electrons: {:9.4f}  |".format(result["luttinger"],result["electrons"]))
+    print("+=========================================================+")
+    if abs(result["luttinger"]-result["electrons"])>0.05:
+        print('\033[93m Luttinger count differs from the number of electrons, consider a denser k-point grid.  \u001b[0m')
+
+
+def analyse(seed,offset=0.,primitive=False,dope=None,smear=0.05,bxsf_files=None,filename=None):
+    '''Fermi surface analysis of a calculation without any plotting, the band and carrier tables of a dry run.
+
+    The reading, mesh and tables are those of castep2fs, but nothing from PyVista or VTK is imported.
+    Returns the dict of summary with the time of each step in seconds under "timings". The result is also
+    written to filename as JSON if given.'''
+    start_time=time.time()
+    timings={}
+
+    cell,bril_zone,symmetry,data=bands.read(seed,bxsf_files)
+    timings["read"]=time.time()-start_time
+
+    step=time.time()
+    bs=bands.unfold(cell,bril_zone,symmetry,data,primitive,None,offset)
+    ef_shift=0.
+    if dope is not None:
+        ef_shift=bs.dope(dope,smear)
+        offset=offset+ef_shift
+    timings["unfold"]=time.time()-step
+
+    points,cells,in_zone=None,None,None
+    if bs.metal:
+        step=time.time()
+        points,cells,in_zone=mesh(bs,bril_zone,primitive)
+        timings["grid"]=time.time()-step
+
+    step=time.time()
+    result,occupation=summary(seed,bs,points,cells,offset,in_zone,dope,smear,ef_shift)
+    timings["volumes"]=time.time()-step
+    timings["total"]=time.time()-start_time
+    result["timings"]=timings
+
+    if filename is not None:
+        write_json(filename,result)
+    return result
+
+
+def write_json(filename,result):
+    '''Write the result of analyse to a JSON file, nan values are written as null'''
+    def clean(obj):
+        if isinstance(obj,dict):
+            return {k:clean(v) for k,v in obj.items()}
+        if isinstance(obj,list):
+            return [clean(v) for v in obj]
+        if isinstance(obj,float) and not np.isfinite(obj):
+            return None
+        return obj
+
+    with open(filename,'w') as f:
+        json.dump(clean(result),f,indent=2)
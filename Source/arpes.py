@@ -0,0 +1,51 @@
+import numpy as np
+
+
+def window_bands(eigenvalues,emin,emax):
+    '''Mask (band,spin) of the bands with any eigenvalue between emin and emax'''
+    e_min=np.min(eigenvalues,axis=1)
+    e_max=np.max(np.where(np.isfinite(eigenvalues),eigenvalues,-np.inf),axis=1)
+    return (e_max>=emin)&(e_min<=emax)
+
+
+def spectral_maps(energies,levels,width=0.,chunk=2**24):
+    '''Spectral weight of every level on a grid of band energies, shape (level,...).
+
+    energies has the grid axes first and the bands (states) last, with nan outside the zone. A width
+    (eV) above zero is the half width at half maximum of a Lorentzian, otherwise each state is
+    counted in a window of the level spacing. All levels, grid points and states are evaluated
+    together, in chunks of levels that keep the temporary array to about chunk elements.'''
+    levels=np.asarray(levels,dtype=float)
+    bin_width=abs(levels[1]-levels[0]) if len(levels)>1 else 1.
+    step=max(1,chunk//max(1,energies.size))
+    maps=np.zeros((len(levels),)+energies.shape[:-1])
+    for i in range(0,len(levels),step):
+        de=energies[np.newaxis]-levels[i:i+step].reshape((-1,)+(1,)*energies.ndim)
+        if width>0:
+            weight=width/np.pi/(de**2+width**2)
+        else:
+            weight=(np.abs(de)<0.5*bin_width)/bin_width
+        maps[i:i+step]=np.nansum(weight,axis=-1)
+    inside=~np.all(np.isnan(energies),axis=-1)
+    maps[:,~inside]=np.nan
+    return maps
+
+
+def plot_maps(filename,x,y,maps,levels,outline=None,cmap='viridis'):
+    '''Plot a stack of constant energy maps as panels, one per level'''
+    import matplotlib.pyplot as plt
+    n=len(levels)
+    cols=int(np.ceil(np.sqrt(n)))
+    rows=int(np.ceil(n/cols))
+    fig,axes=plt.subplots(rows,cols,figsize=(4*cols,4*rows),squeeze=False)
+    for ax in axes.ravel():
+        ax.axis('off')
+    for ax,m,e in zip(axes.ravel(),maps,levels):
+        ax.imshow(m,extent=[x[0],x[-1],y[0],y[-1]],origin='lower',cmap=cmap)
+        if outline is not None:
+            closed=np.append(outline,outline[0:1],axis=0)
+            ax.plot(closed[:,0],closed[:,1],'w-',lw=1)
+        ax.set_aspect('equal')
+        ax.set_title("%6.3f eV"%e)
+    fig.savefig(filename)
+    plt.close(fig)
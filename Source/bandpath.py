@@ -0,0 +1,39 @@
+import numpy as np
+from Source import nesting
+
+
+def interpolate(grid,recip_latt,kpoints,shift=0.,order=3):
+    '''Band energies at Cartesian kpoints from the periodic grid, shape (band,spin,kpoint).
+
+    grid is the (band,spin,n1,n2,n3) array from nesting.periodic_grid. A periodic cubic spline is
+    used by default, which is smooth enough for a quick look at the bands near Ef but will round
+    off band crossings that fall between grid points.'''
+    energies=np.zeros(grid.shape[0:2]+(len(kpoints),))
+    for b in range(grid.shape[0]):
+        for s in range(grid.shape[1]):
+            energies[b,s]=nesting.sample(grid[b,s],recip_latt,kpoints,order=order,shift=shift)
+    return energies
+
+
+def plot(filename,distance,ticks,labels,energies,level=0.,names=None):
+    '''Plot interpolated bands along a path, energies is (band,spin,kpoint) in eV and level is marked'''
+    import matplotlib.pyplot as plt
+    fig=plt.figure(figsize=(7,6))
+    ax=fig.add_subplot(111)
+    styles=['-','--']
+    colours=plt.rcParams['axes.prop_cycle'].by_key()['color']
+    for s in range(energies.shape[1]):
+        for b in range(energies.shape[0]):
+            label=names[b][s] if names is not None else None
+            ax.plot(distance,energies[b,s],styles[s],color=colours[b%len(colours)],label=label)
+    ax.axhline(level,color='grey',lw=0.8,ls=':')
+    for t in ticks:
+        ax.axvline(t,color='grey',lw=0.5)
+    ax.set_xticks(ticks)
+    ax.set_xticklabels(labels)
+    ax.set_xlim(distance[0],distance[-1])
+    ax.set_ylabel(r"$E-E_F$ (eV)")
+    if names is not None:
+        ax.legend()
+    fig.savefig(filename)
+    plt.close(fig)
@@ -1,110 +1,211 @@
+import os
+import contextlib
 import numpy as np
-import sys
+import ase.io as io
+from ase.spacegroup import Spacegroup
+from Source import BZ
+from Source import doping
+
+def read_symmetry(seed):
+    '''Symmetry rotations, translations and the spectral kpoint grid from a <seed>-out.cell'''
+    out_cell=open(seed+"-out.cell","r")
+    out_lines=out_cell.readlines()
+    out_cell.close()
+    spec_grid=[1,1,1]
+    for i in range(len(out_lines)):
+        if "%BLOCK symmetry_ops" in out_lines[i]:
+            start_line=i
+        if "%ENDBLOCK symmetry_ops" in out_lines[i]:
+            end_line=i
+        if "spectral_kpoint_mp_grid" in out_lines[i] or "bs_kpoint_mp_grid" in out_lines[i]:
+            spec_grid=np.array(out_lines[i].split()[-3:],dtype=float)
+
+    n_ops=int((end_line-start_line-1)/5)
+    rotations=np.zeros((n_ops,3,3))
+    translations=np.zeros((n_ops,3))
+
+    for i in range(n_ops):
+        rotations[i,:,0]=[float(j) for j in out_lines[start_line+2+i*5].split()]
+        rotations[i,:,1]=[float(j) for j in out_lines[start_line+3+i*5].split()]
+        rotations[i,:,2]=[float(j) for j in out_lines[start_line+4+i*5].split()]
+        translations[i,:]=[float(j) for j in out_lines[start_line+5+i*5].split()]
+
+    return rotations,translations,spec_grid
+
+
+def _inside_planes(points,vert,scale=1.3):
+    '''Mask of the points inside the zone faces of vert pushed out by scale, the region kept for the interpolation mesh'''
+    planes=np.array([face[1] for face in vert])
+    ds=-scale*np.array([np.dot(face[1],face[0][0]) for face in vert])
+    return np.all(np.matmul(points,planes.T)+ds+1e-8<0,axis=1)
+
+
+def _zone_points(kpoints,kpoint_map,recip_cell,vert,prim):
+    '''Mesh points from kpoints filling the reciprocal cell, with the index of the energies of each.
+
+    Outside the primitive cell the points are copied to the neighbouring cells and the ones near the zone
+    are kept. The negatives are then added, for a zone every point appears twice and the mesh keeps the
+    duplicates as vertices.'''
+    kx=recip_cell[0]
+    ky=recip_cell[1]
+    kz=recip_cell[2]
+    k_len=np.array([np.linalg.norm(kx),np.linalg.norm(ky),np.linalg.norm(kz)])
+
+    # Translate by the reciprocal lattice vectors
+    kpt_copy=kpoints
+    map_copy=np.array(kpoint_map)
+    if not prim:
+        for i in [-1,0]:
+            for j in [-1,0]:
+                for l in [-1,0]:
+                    if i==0 and j==0 and l==0: continue
+                    T=kpt_copy+i*kx+j*ky+l*kz
+                    kpoints=np.append(kpoints,T,axis=0)
+                    kpoint_map=np.append(kpoint_map,map_copy)
+
+    # Find the unique ones
+    kpoints=np.round(kpoints,4)
+    uni_ind,ind=np.unique(kpoints,axis=0,return_index=True)
+    kpoints=kpoints[ind]
+    kpoint_map=np.array(kpoint_map)[ind]
+
+    if not prim:
+        # Gets rid of anything too far away, then cut outside BZ
+        r=np.sqrt(np.sum(kpoints**2,axis=1))
+        mask=(r<np.max(k_len))
+        kpoints=kpoints[mask]
+        kpoint_map=kpoint_map[mask]
+        empty_mask=_inside_planes(kpoints,vert)
+        kpoints=kpoints[empty_mask]
+        kpoint_map=kpoint_map[empty_mask]
+
+    # After the reducing, add in the negatives, need moving if prim
+    if not prim:
+        kpoints=np.append(kpoints,-kpoints,axis=0)
+    else:
+        kpoints=np.append(kpoints,-kpoints+kx+ky+kz,axis=0)
+    kpoint_map=np.append(kpoint_map,kpoint_map)
+    return kpoints,kpoint_map
+
+
+def read_bands(seed):
+    '''Parse a <seed>.bands file, returns a dict with the header, the irreducible kpoints (fractional), their
+    weights and every eigenvalue (band,kpoint,spin) in eV relative to the Fermi energy'''
+    eV=27.2114
+    # Open the bands file
+    try:
+        bands_file=seed+".bands"
+        bands=open(bands_file,'r')
+    except:
+        raise Exception("No .bands file")
+
+    lines=bands.readlines()
+    bands.close()
+
+    no_spins=int(lines[1].split()[-1])
+    no_kpoints=int(lines[0].split()[-1])
+    fermi_energy=float(lines[4].split()[-1])
+
+    data={"fermi_energy":fermi_energy,"n_kpoints":no_kpoints,"nspins":no_spins}
+    if no_spins==1:
+        no_eigen  = int(lines[3].split()[-1])
+        no_eigen_2=None
+        data.update(electrons=float(lines[2].split()[-1]),nup=None,ndown=None)
+    if no_spins==2:
+        no_eigen  = int(lines[3].split()[-2])
+        no_eigen_2=int(lines[3].split()[-1])
+        n_up=float(lines[2].split()[-2])
+        n_down=float(lines[2].split()[-1])
+        data.update(electrons=n_up+n_down,nup=n_up,ndown=n_down)
+    data.update(eig_up=no_eigen,eig_down=no_eigen_2)
+
+    # Read every eigenvalue (band,kpoint,spin) in eV relative to the Fermi energy, and the kpoint weights
+    lines=np.array(lines,dtype=object)
+    if no_spins==1:
+        block=no_eigen+2
+        starts=9+block*np.arange(no_kpoints)
+        eigenvalues=np.zeros((no_eigen,no_kpoints,1))
+        eigenvalues[:,:,0]=np.array(lines[starts[np.newaxis,:]+2+np.arange(no_eigen)[:,np.newaxis]],dtype=str).astype(float)
+    else:
+        block=no_eigen+no_eigen_2+3
+        starts=9+block*np.arange(no_kpoints)
+        # Spin channels may hold different numbers of bands, missing ones never cross
+        eigenvalues=np.full((max(no_eigen,no_eigen_2),no_kpoints,2),np.inf)
+        eigenvalues[0:no_eigen,:,0]=np.array(lines[starts[np.newaxis,:]+2+np.arange(no_eigen)[:,np.newaxis]],dtype=str).astype(float)
+        eigenvalues[0:no_eigen_2,:,1]=np.array(lines[starts[np.newaxis,:]+3+no_eigen+np.arange(no_eigen_2)[:,np.newaxis]],dtype=str).astype(float)
+    data["kpoints"]=np.array([lines[i].split()[2:5] for i in starts],dtype=float)
+    data["weights"]=np.array([float(lines[i].split()[5]) for i in starts])
+    data["eigenvalues"]=(eigenvalues-fermi_energy)*eV
+    return data
+
+
+def read_cell(seed):
+    '''The cell of <seed>.cell and its Brillouin zone'''
+    try:
+        with open(os.devnull,'w') as null,contextlib.redirect_stdout(null):
+            cell=io.read(seed+".cell")
+    except:
+        raise Exception("No file "+seed+".cell")
+    return cell,BZ.BZ(cell)
+
+
+def read(seed,bxsf_files=None):
+    '''Everything read from the files of a calculation: the cell, its zone, the symmetry and the parsed bands.
+
+    The symmetry comes from <seed>-out.cell, or from ASE if there is none. With BXSF files the bands are
+    their grids, as read by bxsf.read, and there is no symmetry as the grids cover the whole cell.'''
+    cell,bril_zone=read_cell(seed)
+    if bxsf_files is not None:
+        from Source import bxsf
+        return cell,bril_zone,None,[bxsf.read(f) for f in bxsf_files]
+    try:
+        symmetry=read_symmetry(seed)
+    except:
+        print("Can't find %s-out.cell, proceeding with ASE, results may be inaccuracte"%seed)
+        rot,trans=Spacegroup(bril_zone.sg).get_op()
+        symmetry=(rot,trans,[1,1,1])
+    return cell,bril_zone,symmetry,read_bands(seed)
+
+
+def unfold(cell,bril_zone,symmetry,data,prim=False,supercell=None,offset=0.):
+    '''BandStructure from the result of read, BXSF grids when there is no symmetry'''
+    if symmetry is None:
+        from Source import bxsf
+        return bxsf.from_data(data,bril_zone.recip_latt,bril_zone.bz_vert,prim,offset)
+    return BandStructure(None,bril_zone.recip_latt,np.array(cell.get_cell()),bril_zone.bz_vert,symmetry,prim,supercell,offset,data=data)
+
+
+def load(seed,prim=False,supercell=None,offset=0.,bxsf_files=None):
+    '''Read and unfold a calculation, returns the cell, its zone, the symmetry and the BandStructure'''
+    cell,bril_zone,symmetry,data=read(seed,bxsf_files)
+    return cell,bril_zone,symmetry,unfold(cell,bril_zone,symmetry,data,prim,supercell,offset)
+
 
 class BandStructure:
     '''Class containing bands information for calculating fermi surfaces'''
-    def __init__(self,seed,recip_cell,cell,vert,sym,prim,supercell,offset):
-        
-        # Calculate the plane info
-        planes=np.zeros((len(vert),3))
-        ds=np.zeros((len(vert)))
-        for i,face in enumerate(vert):
-            lface=face[0]
-            n=face[1]
-            planes[i]=n
-            ds[i]=-1.3*np.dot(n,lface[0])
-
-            
-        def is_outside(points,planes,ds):
-            #make the loci_r mat
-            test_array=np.zeros((len(points),len(planes)))
-            for i in range(len(points)):
-                for j in range(len(planes)):
-                    test_array[i,j]=np.dot(points[i],planes[j])+ds[j]
-                
-            test_array=np.sign(test_array+1e-8)
-            sum_array=np.sum(test_array,axis=1)
-            return sum_array==-len(planes)
-            
-        eV=27.2114
-        
-        # First we try to open the file 
-        
-        # Open the bands file
-        try:
-            bands_file=seed+".bands"
-            bands=open(bands_file,'r')
-        except:
-            raise Exception("No .bands file")
-
-        lines=bands.readlines()
-
-        no_spins=int(lines[1].split()[-1])
-        no_kpoints=int(lines[0].split()[-1])
-        fermi_energy=float(lines[4].split()[-1])
-        
-        if no_spins==1:
-            fermi_energy=float(lines[4].split()[-1])
-            no_electrons =float(lines[2].split()[-1])
-            no_eigen  = int(lines[3].split()[-1])
-            no_eigen_2=None
-            spin_polarised=False
-        if no_spins==2:
-            spin_polarised=True
-            no_eigen  = int(lines[3].split()[-2])
-            no_eigen_2=int(lines[3].split()[-1])
-            n_up=float(lines[2].split()[-2])
-            n_down=float(lines[2].split()[-1])
+    def __init__(self,seed,recip_cell,cell,vert,sym,prim,supercell,offset,data=None):
+        '''Unfold the bands of <seed>.bands, or of data from read_bands if it has already been read'''
+        if data is None:
+            data=read_bands(seed)
+
         # Set all of the bands information
-        fermi_energy=fermi_energy+offset
-        self.spin_polarised=spin_polarised
-        self.Ef=fermi_energy
-        self.n_kpoints=no_kpoints
-        if spin_polarised:
-            self.nup=n_up
-            self.ndown=n_down
-            self.electrons=n_up+n_down
-        else:
-            self.nup=None
-            self.ndown=None
-            self.electrons=no_electrons
-        self.eig_up=no_eigen
-        self.eig_down=no_eigen_2
-        self.n_kpoints=no_kpoints
+        self.spin_polarised=data["nspins"]==2
+        self.Ef=data["fermi_energy"]
+        self.n_kpoints=data["n_kpoints"]
+        self.nup=data["nup"]
+        self.ndown=data["ndown"]
+        self.electrons=data["electrons"]
+        self.eig_up=data["eig_up"]
+        self.eig_down=data["eig_down"]
 
-        
         rot,trans,spec_grid=sym
-        
-        kpoints=np.zeros((no_kpoints,3))
-        if not spin_polarised:
-            temp_kpts=lines[9:-1:no_eigen+2]
-            for i in range(len(temp_kpts)):
-                temp_kpts_array=np.array(temp_kpts[i].split()[2:5],dtype=float)
-                #temp_kpts_array=np.matmul(recip_cell.T,temp_kpts_array)
-                kpoints[i]=temp_kpts_array
-                #kpoints[i+no_kpoints]=-temp_kpts_array
-        else:
-            temp_kpts=lines[9:-1:no_eigen+no_eigen_2+3]
-            for i in range(len(temp_kpts)):
-                temp_kpts_array=np.array(temp_kpts[i].split()[2:5],dtype=float)
-                #temp_kpts_array=np.matmul(recip_cell.T,temp_kpts_array)
-                kpoints[i]=temp_kpts_array
-                #kpoints[i+no_kpoints]=-temp_kpts_array
+        # Translations are made Cartesian below, a copy leaves the caller's symmetry untouched
+        trans=np.array(trans,dtype=float)
+        kpoints=np.array(data["kpoints"])
 
-        kpoints=np.array(kpoints)
-
-        
         unfold_kpoints=[]#np.zeros((2*no_kpoints,3))  
         kpoint_map=[]
         
-        # Define the recip lattice vecs
-        kx=recip_cell[0]
-        ky=recip_cell[1]
-        kz=recip_cell[2]
-        k_len=np.array([np.linalg.norm(kx),np.linalg.norm(ky),np.linalg.norm(kz)])
-
-        
-        
         for i in range(len(trans)):
             trans[i]=np.matmul(recip_cell.T,trans[i])
 
@@ -124,212 +225,116 @@ class BandStructure:
                 unfold_kpoints.append(ks)
                 kpoint_map.append(j)
 
-        # Now we have them unfolded by rotations, we need to translate by the reciprocal lattice vectors
-        unfold_kpoints=np.array(unfold_kpoints)
-        kpoint_map=np.array(kpoint_map)
-        kpt_copy=unfold_kpoints
-        map_copy=np.array(kpoint_map)
-
-
-        if not prim:
-            for i in [-1,0]:
-                for j in [-1,0]:
-                    for l in [-1,0]:
-                        if i==0 and j==0 and l==0: continue
-                        T=kpt_copy+i*kx+j*ky+l*kz
-                        unfold_kpoints=np.append(unfold_kpoints,T,axis=0)
-                        kpoint_map=np.append(kpoint_map,map_copy)
-            
-        # Start masking
-        # Find the unique ones
-        unfold_kpoints=np.round(unfold_kpoints,4)
-
-        uni_ind,ind=np.unique(unfold_kpoints,axis=0,return_index=True)
-        unfold_kpoints=unfold_kpoints[ind]
-        kpoint_map=np.array(kpoint_map)[ind]
-
-
-        
-        # Distance of the points from Gamma
-        r=np.sqrt(np.sum(unfold_kpoints**2,axis=1))
-        mask=(r<2*np.max(k_len)/2)
-        
-        # Gets rid of anything too far away
-        if not prim:
-            unfold_kpoints=unfold_kpoints[mask]
-            kpoint_map=np.array(kpoint_map)[mask]
-            r=r[mask]
-        
-
-        # Cut outside BZ
-        if not prim:
-            empty_mask=is_outside(unfold_kpoints,planes,ds)
-            unfold_kpoints=unfold_kpoints[empty_mask]
-            kpoint_map=kpoint_map[empty_mask]
-        
-        # After the reducing, add in the negatives, need moving if prim
-        if not prim:
-            unfold_kpoints=np.append(unfold_kpoints,-unfold_kpoints,axis=0)
-            kpoint_map=np.append(kpoint_map,kpoint_map)
-        else:
-            unfold_kpoints=np.append(unfold_kpoints,-unfold_kpoints+kx+ky+kz,axis=0)
-            kpoint_map=np.append(kpoint_map,kpoint_map)
-
-
+        unfold_kpoints,kpoint_map=_zone_points(np.array(unfold_kpoints),np.array(kpoint_map),recip_cell,vert,prim)
 
         # Put the folded ones here
         folded=[]
-        temp_mat=np.matmul(cell.T,recip_cell)
-        temp_mat=np.round(temp_mat)
         for j in range(len(kpoints)):
             ks=kpoints[j]
             if ks[0]<0: ks[0]=1+ks[0]
             if ks[1]<0: ks[1]=1+ks[1]
             if ks[2]<0: ks[2]=1+ks[2]
-            #ks=np.matmul(temp_mat,kpoints[j])
             ks=np.matmul(recip_cell.T,ks)
             folded.append(ks)
 
-
         self.kpt_irr=folded
-        #print("kpts: ",len(unfold_kpoints))
-        nkpts_unfolded=len(unfold_kpoints)
         self.nkpts_unfolded=len(unfold_kpoints)
-    
-
-        # Extract the energy for each kpoint
-
-        if not spin_polarised:
-
-            nspins=1
-            self.nspins=nspins
-            
-            energy_array=np.zeros((no_eigen,no_kpoints))
-            fermi_map=np.zeros((no_eigen),dtype=bool)
-            electron_ids=[]
-            for i in range(no_eigen-1):                
-                energy_array[i]=lines[11+i:-1:no_eigen+2]
-                energy_array[i]=energy_array[i]-fermi_energy
-                if np.max(energy_array[i])>0 and  np.min(energy_array[i])<0:
-                    electron_ids.append(i)
-                  
-                    fermi_map[i]=True
 
-            #if np.sum(fermi_map)==0:
-            #    fermi_map[int(no_electrons)-1]=True
-            energy_array=energy_array[fermi_map]
-            #print("Number of Fermi surfaces: ",len(energy_array))
-            n_fermi=len(energy_array)
+        self.weights=data["weights"]
+        self.eigenvalues=data["eigenvalues"]
+        self.nspins=data["nspins"]
 
-            self.n_fermi=np.array([n_fermi])
-
-
-            #Transpose the energy array to make it kpoint oriented
-            energy_array=energy_array.T
-            unfolded_energy_up=np.zeros((nkpts_unfolded,n_fermi))
-
-            for i in range(nkpts_unfolded):
-                unfolded_energy_up[i]=energy_array[kpoint_map[i]]
-
-            energy=np.zeros((n_fermi,unfolded_energy_up.shape[0],nspins))
-            energy[0:n_fermi,:,0]=unfolded_energy_up.T*eV
-
-            self.energy=energy
+        self.kpoints=unfold_kpoints
+        self.kpoint_map=kpoint_map
+        self.set_level(offset)
 
-            ids=np.zeros((len(electron_ids),nspins),dtype=int)
-            ids[0:n_fermi,0]=electron_ids
-            self.ids=ids
+    @classmethod
+    def from_grid(cls,eigenvalues,recip_cell,vert,prim,fermi_energy,offset=0.,electrons=np.nan,bands_below=None):
+        '''Band structure from energies on the full Gamma-centred grid of the reciprocal cell, e.g. read from a BXSF file.
 
+        eigenvalues is (band,n1,n2,n3,spin) in eV relative to fermi_energy (eV). The grid already covers the
+        whole cell, so no symmetry unfolding is needed and the mesh points are made from it as from the
+        unfolded kpoints of a .bands file. bands_below counts the bands lying under the ones given, they are
+        held as bands at -inf so that the band numbers and the Luttinger count match the full calculation.'''
+        self=cls.__new__(cls)
+        eV=27.2114
+        n=np.array(eigenvalues.shape[1:4])
+        nspins=eigenvalues.shape[4]
+        self.spin_polarised=nspins==2
+        self.Ef=fermi_energy/eV
+        self.electrons=electrons
+        self.nspins=nspins
+        self.n_kpoints=int(np.prod(n))
+        eigenvalues=eigenvalues.reshape(len(eigenvalues),-1,nspins)
+        if bands_below:
+            eigenvalues=np.concatenate([np.full((bands_below,)+eigenvalues.shape[1:],-np.inf),eigenvalues])
+        self.eigenvalues=eigenvalues
+        self.weights=np.full(self.n_kpoints,1./self.n_kpoints)
+
+        # Same points as the unfolding of a .bands file on this grid, so both give the same mesh
+        frac=np.indices(n).reshape(3,-1).T/n
+        kpoints,kpoint_map=_zone_points(np.matmul(frac,recip_cell),np.arange(len(frac)),recip_cell,vert,prim)
+        # The negatives take the energies of their own grid point rather than relying on time reversal
+        index=np.mod(np.round(np.matmul(kpoints,np.linalg.inv(recip_cell))*n).astype(int),n)
+        kpoint_map=np.ravel_multi_index(index.T,n)
+        self.kpoints=kpoints
+        self.kpoint_map=kpoint_map
+        self.nkpts_unfolded=len(kpoints)
+        self.set_level(offset)
+        return self
+
+    def exchange_splitting(self):
+        '''E_up-E_down (eV) of the band of every Fermi surface at the kpoints, shape (kpoint,band,spin) like energy.
+        Both entries of a band index hold the same splitting, it is nan where a band is missing in one channel.'''
+        split=np.full((len(self.kpoints),)+self.ids.shape,np.nan)
+        if self.nspins<2:
+            return split
+        with np.errstate(invalid='ignore'):
+            split_all=self.eigenvalues[:,self.kpoint_map,0]-self.eigenvalues[:,self.kpoint_map,1]
+        split_all[~np.isfinite(split_all)]=np.nan
+        for s in range(self.nspins):
+            split[:,0:self.n_fermi[s],s]=split_all[self.ids[0:self.n_fermi[s],s]].T
+        return split
+
+    def dope(self,electrons,smearing=0.):
+        '''Move the level to the rigid band Fermi level for a doping in electrons per cell, returns the shift (eV)'''
+        shift=float(doping.dope(self.eigenvalues,self.weights,electrons,smearing,spin_degen=3-self.nspins))
+        self.set_level(self.level+shift)
+        return shift
+
+    def set_level(self,level):
+        '''Select the bands crossing level (eV relative to the Fermi energy) and unfold their energies onto the kpoints.
+        This only uses the stored eigenvalues, so the isovalue can be moved without reading the .bands file again.'''
+        self.level=level
+        ids=[]
+        n_occupied=[]
+        for s in range(self.nspins):
+            e_min=np.min(self.eigenvalues[:,:,s],axis=1)
+            e_max=np.max(self.eigenvalues[:,:,s],axis=1)
+            ids.append(np.where((e_max>level)&(e_min<level))[0])
+            # Bands lying entirely below the level
+            n_occupied.append(np.sum(e_max<level))
+        self.n_occupied=np.array(n_occupied)
+        self.n_fermi=np.array([len(i) for i in ids])
+
+        self.ids=np.zeros((np.max(self.n_fermi),self.nspins),dtype=int)
+        energy=np.zeros((np.max(self.n_fermi),len(self.kpoints),self.nspins))     # band,kpoint,spin
+        for s in range(self.nspins):
+            self.ids[0:self.n_fermi[s],s]=ids[s]
+            energy[0:self.n_fermi[s],:,s]=self.eigenvalues[ids[s]][:,self.kpoint_map,s]
+        self.energy=energy
+
+        if not self.spin_polarised:
             self.degen=True
-            
         else:
-            nspins=2
-            self.nspins=nspins
-            
-            energy_array=np.zeros((no_eigen,no_kpoints))
-            energy_array_do=np.zeros((no_eigen_2,no_kpoints))
-            fermi_map=np.zeros((no_eigen),dtype=bool)
-            fermi_map_do=np.zeros((no_eigen_2),dtype=bool)
-            up_ids=[]
-            for i in range(no_eigen-1):
-                energy_array[i]=lines[11+i:-1:no_eigen+3+no_eigen_2]
-                energy_array[i]=energy_array[i]-fermi_energy                
-                if np.max(energy_array[i])>0 and np.min(energy_array[i])<0:
-                    fermi_map[i]=True
-                    up_ids.append(i)
-            #if np.sum(fermi_map)==0:
-            #    fermi_map[int(n_up)-1]=True
-            energy_array=energy_array[fermi_map]
-            
-            
-            n_fermi_up=len(energy_array)
-            down_ids=[]
-            for i in range(no_eigen_2-1):
-                energy_array_do[i]=lines[12+i+no_eigen:-1:no_eigen+3+no_eigen_2]
-                energy_array_do[i]=energy_array_do[i]-fermi_energy
-
-                if np.max(energy_array_do[i])>0 and  np.min(energy_array_do[i])<0:
-                    fermi_map_do[i]=True
-                    down_ids.append(i)
-            #if np.sum(fermi_map_do)==0:
-            #    fermi_map_do[int(n_down)-1]=True
-            energy_array_do=energy_array_do[fermi_map_do]
-            
-            n_fermi_down=len(energy_array_do)
-
-            
-            self.n_fermi=np.array([n_fermi_up,n_fermi_down])
-            ids=np.zeros((np.max(self.n_fermi),nspins),dtype=int)
-            ids[0:n_fermi_up,0]=up_ids
-            ids[0:n_fermi_down,1]=down_ids
-            self.ids=ids
-
-            #Transpose the energy array to make it kpoint oriented
-            energy_array=energy_array.T
-            energy_array_do=energy_array_do.T
-
-
-            unfolded_energy_up=np.zeros((nkpts_unfolded,n_fermi_up))
-            unfolded_energy_down=np.zeros((nkpts_unfolded,n_fermi_down))
-
-            for i in range(nkpts_unfolded):
-                unfolded_energy_up[i]=energy_array[kpoint_map[i]]
-                unfolded_energy_down[i]=energy_array_do[kpoint_map[i]]
-
-            energy=np.zeros((np.max(self.n_fermi),unfolded_energy_up.shape[0],nspins))     # band,kpoint,spin
-
-            energy[0:n_fermi_up,:,0]=unfolded_energy_up.T*eV
-            energy[0:n_fermi_down,:,1]=unfolded_energy_down.T*eV
+            self.n_fermi_up=self.n_fermi[0]
+            self.n_fermi_down=self.n_fermi[1]
+            self.energy_up=energy[0:self.n_fermi_up,:,0].T
+            self.energy_down=energy[0:self.n_fermi_down,:,1].T
 
+            # If the spins are definitely degenerate dont plot both... speed and aesthetics!
             self.degen=False
-            if n_fermi_up==n_fermi_down:
-                for band in range(n_fermi_up):
-                    band_diff=np.max(energy[0:n_fermi_up,band,0]-energy[0:n_fermi_down,band,1])
-                    if band_diff<1E-4:
-                        # if definitely degen so dont plot both... speed and aesthetics! 
-                        self.degen=True
-                    else:
-                        self.degen=False
-                        break
-                    
-                        
-            self.energy_up=unfolded_energy_up*eV
-            self.energy_down=unfolded_energy_down*eV
-            self.energy=energy
-
-            self.n_fermi_up=n_fermi_up
-            self.n_fermi_down=n_fermi_down
+            if self.n_fermi_up==self.n_fermi_down and np.all(ids[0]==ids[1]):
+                self.degen=bool(np.max(np.abs(energy[:,:,0]-energy[:,:,1]),initial=0)<1E-4)
 
-        self.kpoints=unfold_kpoints
-        self.kpoint_map=kpoint_map
-        if spin_polarised:
-            if self.n_fermi_up+self.n_fermi_down==0:
-                self.metal=False
-            else:
-                self.metal=True
-        else :
-            if self.n_fermi==0:
-                self.metal=False
-            else:
-                self.metal=True
-            
+        self.metal=bool(np.sum(self.n_fermi)>0)
@@ -0,0 +1,129 @@
+import re
+import numpy as np
+from Source import bands
+from Source import nesting
+
+eV=27.2114
+
+
+def fermi_grid(bs,recip_latt,spin=0):
+    '''Energies of the Fermi surface bands of one spin on the Gamma-centred periodic grid, shape (band,n1,n2,n3).
+
+    The unfolded energies are placed on their Monkhorst-Pack grid. A grid offset from Gamma is resampled
+    onto the Gamma-centred grid of the same size with a periodic cubic spline, as the general grids of
+    BXSF start at Gamma.'''
+    grid,n,shift=nesting.periodic_grid(bs.kpoints,recip_latt,bs.energy[0:bs.n_fermi[spin],:,spin:spin+1])
+    grid=grid[:,0]
+    if np.any(shift!=0):
+        frac=np.indices(n).reshape(3,-1).T/n
+        gamma=np.zeros(grid.shape)
+        for b in range(len(grid)):
+            gamma[b]=nesting.sample(grid[b],recip_latt,np.matmul(frac,recip_latt),order=3,shift=shift).reshape(n)
+        grid=gamma
+    return grid
+
+
+def write(filename,grid,recip_latt,band_ids,fermi_energy,electrons=None,bands_below=None):
+    '''Write bands on a periodic Gamma-centred grid (band,n1,n2,n3) in eV to a BXSF file, band_ids count from 0.
+
+    The general grid repeats the first plane of points at the far side of each axis. The reciprocal
+    vectors are written as castep2fs uses them, in 1/A without the 2pi. The electron count and the
+    number of bands below the ones written go in comment lines so the file can be read back for the
+    carrier analysis.'''
+    n=np.array(grid.shape[1:])
+    general=np.pad(grid,[(0,0),(0,1),(0,1),(0,1)],mode='wrap')
+    with open(filename,'w') as f:
+        f.write("# Band grid written by castep2fs\n")
+        if electrons is not None:
+            f.write("# Electrons: %.6f\n"%electrons)
+        if bands_below is not None:
+            f.write("# Bands below: %d\n"%bands_below)
+        f.write("BEGIN_INFO\n  Fermi Energy: %.6f\nEND_INFO\n"%fermi_energy)
+        f.write("BEGIN_BLOCK_BANDGRID_3D\n  band_energies\n  BEGIN_BANDGRID_3D\n")
+        f.write("    %d\n"%len(grid))
+        f.write("    %d %d %d\n"%tuple(n+1))
+        f.write("    0.000000 0.000000 0.000000\n")
+        for b in recip_latt:
+            f.write("    %.8f %.8f %.8f\n"%tuple(b))
+        for band,values in zip(band_ids,general):
+            # Band numbers in the file count from 1, as in CASTEP and the other BXSF tools
+            f.write("  BAND: %d\n"%(band+1))
+            # The last axis runs fastest
+            flat=values.reshape(-1)
+            np.savetxt(f,flat[0:len(flat)//6*6].reshape(-1,6),fmt="%.6f")
+            if len(flat)%6:
+                np.savetxt(f,flat[len(flat)//6*6:].reshape(1,-1),fmt="%.6f")
+        f.write("  END_BANDGRID_3D\nEND_BLOCK_BANDGRID_3D\n")
+
+
+def read(filename):
+    '''Read a BXSF file, returns a dict with the Fermi energy, the reciprocal vectors of the file, the band ids
+    (counted from 0) and their energies on the periodic grid (band,n1,n2,n3), with the repeated far planes of the general grid
+    removed. The electron count and bands below are nan and 0 unless the file came from castep2fs.'''
+    with open(filename,'r') as f:
+        text=f.read()
+
+    fermi=re.search(r"Fermi Energy:\s*(\S+)",text)
+    electrons=re.search(r"#\s*Electrons:\s*(\S+)",text)
+    below=re.search(r"#\s*Bands below:\s*(\S+)",text)
+
+    block=re.search(r"BEGIN_BANDGRID_3D\w*\s*\n(.*?)END_BANDGRID_3D",text,re.S)
+    if block is None:
+        raise Exception("No BANDGRID_3D block in "+filename)
+    header,*band_blocks=re.split(r"BAND:",block.group(1))
+    header=header.split()
+    n_bands=int(header[0])
+    general=np.array(header[1:4],dtype=int)
+    vectors=np.array(header[7:16],dtype=float).reshape(3,3)
+
+    ids=np.zeros(n_bands,dtype=int)
+    values=np.zeros((n_bands,)+tuple(general))
+    for i,b in enumerate(band_blocks[0:n_bands]):
+        tokens=b.split()
+        ids[i]=int(tokens[0])-1
+        values[i]=np.array(tokens[1:1+np.prod(general)],dtype=float).reshape(general)
+
+    return {"fermi_energy":float(fermi.group(1)) if fermi is not None else 0.,
+            "recip_latt":vectors,
+            "bands":ids,
+            "values":values[:,0:-1,0:-1,0:-1],
+            "electrons":float(electrons.group(1)) if electrons is not None else np.nan,
+            "bands_below":int(below.group(1)) if below is not None else 0}
+
+
+def band_structure(filenames,recip_latt,vert,prim,offset=0.):
+    '''BandStructure from one BXSF file, or two for the up and down spins, skipping the .bands file and the
+    symmetry unfolding. The grids are taken in the cell of recip_latt.'''
+    return from_data([read(f) for f in filenames],recip_latt,vert,prim,offset)
+
+
+def from_data(data,recip_latt,vert,prim,offset=0.):
+    '''BandStructure from the results of read, one for each spin'''
+    for d in data:
+        if not any(np.allclose(d["recip_latt"],s*recip_latt,rtol=1e-3,atol=1e-4) for s in [1,2*np.pi]):
+            print('\033[93m'+"Reciprocal vectors of the BXSF file differ from the cell, the grid is taken in the cell.\u001b[0m")
+    if len(data)==2 and data[0]["values"].shape[1:]!=data[1]["values"].shape[1:]:
+        raise Exception("BXSF files of the two spins are on different grids")
+
+    # Bands are aligned by their number, so spins with different bands below the file bands still line up
+    below=min(d["bands_below"] for d in data)
+    n_bands=max(d["bands_below"]-below+len(d["values"]) for d in data)
+    eigenvalues=np.full((n_bands,)+data[0]["values"].shape[1:]+(len(data),),np.inf)
+    for s,d in enumerate(data):
+        start=d["bands_below"]-below
+        eigenvalues[0:start,...,s]=-np.inf
+        eigenvalues[start:start+len(d["values"]),...,s]=d["values"]-d["fermi_energy"]
+    return bands.BandStructure.from_grid(eigenvalues,recip_latt,vert,prim,data[0]["fermi_energy"],offset,
+                                         electrons=data[0]["electrons"],bands_below=below)
+
+
+def round_trip(filenames,bs,recip_latt,vert,prim):
+    '''Read BXSF files written from bs back, returns whether they give the same mesh points and Fermi surface
+    bands, and the largest difference (eV) of their energies at those points, nan if they differ'''
+    back=band_structure(filenames,recip_latt,vert,prim)
+    if back.kpoints.shape!=bs.kpoints.shape or not np.allclose(back.kpoints,bs.kpoints):
+        return False,np.nan
+    if back.ids.shape!=bs.ids.shape or np.any(back.ids!=bs.ids):
+        return False,np.nan
+    # The files hold the Fermi energy at the isovalue of bs
+    return True,float(np.max(np.abs(back.energy+bs.level-bs.energy),initial=0))
@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.optimize import linear_sum_assignment
+from Source import bands
+from Source import analysis
+from Source import tetra
+
+
+def load(seed,offset=0.):
+    '''Read a calculation and build its tetrahedral mesh, returns the BandStructure, the zone, the mesh points and
+    cells, and the mask of the cells inside the zone'''
+    cell,bril_zone,symmetry,bs=bands.load(seed,offset=offset)
+
+    points,cells,in_zone=analysis.mesh(bs,bril_zone)
+    return bs,bril_zone,points,cells,in_zone
+
+
+def surfaces(bs,bril_zone,points,cells,level):
+    '''Isosurface of every Fermi surface band and spin inside the zone, a dict of (vertices,triangles) keyed by (band,spin)'''
+    result={}
+    for s in range(bs.nspins):
+        for i in range(bs.n_fermi[s]):
+            vertices,tri=tetra.isosurface(points,cells,bs.energy[i,:,s],level)
+            tri=tri[bril_zone.signed_distance(np.mean(vertices[tri],axis=1))<=1e-9]
+            used,tri=np.unique(tri,return_inverse=True)
+            result[(i,s)]=(vertices[used],tri.reshape(-1,3))
+    return result
+
+
+def _tree(vertices):
+    '''KD-tree of surface vertices, the sliding midpoint build is much faster for large meshes'''
+    return cKDTree(vertices,balanced_tree=False,compact_nodes=False)
+
+
+def distances(vertices_a,vertices_b,tree_a=None,tree_b=None):
+    '''Nearest neighbour distance of every vertex of each surface to the other, from KD-trees of the vertices'''
+    if tree_a is None:
+        tree_a=_tree(vertices_a)
+    if tree_b is None:
+        tree_b=_tree(vertices_b)
+    d_ab=tree_b.query(vertices_a,workers=-1)[0]
+    d_ba=tree_a.query(vertices_b,workers=-1)[0]
+    return d_ab,d_ba
+
+
+def match(surf_a,surf_b,trees_a,trees_b,keys_a,keys_b,n_sample=2000):
+    '''Pair the surfaces of two calculations by minimum total mean distance, estimated on a sample of vertices.
+    Returns the matched (key_a,key_b) pairs, surfaces left over are unmatched.'''
+    if len(keys_a)==0 or len(keys_b)==0:
+        return []
+    rng=np.random.default_rng(0)
+    cost=np.zeros((len(keys_a),len(keys_b)))
+    for i,ka in enumerate(keys_a):
+        va=surf_a[ka][0]
+        va=va[rng.choice(len(va),min(len(va),n_sample),replace=False)] if len(va)>0 else va
+        for j,kb in enumerate(keys_b):
+            vb=surf_b[kb][0]
+            if len(va)==0 or len(vb)==0:
+                cost[i,j]=np.inf if len(va)!=len(vb) else 0.
+                continue
+            vb=vb[rng.choice(len(vb),min(len(vb),n_sample),replace=False)]
+            cost[i,j]=np.mean(trees_b[kb].query(va)[0])+np.mean(trees_a[ka].query(vb)[0])
+    cost=np.where(np.isfinite(cost),cost,1e12)
+    rows,cols=linear_sum_assignment(cost)
+    return [(keys_a[i],keys_b[j]) for i,j in zip(rows,cols)]
+
+
+def compare(seed_a,seed_b,offset=0.,n_sample=2000):
+    '''Fermi surfaces of two calculations matched band by band, with the symmetric Hausdorff and mean distances
+    (1/A, k without the 2pi) between matched surfaces and their difference in occupied volume (% of the zone).
+
+    Returns a list of dicts, one per matched pair, the per-vertex distances of every matched pair and both sets of surfaces.'''
+    data=[]
+    for seed in [seed_a,seed_b]:
+        bs,bril_zone,points,cells,in_zone=load(seed,offset)
+        occupation=tetra.occupations(points,cells,bs.energy,offset,weights=in_zone)
+        surf=surfaces(bs,bril_zone,points,cells,offset)
+        trees={key:_tree(v) for key,(v,t) in surf.items() if len(v)>0}
+        data.append((bs,occupation,surf,trees))
+
+    (bs_a,occ_a,surf_a,trees_a),(bs_b,occ_b,surf_b,trees_b)=data
+    results=[]
+    vertex_distances={}
+    # A spin degenerate calculation is compared against both channels of a polarised one
+    for s in range(max(bs_a.nspins,bs_b.nspins)):
+        sa=min(s,bs_a.nspins-1)
+        sb=min(s,bs_b.nspins-1)
+        keys_a=[k for k in trees_a if k[1]==sa]
+        keys_b=[k for k in trees_b if k[1]==sb]
+        for ka,kb in match(surf_a,surf_b,trees_a,trees_b,keys_a,keys_b,n_sample):
+            d_ab,d_ba=distances(surf_a[ka][0],surf_b[kb][0],trees_a[ka],trees_b[kb])
+            vertex_distances[(ka,kb)]=(d_ab,d_ba)
+            results.append({"band_a":int(bs_a.ids[ka]),
+                            "band_b":int(bs_b.ids[kb]),
+                            "spin":["up","down"][s] if max(bs_a.nspins,bs_b.nspins)==2 else "both",
+                            "hausdorff":float(max(np.max(d_ab),np.max(d_ba))),
+                            "mean":float(0.5*(np.mean(d_ab)+np.mean(d_ba))),
+                            "volume_a":float(100*occ_a[ka]),
+                            "volume_b":float(100*occ_b[kb]),
+                            "volume_difference":float(100*(occ_b[kb]-occ_a[ka])),
+                            "vertices_a":int(len(d_ab)),
+                            "vertices_b":int(len(d_ba))})
+    return results,vertex_distances,(surf_a,surf_b)
+
+
+def main(argv=None):
+    '''Command line entry for castep2fs compare seedA seedB'''
+    parser=argparse.ArgumentParser(prog="castep2fs compare",description="Quantitative comparison of the Fermi surfaces of two CASTEP calculations.")
+    parser.add_argument("seed_a",help="The seed of the first calculation.")
+    parser.add_argument("seed_b",help="The seed of the second calculation.")
+    parser.add_argument("-O","--offset",help="Fermi surface isovalue offset in eV, applied to both",default=0.0,type=float)
+    parser.add_argument("--sample",help="Vertices sampled from each surface when matching bands",default=2000,type=int)
+    parser.add_argument("--save",help="Write the matched surfaces and their per-vertex distances to <seedA>_<seedB>_compare.npz",action="store_true")
+    args=parser.parse_args(argv)
+
+    start_time=time.time()
+    results,vertex_distances,(surf_a,surf_b)=compare(args.seed_a,args.seed_b,args.offset,args.sample)
+    name=os.path.basename(args.seed_a)+"_"+os.path.basename(args.seed_b)+"_compare"
+
+    print("+=========================================================+")
+    print("|                    C O M P A R E                        |")
+    print("+=========================================================+")
+    print("| Band A  Band B  Spin  Hausdorff  Mean (1/A)  dVol (%)   |")
+    print("+=========================================================+")
+    for r in results:
+        print("|  {:04d}    {:04d}   {:>4s}   {:8.5f}    {:8.5f}  {:8.3f}   |".format(r["band_a"],r["band_b"],r["spin"],r["hausdorff"],r["mean"],r["volume_difference"]))
+    print("+=========================================================+")
+
+    with open(name+".json",'w') as f:
+        json.dump({"seed_a":args.seed_a,"seed_b":args.seed_b,"offset":args.offset,
+                   "units":{"distance":"1/A","volume":"% of the zone"},"bands":results},f,indent=2)
+    print("Comparison written to %s.json"%name)
+
+    if args.save:
+        arrays={}
+        for n,((ka,kb),(d_ab,d_ba)) in enumerate(vertex_distances.items()):
+            arrays["vertices_a_%d"%n],arrays["triangles_a_%d"%n]=surf_a[ka]
+            arrays["vertices_b_%d"%n],arrays["triangles_b_%d"%n]=surf_b[kb]
+            arrays["distance_a_%d"%n]=d_ab
+            arrays["distance_b_%d"%n]=d_ba
+        np.savez(name+".npz",**arrays)
+        print("Surfaces written to %s.npz"%name)
+    print("Time %3.3f s"%(time.time()-start_time))
@@ -0,0 +1,326 @@
+import numpy as np
+import pyvista as pv
+from multiprocessing import Pool
+from scipy.spatial import ConvexHull
+from Source import tetra
+
+# Converts an area in 1/Angstrom^2 (k without the 2pi) to m^-2
+area_conv=(2*np.pi)**2*1e20
+
+
+def _plane_basis(normal):
+    '''Two unit vectors spanning the plane perpendicular to normal'''
+    trial=np.array([1.,0.,0.]) if abs(normal[0])<0.9 else np.array([0.,1.,0.])
+    u=np.cross(normal,trial)
+    u=u/np.linalg.norm(u)
+    return u,np.cross(normal,u)
+
+
+def _loops(section,level,normal):
+    '''Closed contour loops of the section at level, as a list of (area,centroid,outline) with areas in the units of
+    the mesh and the outline in the coordinates of the plane'''
+    if section.n_points==0:
+        return []
+    lines=section.contour([level],scalars="values")
+    if lines.n_points==0:
+        return []
+    lines=lines.strip(join=True,max_length=10*lines.n_points)
+
+    u,v=_plane_basis(normal)
+    points=np.array(lines.points)
+    conn=np.array(lines.lines)
+    loops=[]
+    i=0
+    while i<len(conn):
+        n=conn[i]
+        ids=conn[i+1:i+1+n]
+        i+=n+1
+        # Open orbits leave the mesh or cross themselves, only closed ones carry an area
+        if n<4 or ids[0]!=ids[-1]:
+            continue
+        loop=points[ids]
+        x=np.dot(loop,u)
+        y=np.dot(loop,v)
+        area=0.5*abs(np.sum(x[:-1]*y[1:]-x[1:]*y[:-1]))
+        loops.append((area,np.mean(loop[:-1],axis=0),np.column_stack([x[:-1],y[:-1]])))
+    return loops
+
+
+def _nearest(loops,centroid,tol,exclude=()):
+    '''Index of the loop with the closest centroid, or None if none lie within tol'''
+    best=None
+    best_d=tol
+    for i,l in enumerate(loops):
+        if i in exclude:
+            continue
+        d=np.linalg.norm(l[1]-centroid)
+        if d<=best_d:
+            best,best_d=i,d
+    return best
+
+
+def _enclosed(outline,loops):
+    '''Number of loops whose centre lies inside the outline, by counting crossings of a ray along x'''
+    if len(loops)==0:
+        return 0
+    centres=np.array([np.mean(l[2],axis=0) for l in loops])
+    x,y=outline[:,0],outline[:,1]
+    x2,y2=np.roll(x,-1),np.roll(y,-1)
+    px,py=centres[:,0:1],centres[:,1:2]
+    with np.errstate(divide='ignore',invalid='ignore'):
+        cross=((y>py)!=(y2>py))&(px<x+(py-y)*(x2-x)/(y2-y))
+    return int(np.sum(np.sum(cross,axis=1)%2==1))
+
+
+def _same_connectivity(loop,other,loops,other_loops):
+    '''Whether two loops followed between neighbouring planes each enclose as many loops of one plane as of the other.
+    Where loops join or split between the planes their area jumps, which must not be taken for an extremum.'''
+    return all(_enclosed(l[2],loops)==_enclosed(l[2],other_loops) for l in (loop,other))
+
+
+def extremal_orbits(mesh,values,isovalue,direction,heights,inside=None,delta_e=0.01,freq_tol=0.05):
+    '''Extremal cross-sections of the isosurface perpendicular to a field direction.
+
+    The mesh is sliced at each height along the direction and the isovalue contour of every
+    slice is split into closed loops. Loops are followed between neighbouring planes by their
+    centroids, which move by about the plane spacing, and the extrema of the area along each
+    chain are the extremal orbits. Extrema within a cell height of a join or split of loops, of
+    an extremum of the other kind or of the edge of the mesh are not resolved and are dropped.
+    The height of each extremum is refined by a parabola through the three areas and the orbit is
+    taken from a slice there. The cyclotron mass comes from the change of that area between
+    isovalues delta_e (eV) either side. inside optionally maps centroids to a bool so that copies
+    of an orbit outside the BZ are dropped. Orbits within freq_tol (relative) of one another whose
+    centroids are within a cell of the same height and distance from the field axis through Gamma
+    are symmetry copies and are merged.
+
+    Returns a list of dicts with the frequency (T), cyclotron mass (m_e), area (1/A^2 without
+    the 2pi), height, centroid and number of merged copies of each orbit.'''
+    normal=np.array(direction,dtype=float)
+    normal=normal/np.linalg.norm(normal)
+    heights=np.asarray(heights)
+    dh=heights[1]-heights[0] if len(heights)>1 else 1.
+    tol=3*dh
+
+    # Loops reaching the edge of the mesh close through pieces of the surface that it only partly holds
+    hull=ConvexHull(np.array(mesh.points))
+    u,v=_plane_basis(normal)
+
+    # Only the cells near the isovalue are sliced
+    cells=tetra.mesh_cells(mesh)
+    v_min,v_max=tetra.cell_ranges(cells,values)
+    near=(v_min<=isovalue+delta_e)&(v_max>=isovalue-delta_e)
+    mesh=pv.UnstructuredGrid({tetra.VTK_TETRA:cells[near]},np.array(mesh.points))
+    mesh.point_arrays["values"]=values
+
+    # Sections are linear within a cell, so a join or split of loops changes the areas over about one cell height
+    cell_heights=np.dot(np.array(mesh.points),normal)[cells[near]]
+    reach=max(dh,np.median(np.ptp(cell_heights,axis=1))) if len(cell_heights)>0 else dh
+
+    planes=[]
+    for h in heights:
+        planes.append(_loops(mesh.slice(normal=normal,origin=h*normal),isovalue,normal))
+
+    # Chain the loops from plane to plane, marking the links across which the loops keep their connectivity
+    chains=[]
+    open_chains=[]
+    for k,loops in enumerate(planes):
+        next_chains=[]
+        used=set()
+        for chain in open_chains:
+            last=chain[-1][1]
+            i=_nearest(loops,last[1],tol,exclude=used)
+            if i is None:
+                chains.append(chain)
+                continue
+            used.add(i)
+            chain.append((k,loops[i],_same_connectivity(last,loops[i],planes[k-1],loops)))
+            next_chains.append(chain)
+        for j,l in enumerate(loops):
+            if j not in used:
+                next_chains.append([(k,l,False)])
+        open_chains=next_chains
+    chains.extend(open_chains)
+
+    orbits=[]
+    for chain in chains:
+        areas=np.array([c[1][0] for c in chain])
+        chain_heights=heights[[c[0] for c in chain]]
+        changes=np.array([h-0.5*dh for h,c in zip(chain_heights[1:],chain[1:]) if not c[2]])
+        extrema=[]
+        for i in range(1,len(chain)-1):
+            is_max=areas[i]>=areas[i-1] and areas[i]>areas[i+1]
+            is_min=areas[i]<=areas[i-1] and areas[i]<areas[i+1]
+            if is_max or is_min:
+                extrema.append((i,is_max))
+        for i,is_max in extrema:
+            # Extrema closer than a cell height to a join or split, or to an extremum of the other kind, are not resolved by the mesh
+            if np.any(np.abs(changes-chain_heights[i])<reach):
+                continue
+            if any(other!=is_max and abs(chain_heights[j]-chain_heights[i])<reach for j,other in extrema):
+                continue
+            k,(area,centroid,outline),_=chain[i]
+
+            # Vertex of the parabola through the three areas, the slice there gives the extremal orbit
+            curve=areas[i-1]-2*areas[i]+areas[i+1]
+            shift=np.clip(0.5*(areas[i-1]-areas[i+1])/curve,-0.5,0.5) if curve!=0 else 0.
+            height=heights[k]+shift*dh
+            section=mesh.slice(normal=normal,origin=height*normal)
+            at=_loops(section,isovalue,normal)
+            i_e=_nearest(at,centroid+shift*dh*normal,tol)
+            if i_e is not None:
+                area,centroid,outline=at[i_e]
+            else:
+                height=heights[k]
+                section=mesh.slice(normal=normal,origin=height*normal)
+            if inside is not None and not inside(centroid):
+                continue
+            loop=outline[:,0:1]*u+outline[:,1:2]*v+height*normal
+            if np.max(np.dot(loop,hull.equations[:,0:3].T)+hull.equations[:,3])>-reach:
+                continue
+
+            # Cyclotron mass from the neighbouring isovalues on the same plane
+            above=_loops(section,isovalue+delta_e,normal)
+            below=_loops(section,isovalue-delta_e,normal)
+            i_a=_nearest(above,centroid,tol)
+            i_b=_nearest(below,centroid,tol)
+            if i_a is not None and i_b is not None:
+                dadE=(above[i_a][0]-below[i_b][0])/(2*delta_e)
+                mass=tetra.hbar**2*dadE*area_conv/(2*np.pi*tetra.e_charge*tetra.m_e)
+            else:
+                mass=np.nan
+
+            frequency=tetra.hbar*area*area_conv/(2*np.pi*tetra.e_charge)
+
+            # Symmetry copies and plateaus give the same orbit more than once. Operations that keep the field
+            # axis leave the area, the height up to its sign and the distance of the centroid from the axis unchanged
+            radius=np.linalg.norm(centroid-np.dot(centroid,normal)*normal)
+            same=[o for o in orbits if abs(o["frequency"]-frequency)<=freq_tol*frequency
+                  and abs(abs(o["height"])-abs(height))<=reach
+                  and abs(np.linalg.norm(o["centroid"]-np.dot(o["centroid"],normal)*normal)-radius)<=reach]
+            if len(same)>0:
+                same[0]["count"]+=1
+                continue
+            orbits.append({"frequency":frequency,
+                           "mass":mass,
+                           "area":area,
+                           "height":height,
+                           "centroid":centroid,
+                           "extremum":"max" if is_max else "min",
+                           "count":1})
+    return orbits
+
+
+# Mesh shared by the workers of an angular sweep
+_sweep={}
+
+
+def _sweep_init(points,cells,energy,isovalue,heights,normals,origins,delta_e):
+    _sweep["mesh"]=pv.UnstructuredGrid({tetra.VTK_TETRA:cells},points)
+    _sweep["energy"]=energy
+    _sweep["isovalue"]=isovalue
+    _sweep["heights"]=heights
+    _sweep["normals"]=normals
+    _sweep["origins"]=origins
+    _sweep["delta_e"]=delta_e
+
+
+def _sweep_direction(args):
+    direction,bands=args
+    normals=_sweep["normals"]
+    offsets=np.sum(normals*_sweep["origins"],axis=1)
+
+    heights=_sweep["heights"](direction)
+
+    # Orbits centred on a zone face count as inside
+    def inside(x):
+        return np.max(np.dot(normals,x)-offsets)<=heights[1]-heights[0]
+    results=[]
+    for band,spin in bands:
+        orbits=extremal_orbits(_sweep["mesh"],_sweep["energy"][band,:,spin],_sweep["isovalue"],direction,heights,inside=inside,delta_e=_sweep["delta_e"])
+        results.append(orbits)
+    return results
+
+
+class _Heights:
+    '''Evenly spaced planes spanning the zone along a direction.
+
+    The planes run slightly past the zone so that orbits extremal on a zone face, such as
+    necks, are interior to their chains.'''
+    def __init__(self,vertices,n_planes,pad=0.1):
+        self.vertices=np.array(vertices)
+        self.n_planes=n_planes
+        self.pad=pad
+
+    def __call__(self,direction):
+        direction=np.array(direction,dtype=float)
+        direction=direction/np.linalg.norm(direction)
+        h=np.dot(self.vertices,direction)
+        pad=self.pad*(np.max(h)-np.min(h))/2
+        return np.linspace(np.min(h)-pad,np.max(h)+pad,self.n_planes)
+
+
+def angular_sweep(points,cells,energy,bands,isovalue,directions,bz,n_planes=100,delta_e=0.01,processes=None):
+    '''Extremal orbits of the given (band,spin) pairs for every field direction, evaluated in a process pool.
+
+    Returns a list over directions of lists over bands of the orbits from extremal_orbits.'''
+    heights=_Heights(bz.vertices,n_planes)
+    init=(np.array(points),np.array(cells),np.array(energy),isovalue,heights,bz.normals,bz.origins,delta_e)
+    jobs=[(d,bands) for d in directions]
+    if processes==1 or len(directions)==1:
+        _sweep_init(*init)
+        return [_sweep_direction(job) for job in jobs]
+    with Pool(processes,initializer=_sweep_init,initargs=init) as pool:
+        return pool.map(_sweep_direction,jobs)
+
+
+def rotation_directions(start,end,steps):
+    '''Field directions rotating from start to end in equal angular steps, with the angles in degrees'''
+    a=np.array(start,dtype=float)
+    b=np.array(end,dtype=float)
+    a=a/np.linalg.norm(a)
+    b=b/np.linalg.norm(b)
+    total=np.arccos(np.clip(np.dot(a,b),-1,1))
+    perp=b-np.dot(a,b)*a
+    if np.linalg.norm(perp)<1e-8:
+        return np.array([a]),np.array([0.])
+    perp=perp/np.linalg.norm(perp)
+    angles=np.linspace(0,total,steps)
+    directions=np.cos(angles)[:,np.newaxis]*a+np.sin(angles)[:,np.newaxis]*perp
+    return directions,np.rad2deg(angles)
+
+
+def write_json(filename,seed,angles,directions,labels,results):
+    '''Write the orbits of an angular sweep to a JSON file, labels gives the (band,spin) name of each result'''
+    import json
+    report={"seed":seed,
+            "units":{"frequency":"T","mass":"m_e","angle":"deg"},
+            "orbits":[]}
+    for a,d,res in zip(angles,directions,results):
+        for (band,spin),orbits in zip(labels,res):
+            for o in orbits:
+                report["orbits"].append({"angle":float(a),
+                                         "direction":[float(x) for x in d],
+                                         "band":int(band),
+                                         "spin":spin,
+                                         "frequency":float(o["frequency"]),
+                                         "mass":None if np.isnan(o["mass"]) else float(o["mass"]),
+                                         "extremum":o["extremum"],
+                                         "count":int(o["count"])})
+    with open(filename,'w') as f:
+        json.dump(report,f,indent=2)
+
+
+def plot_sweep(filename,angles,labels,results):
+    '''Plot the dHvA frequencies against field angle for every band'''
+    import matplotlib.pyplot as plt
+    fig=plt.figure(figsize=(7,6))
+    ax=fig.add_subplot(111)
+    for j,(band,spin) in enumerate(labels):
+        x=[a for a,res in zip(angles,results) for o in res[j]]
+        y=[o["frequency"]/1000 for res in results for o in res[j]]
+        ax.scatter(x,y,label="%d %s"%(band,spin),s=12)
+    ax.set_xlabel("Angle (deg)")
+    ax.set_ylabel("Frequency (kT)")
+    ax.legend()
+    fig.savefig(filename)
+    plt.close(fig)
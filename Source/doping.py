@@ -0,0 +1,43 @@
+import numpy as np
+from scipy.special import erfc
+
+
+def electron_count(eigenvalues,weights,levels,smearing=0.,spin_degen=2):
+    '''Electrons per cell with every state below each level occupied, shape of levels.
+
+    eigenvalues is the BandStructure array of all bands (band,kpoint,spin) and weights the kpoint
+    weights. A smearing (eV) above zero uses Gaussian occupations, otherwise a step.'''
+    levels=np.asarray(levels,dtype=float)
+    e=eigenvalues[np.newaxis]-levels.reshape(-1,1,1,1)
+    if smearing>0:
+        f=0.5*erfc(e/smearing)
+    else:
+        f=(e<0).astype(float)
+    n=spin_degen*np.einsum('lbks,k->l',f,weights)
+    return n.reshape(levels.shape)
+
+
+def fermi_level(eigenvalues,weights,electrons,smearing=0.,spin_degen=2,tol=1e-6):
+    '''Level (eV) holding the given number of electrons per cell, found by bisection.
+
+    electrons may be an array, all of the levels are bisected together so a scan over dopings
+    costs little more than a single value.'''
+    electrons=np.asarray(electrons,dtype=float)
+    finite=eigenvalues[np.isfinite(eigenvalues)]
+    lo=np.full(electrons.shape,np.min(finite)-10*smearing-1)
+    hi=np.full(electrons.shape,np.max(finite)+10*smearing+1)
+    while np.max(hi-lo)>tol:
+        mid=0.5*(lo+hi)
+        below=electron_count(eigenvalues,weights,mid,smearing,spin_degen)<electrons
+        lo=np.where(below,mid,lo)
+        hi=np.where(below,hi,mid)
+    return 0.5*(lo+hi)
+
+
+def dope(eigenvalues,weights,doping,smearing=0.,spin_degen=2,tol=1e-6):
+    '''Rigid band Fermi level (eV relative to the undoped one) for a doping in electrons per cell,
+    negative for holes. The count at the undoped level is the reference, so with smearing zero
+    doping gives no shift. Without smearing the count is a staircase and the level lands on the
+    nearest eigenvalue, which is only a good estimate on dense kpoint grids.'''
+    reference=electron_count(eigenvalues,weights,0.,smearing,spin_degen)
+    return fermi_level(eigenvalues,weights,reference+np.asarray(doping,dtype=float),smearing,spin_degen,tol)
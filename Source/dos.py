@@ -0,0 +1,61 @@
+import json
+import numpy as np
+from Source import tetra
+
+
+def _zone_volumes(points,cells,weights):
+    '''Cell volumes, optionally scaled by weights such as an in-zone mask'''
+    vol=tetra.cell_volumes(points,cells)
+    if weights is not None:
+        vol=vol*weights
+    return vol
+
+
+def density_of_states(points,cells,energy,levels,weights=None,spin_degen=2):
+    '''Tetrahedron-method density of states in states/eV/cell at each level for every band and spin.
+
+    energy is the BandStructure array (band,kpoint,spin), the result is (level,band,spin). All
+    levels, cells, bands and spins are evaluated in a single batched pass.'''
+    vol=_zone_volumes(points,cells,weights)
+    g=tetra.dos_fraction(cells,np.moveaxis(energy,1,0),levels)
+    axis=g.ndim-energy.ndim
+    return spin_degen*np.tensordot(vol,g,axes=([0],[axis]))/np.sum(vol)
+
+
+def surface_average(points,cells,energy,attribute,level,weights=None):
+    '''Average of an attribute over the isosurface at level for every band and spin, shape (band,spin).
+
+    attribute is given at the points with shape (kpoint,band,spin), each cell contributes the mean of its
+    corners weighted by its share of the density of states.'''
+    vol=_zone_volumes(points,cells,weights)
+    g=tetra.dos_fraction(cells,np.moveaxis(energy,1,0),level)
+    w=np.mean(attribute[cells],axis=1)
+    norm=np.tensordot(vol,g,axes=([0],[0]))
+    norm=np.where(norm>0,norm,1.)
+    return np.tensordot(vol,g*w,axes=([0],[0]))/norm
+
+
+def write_json(filename,seed,bs,levels,dos,occupation,isovalue,dos_fermi,velocity=None):
+    '''Write the density of states and Fermi level quantities of every band and spin to a JSON file'''
+    spin_names=["up","down"]
+    report={"seed":seed,
+            "units":{"energy":"eV","dos":"states/eV/cell","velocity":"m/s"},
+            "isovalue":float(isovalue),
+            "electrons":float(bs.electrons),
+            "energies":[float(e) for e in levels],
+            "total_dos_at_fermi":float(np.sum([np.sum(dos_fermi[0:bs.n_fermi[s],s]) for s in range(bs.nspins)])),
+            "bands":[]}
+
+    for s in range(bs.nspins):
+        for i in range(bs.n_fermi[s]):
+            band={"band":int(bs.ids[i,s]),
+                  "spin":spin_names[s],
+                  "occupation":float(occupation[i,s]),
+                  "dos_at_fermi":float(dos_fermi[i,s]),
+                  "dos":[float(d) for d in dos[:,i,s]]}
+            if velocity is not None:
+                band["fermi_velocity"]=float(velocity[i,s])
+            report["bands"].append(band)
+
+    with open(filename,'w') as f:
+        json.dump(report,f,indent=2)
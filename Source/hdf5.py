@@ -0,0 +1,110 @@
+import numpy as np
+from Source import nesting
+
+spin_names=["up","down"]
+
+# Rows of vertices or triangles per chunk of a surface dataset
+surface_chunk=65536
+
+
+def _h5py():
+    '''h5py is only needed for the HDF5 archives, so it is imported when they are used'''
+    try:
+        import h5py
+    except ImportError:
+        raise Exception("HDF5 export needs h5py, install it with: pip install h5py")
+    return h5py
+
+
+def _name(array_name):
+    '''Dataset name of a point array, HDF5 names cannot hold a /'''
+    return array_name.replace("/","_")
+
+
+def write(filename,seed,bs,recip_latt,cell,offset,surfaces=None,symmetry=None,compression=4):
+    '''Write a BandStructure and its Fermi surfaces to a chunked, compressed HDF5 file.
+
+    Every band and spin has its own group, bands/<band>/<spin>, holding its energies on the periodic grid
+    (eV relative to the Fermi energy) so any one of them can be read without touching the rest. surfaces
+    maps (band,spin) positions of the Fermi surface bands to (vertices,triangles,point arrays), they are
+    written to the surface group of their band. The unfolded kpoints, kpoint_map and weights go in
+    kpoints and the symmetry operations, if given, in symmetry.'''
+    h5py=_h5py()
+    options=dict(compression="gzip",compression_opts=compression,shuffle=True)
+    eigenvalues=bs.eigenvalues[:,bs.kpoint_map,:]
+    present=np.all(np.isfinite(eigenvalues),axis=1)
+    grid,n,shift=nesting.periodic_grid(bs.kpoints,recip_latt,np.where(np.isfinite(eigenvalues),eigenvalues,0.))
+
+    with h5py.File(filename,"w") as f:
+        f.attrs["seed"]=seed
+        f.attrs["fermi_energy"]=bs.Ef*27.2114
+        f.attrs["isovalue"]=offset
+        f.attrs["nspins"]=bs.nspins
+        f.attrs["electrons"]=bs.electrons
+        f.attrs["grid"]=n
+        f.attrs["grid_shift"]=shift
+
+        f.create_dataset("lattice/cell",data=np.array(cell))
+        f.create_dataset("lattice/recip_latt",data=recip_latt)
+        f.create_dataset("kpoints/kpoints",data=bs.kpoints,**options)
+        f.create_dataset("kpoints/kpoint_map",data=bs.kpoint_map,**options)
+        f.create_dataset("kpoints/weights",data=bs.weights)
+        if symmetry is not None:
+            f.create_dataset("symmetry/rotations",data=symmetry[0])
+            f.create_dataset("symmetry/translations",data=symmetry[1])
+
+        chunks=tuple(int(min(i,32)) for i in n)
+        for b in range(len(grid)):
+            for s in range(bs.nspins):
+                if not present[b,s]:
+                    continue
+                group=f.create_group("bands/%04d/%s"%(b,spin_names[s]))
+                group.create_dataset("grid",data=grid[b,s],chunks=chunks,**options)
+                group.attrs["min"]=np.min(grid[b,s])
+                group.attrs["max"]=np.max(grid[b,s])
+
+        for (i,s),(vertices,triangles,arrays) in (surfaces or {}).items():
+            group=f.require_group("bands/%04d/%s"%(bs.ids[i,s],spin_names[s])).create_group("surface")
+            group.attrs["isovalue"]=offset
+            for name,data in [("vertices",vertices),("triangles",triangles)]+[(_name(k),v) for k,v in arrays.items()]:
+                data=np.asarray(data)
+                rows=int(max(1,min(len(data),surface_chunk)))
+                group.create_dataset(name,data=data,chunks=(rows,)+data.shape[1:] if len(data)>0 else None,**(options if len(data)>0 else {}))
+            for k in arrays:
+                group[_name(k)].attrs["name"]=k
+
+
+def bands(filename):
+    '''(band,spin) pairs held in an HDF5 file, without reading any of their data'''
+    h5py=_h5py()
+    with h5py.File(filename,"r") as f:
+        return [(int(b),s) for b in f["bands"] for s in f["bands"][b]]
+
+
+def read_info(filename):
+    '''Attributes, lattice, symmetry and unfolded kpoints of an HDF5 file, the band data is not read'''
+    h5py=_h5py()
+    with h5py.File(filename,"r") as f:
+        info=dict(f.attrs)
+        for group in ["lattice","kpoints","symmetry"]:
+            if group in f:
+                for name in f[group]:
+                    info[name]=f[group][name][()]
+    return info
+
+
+def read_grid(filename,band,spin="up",index=()):
+    '''Energies of one band and spin on the periodic grid, only the chunks covering index are read,
+    e.g. index=(slice(None),slice(None),0) for the kz=0 plane'''
+    h5py=_h5py()
+    with h5py.File(filename,"r") as f:
+        return f["bands/%04d/%s/grid"%(band,spin)][index]
+
+
+def read_surface(filename,band,spin="up",arrays=("vertices","triangles")):
+    '''Selected arrays of the Fermi surface of one band and spin, e.g. arrays=("vertices",) for only its vertices.
+    Point arrays are given by the names used for colouring, e.g. "Fermi Velocity (m/s)".'''
+    h5py=_h5py()
+    with h5py.File(filename,"r") as f:
+        group=f["bands/%04d/%s/surface"%(band,spin)]
+        return {name:group[_name(name)][()] for name in arrays}
@@ -9,6 +9,20 @@ from colorsys import rgb_to_hsv, hsv_to_rgb
 import ase.io as io
 from Source import BZ
 from Source import bands
+from Source import dos
+from Source import dhva
+from Source import nesting
+from Source import transport
+from Source import pockets
+from Source import bandpath
+from Source import slices
+from Source import arpes
+from Source import compare
+from Source import bxsf
+from Source import hdf5
+from Source import meshes
+from Source import pipeline
+from Source import analysis
 #import BZ
 #import bands  
 from matplotlib.colors import LinearSegmentedColormap
@@ -31,6 +45,11 @@ matplotlib.rcParams['font.family'] = 'STIXGeneral'
 def main():    
 
     warnings.filterwarnings("ignore")
+
+    # castep2fs compare seedA seedB has its own arguments
+    if len(sys.argv)>1 and sys.argv[1]=="compare":
+        compare.main(sys.argv[2:])
+        return
     
     
     # Start with the parser
@@ -48,6 +67,9 @@ def main():
     parser.add_argument("-s","--smooth",help="Smoothing factor for Fermi surfaces",default=10,type=int)
     parser.add_argument("-v","--velocity",help="Colour Fermi Surfaces by Fermi Velocity",action="store_true")
     parser.add_argument("-m","--mass",help="Colour Fermi Surfaces by effective mass",action="store_true")
+    parser.add_argument("--exchange",help="Colour spin-polarised Fermi Surfaces by the exchange splitting E_up-E_down of their band",action="store_true")
+    parser.add_argument("--mass_dir",help="Direction (Cartesian) of the effective mass for --mass, default is the harmonic mean of the principal masses",nargs=3,type=float)
+    parser.add_argument("--mass_principal","--mass-principal",help="Colour --mass by the lightest or heaviest principal mass instead",choices=['light','heavy'])
     parser.add_argument("-o","--opacity",help="Opacity of Fermi Surfaces",default=[1],type=float,nargs="+")
     parser.add_argument("--verbose",help="Set print verbosity",action="store_true")
     parser.add_argument("-z","--zoom",help="Zoom multiplier",default=1)
@@ -61,13 +83,40 @@ def main():
     parser.add_argument("--species",help="Project pdos onto species rather than orbitals",action='store_true')
     parser.add_argument("--gif",help="Option to generate an orbital .gif",action='store_true')
     parser.add_argument("-d",'--dryrun',help='Fermi surface analysis without displaying results',action="store_true")
-    parser.add_argument('--slice',help="Plane to plot slice through",nargs=3,type=int)
+    parser.add_argument('--slice',help="Plane to plot slice through, several planes can be given as consecutive h k l triples",nargs="+",type=int)
+    parser.add_argument('--slice_offsets','--slice-offsets',help="Offsets of the slice planes along their normal, as fractions of |h b1 + k b2 + l b3|, one panel each",default=[0.],nargs="+",type=float)
+    parser.add_argument('--slice_res','--slice-res',help="Resolution of the grid the slice is resampled on",default=300,type=int)
     parser.add_argument('-r','--rotation',help='Overide for plotting slices to improve appearence (deg)',default=0,type=float)
     parser.add_argument('--holes',help='Calculate electron and hole orbits. Red/Blue for electron/holes',action="store_true")
     parser.add_argument('--super',help='Display a supercell of the primitive Brillouin zone',type=int, nargs=3)
     parser.add_argument('--path',help='Visualise a path in a BZ',nargs="*")
     parser.add_argument('--orient',choices=['kx','ky','kz'],default=None)
     parser.add_argument('--spin',help='Colour the surfaces by the spin-channel (red=up, blue=down)',action='store_true')
+    parser.add_argument('--dos',help='Energy window (eV) about the Fermi level for a tetrahedron-method DOS of the Fermi surface bands, written to <seed>_dos.json',nargs=2,type=float)
+    parser.add_argument('--dos_points',help='Number of energies in the DOS window',default=101,type=int)
+    parser.add_argument('--dhva',help='Cartesian magnetic field direction for de Haas-van Alphen extremal orbits',nargs=3,type=float)
+    parser.add_argument('--dhva_to',help='Sweep the dHvA field direction from --dhva to this direction',nargs=3,type=float)
+    parser.add_argument('--dhva_steps',help='Number of field directions in a dHvA sweep',default=10,type=int)
+    parser.add_argument('--dhva_planes',help='Number of slicing planes per field direction for dHvA orbits',default=100,type=int)
+    parser.add_argument('--nesting',help='Nesting function and Lindhard susceptibility along --path (or the special points) and through Gamma on each --slice plane (0 0 1 by default)',action='store_true')
+    parser.add_argument('--sigma',help='Smearing (eV) for the nesting function and susceptibility',default=0.05,type=float)
+    parser.add_argument('--transport',help='Plasma frequencies, Fermi velocities and Boltzmann conductivities from Fermi surface integrals, written to <seed>_transport.json',action='store_true')
+    parser.add_argument('--tau',help='Relaxation time (fs) for the Boltzmann conductivity',default=10.,type=float)
+    parser.add_argument('--dope',help='Rigid band doping in electrons per cell (negative for holes), the Fermi surface is drawn at the shifted Fermi level',default=None,type=float)
+    parser.add_argument('--smear',help='Gaussian smearing (eV) of the occupations when solving for the doped Fermi level',default=0.05,type=float)
+    parser.add_argument('--topology',help='Connected pockets of every band with their area, volume, Euler characteristic and periodicity, and colour the surfaces by pocket',action='store_true')
+    parser.add_argument('--arpes',help='Energy window (eV) about the Fermi level for a stack of constant energy maps on the --slice planes (0 0 1 by default), written to <seed>_arpes_h_k_l.npz',nargs=2,type=float)
+    parser.add_argument('--arpes_points','--arpes-points',help='Number of energies in the ARPES window',default=21,type=int)
+    parser.add_argument('--arpes_width','--arpes-width',help='Lorentzian half width (eV) of the constant energy maps, 0 for no broadening',default=0.05,type=float)
+    parser.add_argument('--arpes_kz','--arpes-kz',help='Half range of kz integration of the constant energy maps, as a fraction of |h b1 + k b2 + l b3|',default=0.,type=float)
+    parser.add_argument('--arpes_kz_steps','--arpes-kz-steps',help='Number of planes in the kz integration',default=1,type=int)
+    parser.add_argument('--bxsf',help='Read the bands from BXSF files (one, or up and down) instead of the .bands file, skipping the symmetry unfolding',nargs="+")
+    parser.add_argument('--write_bxsf','--write-bxsf',help='Write the Fermi surface bands on the reciprocal lattice grid to <seed>.bxsf (<seed>_up.bxsf and <seed>_down.bxsf if spin polarised)',action='store_true')
+    parser.add_argument('--hdf5',help='Write the band grids, kpoint map, symmetry and Fermi surfaces to a chunked, compressed <seed>.h5, needs h5py',action='store_true')
+    parser.add_argument('--export_mesh','--export-mesh',help='Write every surface with its colouring arrays to <seed>_mesh/ as VTP for --from_mesh, optionally also as PLY with baked colours or the scene as glTF',nargs='*',choices=['vtp','ply','gltf'])
+    parser.add_argument('--from_mesh','--from-mesh',help='Render the surfaces saved by --export_mesh (in <seed>_mesh/ or the given directory) instead of computing them',nargs='?',const='')
+    parser.add_argument('--refine',help='Levels of adaptive refinement of the cells crossed by the Fermi surface',default=0,type=int)
+    parser.add_argument('--cache',help='Keep the results of each stage (read, unfold, grid, analysis, surface, attribute) in <seed>_cache/ or the given directory, and only rerun the stages whose inputs changed',nargs='?',const='')
     args = parser.parse_args()
     seed=args.seed
     save=args.save
@@ -82,6 +131,12 @@ def main():
     smooth=args.smooth
     velocity=args.velocity
     mass=args.mass
+    exchange=args.exchange
+    mass_dir=args.mass_dir
+    mass_principal=args.mass_principal
+    if mass_dir is not None and mass_principal is not None:
+        print("Error: --mass_dir and --mass_principal cannot be used together")
+        sys.exit()
     opacity=args.opacity
     verbose=args.verbose
     cam_pos=args.position
@@ -104,8 +159,55 @@ def main():
     R_corr = np.array(((c, -s, 0), (s, c, 0),(0,0,1)))
     orient=args.orient
     color_spin=args.spin
+    refine=args.refine
+    dos_window=args.dos
+    dos_points=args.dos_points
+    dhva_dir=args.dhva
+    dhva_to=args.dhva_to
+    dhva_steps=args.dhva_steps
+    dhva_planes=args.dhva_planes
+    plot_nesting=args.nesting
+    sigma=args.sigma
+    plot_transport=args.transport
+    plot_topology=args.topology
+    dope=args.dope
+    smear=args.smear
+    tau=args.tau*1e-15
+    bxsf_files=args.bxsf
+    write_bxsf=args.write_bxsf
+    export_h5=args.hdf5
+    export_mesh=args.export_mesh
+    from_mesh=args.from_mesh
+    export_gltf=export_mesh is not None and 'gltf' in export_mesh
+    if export_mesh is not None:
+        mesh_formats=set(export_mesh)|{'vtp'}
+        mesh_dir=seed+"_mesh"
+        os.makedirs(mesh_dir,exist_ok=True)
+        mesh_manifest=[]
+    if from_mesh is not None:
+        # The surfaces come from the cache, only the zone is built
+        fermi=False
+        if from_mesh=='':
+            from_mesh=seed+"_mesh"
+    cache_dir=args.cache
+    if cache_dir=='':
+        cache_dir=seed+"_cache"
+    cache=pipeline.Cache(cache_dir,verbose=verbose)
+    if bxsf_files is not None and len(bxsf_files)>2:
+        print("Error: --bxsf takes one file, or one for each spin")
+        sys.exit()
+    arpes_window=args.arpes
+    arpes_points=args.arpes_points
+    arpes_width=args.arpes_width
+    arpes_kz=args.arpes_kz
+    arpes_kz_steps=args.arpes_kz_steps
     slice=args.slice
+    slice_res=args.slice_res
+    slice_offsets=args.slice_offsets
     if slice!=None:
+        if len(slice)%3!=0:
+            print("Error: --slice takes h k l triples")
+            sys.exit()
         plot_slice=True
         
     else:
@@ -219,38 +321,10 @@ def main():
         sys.stdout = sys.__stdout__
     
     
-    def castep_read_out_sym(seed):
-    
-        out_cell=open(seed+"-out.cell","r")
-        out_lines=out_cell.readlines()
-        spec_grid=[1,1,1]
-        for i in range(len(out_lines)):
-            if "%BLOCK symmetry_ops" in out_lines[i]:
-                start_line=i
-            if "%ENDBLOCK symmetry_ops" in out_lines[i]:
-                end_line=i
-            if "spectral_kpoint_mp_grid" in out_lines[i] or "bs_kpoint_mp_grid" in out_lines[i]:
-                spec_grid=np.array(out_lines[i].split()[-3:],dtype=float)
-    
-        n_ops=int((end_line-start_line-1)/5)
-        rotations=np.zeros((n_ops,3,3))
-        translations=np.zeros((n_ops,3))
-    
-        for i in range(n_ops):
-            rotations[i,:,0]=[float(j) for j in out_lines[start_line+2+i*5].split()]
-            rotations[i,:,1]=[float(j) for j in out_lines[start_line+3+i*5].split()]
-            rotations[i,:,2]=[float(j) for j in out_lines[start_line+4+i*5].split()]
-            translations[i,:]=[float(j) for j in out_lines[start_line+5+i*5].split()]
-    
-        return rotations,translations,spec_grid
-
-    def skew(x):
-        return np.array([[0, -x[2], x[1]],
-                         [x[2], 0, -x[0]],
-                         [-x[1], x[0], 0]])
+    def trans(mesh,rgb=False,cmap=None,scalars=None,scale_bar=False,color=None,clim=None):
+        if color is None:
+            color=c
 
-    def trans(mesh,rgb=False,cmap=None,scalars=None,scale_bar=False,color=c):
-        
         for i in range(0,supercell[0]):
             for j in range(0,supercell[1]):
                 for k in range(0,supercell[2]):
@@ -275,7 +349,7 @@ def main():
                                      [0,0,0,1]])
                     translated=mesh.transform(matrix,inplace=False)
                     
-                    p.add_mesh(translated,rgb=rgb,scalars=scalars,color=c,smooth_shading=True,show_scalar_bar = scale_bar,lighting=True,pickable=False,specular=specular,specular_power=specular_power,ambient=ambient,diffuse=diffuse,opacity=op)
+                    p.add_mesh(translated,rgb=rgb,scalars=scalars,cmap=cmap,clim=clim,color=color,smooth_shading=True,show_scalar_bar = scale_bar,lighting=True,pickable=False,specular=specular,specular_power=specular_power,ambient=ambient,diffuse=diffuse,opacity=op)
 
                     
 
@@ -341,20 +415,19 @@ def main():
         col="rainbow"
     
     #Open the files: Cell and bands
-    blockPrint()
-    try:
-        cell=io.read(seed+".cell")
-    except:
-        raise Exception("No file "+seed+".cell")
-    
-    
-    enablePrint()
+    if fermi:
+        # Stage read: the cell, zone, symmetry and parsed bands, keyed on the contents of the files
+        if bxsf_files is not None:
+            read_files=[seed+".cell"]+bxsf_files
+        else:
+            read_files=[seed+".cell",seed+".bands",seed+"-out.cell"]
+        (cell,bril_zone,symmetry,band_data),read_key=cache.run("read",[pipeline.file_digest(read_files),bxsf_files],lambda: bands.read(seed,bxsf_files))
+    else:
+        cell,bril_zone=bands.read_cell(seed)
     positions=cell.get_positions()
     numbers=cell.get_atomic_numbers()
     latt=cell.get_cell()
     atoms=np.unique(cell.get_chemical_symbols())[::-1]
-    # Get the BZ information
-    bril_zone=BZ.BZ(cell)
     recip_latt=bril_zone.recip_latt
     
     if species:
@@ -362,30 +435,31 @@ def main():
     else:
         n_cat=4
         
-    # Try and read a castep <seed>-out.cell, if not will have to use the ase symmetries
-    try:
-        symmetry=castep_read_out_sym(seed)
-    except:
-        print("Can't find <seed>-out.cell, proceeding with ASE, results may be inaccuracte")
-        spacegroup=Spacegroup(bril_zone.sg)
-        rot,trans=spacegroup.get_op()
-        symmetry=(rot,trans,[1,1,1])
-    
-    
     # Get the bands information if needed
     if fermi:
-        bs=bands.BandStructure(seed,recip_latt,np.array(latt),bril_zone.bz_vert,symmetry,prim,supercell,offset)
+        # Stage unfold: keyed on the same arguments, with the read key standing in for what was read
+        (bs,ef_shift),unfold_key=cache.run("unfold",[read_key,prim,supercell,offset,dope,smear],
+                                           lambda: pipeline.unfold(cell,bril_zone,symmetry,band_data,prim,supercell,offset,dope,smear))
+
+        if dope is not None:
+            print("+=========================================================+")
+            print("|                      D O P I N G                        |")
+            print("+=========================================================+")
+            print("| Doping (e/cell): {:8.4f}     Smearing (eV): {:7.4f}    |".format(dope,smear))
+            print("| Fermi level shift (eV): {:9.5f}                       |".format(ef_shift))
+            print("| New Ef (eV): {:10.5f}                                 |".format(bs.Ef*27.2114+ef_shift))
+            offset=offset+ef_shift
 
     
-    # Set up the plotting stuff
-    pv.set_plot_theme(background)
-    
-    
-    if save:
-        p=pv.Plotter(off_screen=True,lighting="three lights")
-    else:
-        p = pv.Plotter(lighting="three lights")
-    p.enable_parallel_projection()
+    # Set up the plotting stuff, a dry run only prints the analysis so no plotter is made
+    p=None
+    if not dry:
+        pv.set_plot_theme(background)
+        if save:
+            p=pv.Plotter(off_screen=True,lighting="three lights")
+        else:
+            p = pv.Plotter(lighting="three lights")
+        p.enable_parallel_projection()
     
     
     #light = pv.Light()
@@ -401,7 +475,7 @@ def main():
         pdos_weights,full_kp,pdos_norm=pdos_read(seed,species,bs)
     
     # Add box for BZ
-    if not prim:
+    if not prim and not dry:
         for i in range(len(bril_zone.edges)):
             if not save:
                 p.add_lines(bril_zone.edges[i],color=line_color,width=1.5)
@@ -441,7 +515,7 @@ def main():
         for j,sub in enumerate(main):
             edges[i,j]=np.matmul(recip_latt.T,sub)
     
-    if prim:
+    if prim and not dry:
         for i in range(0,12):
             if not save:
                 p.add_lines(edges[i],width=1.5,color=line_color)
@@ -475,6 +549,7 @@ def main():
         
         verts=pv.PolyData(verts,faces)
 
+    border_mesh=verts.triangulate()
 
 
     # Add recip lattice vecs
@@ -483,9 +558,9 @@ def main():
     axis_lab=np.array([r"k1","k2","k3"])
     min_k=np.max(np.linalg.norm(recip_latt,axis=1))
     l=np.zeros((3))
-    recip_latt_labels = recip_latt
+    recip_latt_labels = np.copy(recip_latt)
     arrow_scale=np.array([0.2,0.2,0.2])
-    if show_axes:
+    if show_axes and not dry:
         for i in range(0,3):
             l[i]=np.linalg.norm(recip_latt[i])
             
@@ -531,10 +606,11 @@ def main():
                 path_points.append(path_point)
                 path_labels.append(i)
             
-        for i in range(len(path_points)-1):
-            line=pv.Line(path_points[i],path_points[i+1])
-            p.add_mesh(line,color='red',line_width=5)
-        p.add_point_labels(path_points,path_labels,shape=None,always_visible=True,show_points=False,font_family="courier",font_size=24,italic=True)
+        if not dry:
+            for i in range(len(path_points)-1):
+                line=pv.Line(path_points[i],path_points[i+1])
+                p.add_mesh(line,color='red',line_width=5)
+            p.add_point_labels(path_points,path_labels,shape=None,always_visible=True,show_points=False,font_family="courier",font_size=24,italic=True)
         print(path_points)
 
 
@@ -573,33 +649,196 @@ def main():
             print('\033[93m K-point density is relatively low, results may not be accurate..  \u001b[0m')
     
         
-        # Calculate the spacing
-        frac_spacing=1/np.array(symmetry[2])
-        recip_spacing=np.matmul(recip_latt,frac_spacing)
-        max_spacing=2*np.max(recip_spacing)
-        if max_spacing>0.2:
-            max_spacing=0.2
-    
         #Number of fermi surfaces
             
         ids=bs.ids
         n_fermi=bs.n_fermi
         energy=bs.energy[:,:,:]        
-        # Print the report
-        print("+=========================================================+")
-        print("| Electron   Spin   Min. (eV)  Max. (eV)   Bandwidth (eV) |")
-        print("+=========================================================+")
 
-        
-        for i in range(n_fermi[0]):
-            print("|    {:04d}      up     {:6.3f}     {:6.3f}         {:6.3f}    |".format(ids[i,0],np.min(energy[i,:,0]),np.max(energy[i,:,0]),(np.max(energy[i,:,0])-np.min(energy[i,:,0]))))
-            
-        if bs.nspins==2:
-            for i in range(n_fermi[1]):
-                print("|    {:04d}    down     {:6.3f}     {:6.3f}         {:6.3f}    |".format(ids[i,1],np.min(energy[i,:,1]),np.max(energy[i,:,1]),(np.max(energy[i,:,1])-np.min(energy[i,:,1]))))
+        if exchange and bs.nspins<2:
+            print('\033[93m'+"Exchange splitting needs a spin-polarised calculation, colouring ignored.\u001b[0m")
+            exchange=False
+
+        # Stage grid: the mesh, occupations and only the fields this run needs
+        gradients=velocity or holes or refine>0 or dos_window is not None or plot_transport
+        grid,grid_key=cache.run("grid",[unfold_key,offset,prim,gradients,mass,mass_dir,mass_principal,exchange],
+                                lambda: pipeline.grid(bs,bril_zone,offset,prim,gradients,mass,mass_dir,mass_principal,exchange))
+        interp=grid["interp"]
+        tets=grid["cells"]
+        in_zone=grid["in_zone"]
+        points=np.array(interp.points)
+        spin_degen=3-bs.nspins
+        spin_names=["up","down"]
+
+        # Print the report, the same tables as a dry run through analysis.analyse
+        band_summary,occupation=analysis.summary(seed,bs,points,tets,offset,in_zone,dope,smear,ef_shift,occupation=grid["occupation"])
+        analysis.print_summary(band_summary)
+
+        if write_bxsf:
+            # Absolute energies, with the Fermi energy at the drawn isovalue so the file reproduces these surfaces
+            bxsf_names=[seed+".bxsf"] if bs.nspins==1 else [seed+"_up.bxsf",seed+"_down.bxsf"]
+            for sp in range(bs.nspins):
+                b_grid=bxsf.fermi_grid(bs,recip_latt,sp)+bs.Ef*bxsf.eV
+                bxsf.write(bxsf_names[sp],b_grid,recip_latt,ids[0:n_fermi[sp],sp],bs.Ef*bxsf.eV+offset,electrons=bs.electrons,bands_below=bs.n_occupied[sp])
+                print("Bands written to %s"%bxsf_names[sp])
+            same_mesh,bxsf_diff=bxsf.round_trip(bxsf_names,bs,recip_latt,bril_zone.bz_vert,prim)
+            if same_mesh:
+                print("| Read back: same mesh points, max |dE| {:9.2e} eV       |".format(bxsf_diff))
+            else:
+                print('\033[93m'+"The BXSF grid was resampled to Gamma, reading it back gives a different mesh.\u001b[0m")
+            print("+=========================================================+")
 
-                
-        print("+=========================================================+")
+        # Stage analysis: every table is keyed on the unfolded bands and its own options, as the mesh and
+        # fields are fixed by the bands, so changing one table or the styling never reruns the others
+        if plot_topology:
+            band_pockets,_=cache.run("analysis",[unfold_key,"topology",offset],lambda: pipeline.topology(bs,recip_latt,offset))
+            print("|                     P O C K E T S                       |")
+            print("+=========================================================+")
+            print("| Band  Spin  No.  Area (1/A^2)  Vol. (%)  Type  Euler g  |")
+            print("+=========================================================+")
+            for sp in range(bs.nspins):
+                for i in range(n_fermi[sp]):
+                    for n,r in enumerate(band_pockets[(i,sp)][2]):
+                        if r["periodic"]>0:
+                            vol_str="open"
+                            type_str="%dD"%r["periodic"]
+                        else:
+                            vol_str="{:8.3f}".format(100*r["volume"]/abs(np.linalg.det(recip_latt)))
+                            type_str="e" if r["character"]>0 else "h"
+                        print("| {:04d}  {:>4s}  {:3d}     {:8.4f}  {:>8s}  {:>4s}  {:5d} {:2d}  |".format(ids[i,sp],spin_names[sp],n,r["area"],vol_str,type_str,r["euler"],r["genus"]))
+            print("+=========================================================+")
+
+        if exchange:
+            band_split=grid["band_split"]
+            split_lim=np.nanmax(np.abs(band_split),initial=0)
+            print("|                    E X C H A N G E                      |")
+            print("+=========================================================+")
+            print("| Electron   Spin   <E_up-E_down> (eV)   Max |dE| (eV)    |")
+            print("+=========================================================+")
+            for sp in range(bs.nspins):
+                for i in range(n_fermi[sp]):
+                    print("|    {:04d}    {:>4s}        {:8.4f}            {:8.4f}      |".format(ids[i,sp],spin_names[sp],grid["split_fermi"][i,sp],np.nanmax(np.abs(band_split[:,i,sp]),initial=0)))
+            print("+=========================================================+")
+
+        if dos_window is not None:
+            (dos_levels,band_dos,dos_fermi,mean_vel),_=cache.run("analysis",[unfold_key,"dos",offset,dos_window,dos_points],
+                                                                 lambda: pipeline.dos_table(points,tets,energy,grid["fermi_vel"],offset,dos_window,dos_points,in_zone,spin_degen))
+
+            print("|                        D O S                            |")
+            print("+=========================================================+")
+            print("| Electron   Spin   N(Ef) (states/eV)     <v_F> (m/s)     |")
+            print("+=========================================================+")
+            for sp in range(bs.nspins):
+                for i in range(n_fermi[sp]):
+                    print("|    {:04d}    {:>4s}        {:8.4f}           {:9.3e}     |".format(ids[i,sp],spin_names[sp],dos_fermi[i,sp],mean_vel[i,sp]))
+            print("+=========================================================+")
+            dos.write_json(seed+"_dos.json",seed,bs,dos_levels,band_dos,occupation,offset,dos_fermi,velocity=mean_vel)
+            print("DOS written to %s_dos.json"%seed)
+            print("+=========================================================+")
+
+        if plot_transport:
+            (n_ef,mean_speed,vv,plasma2,sigma_tensor),_=cache.run("analysis",[unfold_key,"transport",offset,tau],
+                                                                  lambda: pipeline.transport_table(points,tets,energy,grid["e_grad"],offset,cell.get_volume(),tau,in_zone,spin_degen))
+
+            print("|                   T R A N S P O R T                     |")
+            print("+=========================================================+")
+            print("| Electron  Spin      hbar w_p (eV)          <v_F> (m/s)  |")
+            print("|                    xx     yy     zz                     |")
+            print("+=========================================================+")
+            for sp in range(bs.nspins):
+                for i in range(n_fermi[sp]):
+                    w_p=np.sqrt(np.abs(np.diag(plasma2[:,:,i,sp])))
+                    print("|    {:04d}   {:>4s}   {:6.3f} {:6.3f} {:6.3f}         {:9.3e} |".format(ids[i,sp],spin_names[sp],w_p[0],w_p[1],w_p[2],mean_speed[i,sp]))
+            print("+=========================================================+")
+            total_plasma2=sum(plasma2[:,:,i,sp] for sp in range(bs.nspins) for i in range(n_fermi[sp]))
+            total_sigma=sum(sigma_tensor[:,:,i,sp] for sp in range(bs.nspins) for i in range(n_fermi[sp]))
+            w_p=np.sqrt(np.abs(np.diag(total_plasma2)))
+            print("| Total hbar w_p (eV):     {:6.3f} {:6.3f} {:6.3f}           |".format(w_p[0],w_p[1],w_p[2]))
+            print("| sigma (S/m), tau={:5.1f} fs: {:8.2e} {:8.2e} {:8.2e}   |".format(tau*1e15,total_sigma[0,0],total_sigma[1,1],total_sigma[2,2]))
+            print("+=========================================================+")
+            transport.write_json(seed+"_transport.json",seed,bs,n_ef,mean_speed,plasma2,sigma_tensor,tau)
+            print("Transport written to %s_transport.json"%seed)
+            print("+=========================================================+")
+
+        if dhva_dir is not None:
+            (dhva_dirs,dhva_angles,dhva_bands,orbits),_=cache.run("analysis",[unfold_key,"dhva",offset,dhva_dir,dhva_to,dhva_steps,dhva_planes],
+                                                                  lambda: pipeline.dhva_table(points,tets,bs,bril_zone,offset,dhva_dir,dhva_to,dhva_steps,dhva_planes))
+            dhva_labels=[(ids[i,sp],spin_names[sp]) for i,sp in dhva_bands]
+
+            print("|                       d H v A                           |")
+            print("+=========================================================+")
+            print("| Angle  Electron  Spin     F (T)     m*/m_e   Extremum   |")
+            print("+=========================================================+")
+            for a,res in zip(dhva_angles,orbits):
+                for (band_id,spin_name),band_orbits in zip(dhva_labels,res):
+                    for o in band_orbits:
+                        print("| {:5.1f}    {:04d}    {:>4s}  {:10.1f}   {:7.3f}     {:>3s}     |".format(a,band_id,spin_name,o["frequency"],o["mass"],o["extremum"]))
+            print("+=========================================================+")
+            dhva.write_json(seed+"_dhva.json",seed,dhva_angles,dhva_dirs,dhva_labels,orbits)
+            print("dHvA orbits written to %s_dhva.json"%seed)
+            if len(dhva_dirs)>1:
+                dhva.plot_sweep(seed+"_dhva.png",dhva_angles,dhva_labels,orbits)
+            print("+=========================================================+")
+
+        if path is not None and len(path_points)<2:
+            print('\033[93m'+"--path needs at least two points, no bands or nesting along the path.\u001b[0m")
+        elif path is not None:
+            # Bands along the path interpolated from the periodic grid, no separate band structure calculation needed
+            (k_path,k_dist,k_ticks,path_energy),_=cache.run("analysis",[unfold_key,"path",path_points],lambda: pipeline.band_path(bs,recip_latt,path_points))
+            path_names=[["%d %s"%(ids[i,sp],spin_names[sp]) for sp in range(bs.nspins)] for i in range(path_energy.shape[0])]
+            bandpath.plot(seed+"_path.png",k_dist,k_ticks,path_labels,path_energy,offset,path_names)
+            np.savez(seed+"_path.npz",kpoints=k_path,distance=k_dist,ticks=k_ticks,labels=path_labels,energy=path_energy,ids=ids[:,0:bs.nspins])
+            print("Bands along the path written to %s_path.png"%seed)
+            print("+=========================================================+")
+
+        if plot_nesting:
+            if path is not None:
+                q_corners,q_labels=path_points,path_labels
+            else:
+                q_corners,q_labels=bril_zone.bz_points,bril_zone.bz_labels
+            q_families=np.array(slice).reshape(-1,3) if plot_slice else np.array([[0,0,1]])
+            q_extent=np.max(np.linalg.norm(bril_zone.vertices,axis=1))
+            nesting_arrays,_=cache.run("analysis",[unfold_key,"nesting",offset,sigma,q_corners,q_families,q_extent],
+                                       lambda: pipeline.nesting_maps(bs,recip_latt,offset,sigma,q_corners,q_families,q_extent))
+            if "path" in nesting_arrays:
+                nesting.plot_path(seed+"_nesting_path.png",nesting_arrays["path_distance"],nesting_arrays["path_ticks"],q_labels,nesting_arrays["xi_path"],nesting_arrays["chi_path"])
+            for hkl,xi_map,chi_map in zip(q_families,nesting_arrays["xi_plane"],nesting_arrays["chi_plane"]):
+                nesting.plot_plane(seed+"_nesting_%i_%i_%i.png"%tuple(hkl),nesting_arrays["plane"],xi_map,chi_map,cmap=col)
+
+            np.savez(seed+"_nesting.npz",**nesting_arrays)
+            xi,chi,grid_n=nesting_arrays["xi"],nesting_arrays["chi"],nesting_arrays["grid"]
+            print("|                    N E S T I N G                        |")
+            print("+=========================================================+")
+            print("| Grid: {:3d} x {:3d} x {:3d}     chi(0): {:8.4f} states/eV    |".format(grid_n[0],grid_n[1],grid_n[2],chi[0,0,0]))
+            print("| Max. xi(q): {:9.4f}       Max. chi(q): {:8.4f}       |".format(np.max(xi),np.max(chi)))
+            print("+=========================================================+")
+            print("Nesting written to %s_nesting.npz"%seed)
+            print("+=========================================================+")
+
+        if arpes_window is not None:
+            a_families=np.array(slice).reshape(-1,3) if plot_slice else np.array([[0,0,1]])
+            (a_levels,a_kz,a_states,a_maps),_=cache.run("analysis",[unfold_key,"arpes",offset,arpes_window,arpes_points,arpes_width,arpes_kz,arpes_kz_steps,a_families,slice_offsets,slice_res,R_corr],
+                                                        lambda: pipeline.arpes_maps(interp,bs,recip_latt,border_mesh,offset,arpes_window,arpes_points,arpes_width,arpes_kz,arpes_kz_steps,a_families,slice_offsets,slice_res,R_corr))
+            print("|                       A R P E S                         |")
+            print("+=========================================================+")
+            print("| Energies: {:4d}   Window: {:7.3f} to {:7.3f} eV          |".format(arpes_points,arpes_window[0],arpes_window[1]))
+            print("| States: {:4d}     Width: {:6.3f} eV     kz planes: {:3d}    |".format(a_states,arpes_width,len(a_kz)))
+            print("+=========================================================+")
+            for a_family in a_maps:
+                hkl=a_family["hkl"]
+                family="%i_%i_%i"%(hkl[0],hkl[1],hkl[2])
+                for i,s_off in enumerate(slice_offsets):
+                    if a_family["outlines"][i] is None:
+                        continue
+                    if len(slice_offsets)>1:
+                        a_name=seed+"_arpes_"+family+"_%4.2f.png"%s_off
+                    else:
+                        a_name=seed+"_arpes_"+family+".png"
+                    arpes.plot_maps(a_name,a_family["x"],a_family["y"],a_family["maps"][i],a_levels-offset,outline=a_family["outlines"][i],cmap=col)
+                np.savez(seed+"_arpes_"+family+".npz",energies=a_levels-offset,offsets=np.array(slice_offsets),kz=a_kz,x=a_family["x"],y=a_family["y"],
+                         maps=a_family["maps"],normal=a_family["normal"],rotation=a_family["rotation"])
+                print("Constant energy maps written to %s_arpes_%s.npz"%(seed,family))
+            print("+=========================================================+")
 
         if pdos:
             
@@ -622,6 +861,13 @@ def main():
 
             
         
+        if export_h5 and dry:
+            # No surfaces are rendered in a dry run, so they come from the tetrahedra directly
+            h5_surfaces={key:(v,t,{}) for key,(v,t) in compare.surfaces(bs,bril_zone,np.array(interp.points),tets,offset).items()}
+            hdf5.write(seed+".h5",seed,bs,recip_latt,latt,offset,surfaces=h5_surfaces,symmetry=symmetry)
+            print("Bands and surfaces written to %s.h5"%seed)
+        h5_surfaces={}
+
         if dry:
             sys.exit()
         nspins=range(bs.nspins)
@@ -637,106 +883,109 @@ def main():
 
         if plot_slice:
 
-            fig = plt.figure(figsize=(9,9))
-            ax = fig.add_subplot(111)
-            ax.set_aspect('equal')
-            
-            # Calculte norm
-            norm=slice[0]*recip_latt.T[:,0]+slice[1]*recip_latt.T[:,1]+slice[2]*recip_latt.T[:,2]
-            norm=norm/np.linalg.norm(norm)
-            
-            v_R=np.cross(norm,np.array([0,0,1]))
-            s_R=np.linalg.norm(v_R)
-            c_R=np.dot(norm,np.array([0,0,1]))
-            skew_R=skew(v_R)
-            
-            R=np.identity(3)+skew_R+np.dot(skew_R,skew_R)*(1-c_R)/(s_R**2)
-            
-            if (v_R==0).all():
-                R=np.identity(3)
-            
-            # Calculate the rotation for prettyness (project kx onto plane and rotate to y)
-            kx= recip_latt.T[:,0]/np.linalg.norm(recip_latt.T[:,0])
-            plane_vec=np.matmul(R,kx-np.dot(kx,norm)*norm)
+            # Every plane of a family shares its rotation, each offset along the normal is a panel
+            slice_planes=[]
+            slice_figs=[]
+            for hkl in np.array(slice).reshape(-1,3):
+                norm,R=slices.rotation(hkl,recip_latt,R_corr)
+                g_len=np.linalg.norm(np.matmul(recip_latt.T,hkl))
+                fig,axes=plt.subplots(1,len(slice_offsets),figsize=(9*len(slice_offsets),9),squeeze=False)
+                slice_figs.append((fig,hkl))
 
-            if (slice==np.array([1,0,0])).all():
-                direction=np.array([0,1,0])
-            else:
-                direction=np.array([1,0,0])
-            
-            v_P=np.cross(plane_vec,direction)
-            s_P=np.linalg.norm(v_P)
-            c_P=np.dot(plane_vec,direction)
-            skew_P=skew(v_P)
+                for ax,s_off in zip(axes[0],slice_offsets):
+                    ax.set_aspect('equal')
+                    ax.axis("off")
+                    origin=s_off*g_len*norm
 
-            R_P=np.identity(3)+skew_P+np.dot(skew_P,skew_P)*(1-c_P)/(s_P**2)
+                    outline=slices.outline(border_mesh,norm,R,origin)
+                    if outline is None:
+                        print('\033[93m'+"Slice (%i %i %i) at %4.2f does not cut the Brillouin zone.\u001b[0m"%(hkl[0],hkl[1],hkl[2],s_off))
+                        continue
 
+                    ax.plot(outline[:,0], outline[:,1], 'k-', lw=2)
+                    connect=outline[[0,-1]]
+                    ax.plot(connect[:,0],connect[:,1], 'k-', lw=2)
+                    ax.set_xlim(1.05*np.min(outline[:,0]),1.05*np.max(outline[:,0]))
+                    ax.set_ylim(1.05*np.min(outline[:,1]),1.05*np.max(outline[:,1]))
+                    if len(slice_offsets)>1:
+                        ax.set_title("%4.2f"%s_off,fontsize=22)
 
-            if (v_P==0).all() or abs(np.linalg.det(R_P))<0.001:
+                    #do the special point labels
 
-                R_P=np.identity(3)
 
-            
-            R=np.matmul(R_P,R)
-            R=np.matmul(R_corr,R)
-            
+                    for li,L in enumerate(bril_zone.bz_points):
 
-            plane=pv.Plane(center=[0,0,0],direction=norm)
-            plane=plane.triangulate()
+                        if abs(np.dot(norm,L)-s_off*g_len)<0.001:
 
-            border=verts.triangulate()
-            border=border.intersection(plane)[0]
+                            point=np.matmul(R,L)
+                            ax.text(point[0],point[1],bril_zone.bz_labels[li],fontsize=22)
+                            ax.scatter(point[0],point[1],marker='s',c='k',zorder=2)
 
-            outline=np.array(border.points)
+                    slice_planes.append({"ax":ax,"norm":norm,"R":R,"origin":origin,"outline":outline})
 
-            
-
-            for i in range(len(outline)):
-                outline[i]=np.matmul(R,outline[i])
-                
-
-            outline=outline[:,0:2]
-            hull = ConvexHull(outline)
-        
-            ax.plot(outline[hull.vertices,0], outline[hull.vertices,1], 'k-', lw=2)
-            outline=outline[hull.vertices,:]
-            connect=outline[[0,-1]]
-            ax.plot(connect[:,0],connect[:,1], 'k-', lw=2)
-            ax.axis("off")
-            ax.set_xlim(1.05*np.min(outline[:,0]),1.05*np.max(outline[:,0]))
-            ax.set_ylim(1.05*np.min(outline[:,1]),1.05*np.max(outline[:,1]))
 
-            #do the special point labels
-
-
-            for li,L in enumerate(bril_zone.bz_points):
-
-                if abs(np.linalg.norm(np.dot(norm,L)))<0.001:
-                    
-                    point=np.matmul(R,L)
-                    ax.text(point[0],point[1],bril_zone.bz_labels[li],fontsize=22)
-                    ax.scatter(point[0],point[1],marker='s',c='k',zorder=2)
 
 
+        # get the indices to plot
+        if n_surf!=None:
+            n_surf=np.array(n_surf,dtype=int)
+        else:
+            n_surf=range(np.max(n_fermi))
+
+        # Arrays that are moved from the mesh onto the surfaces
+        surface_fields={}
+        if holes:
+            surface_fields["Energy Gradient"]=grid["e_grad"]
+        elif velocity:
+            surface_fields["Fermi Velocity (m/s)"]=grid["fermi_vel"]
+        elif mass:
+            surface_fields["Effective Mass (m_e)"]=grid["band_mass"]
+        elif exchange:
+            surface_fields["Exchange Splitting (eV)"]=band_split
+        elif pdos:
+            # Colours are set on the mesh so they can be probed onto the surface, only the up spin weights are read
+            cmap_array=np.zeros((len(kpoints),4)+ids.shape)
+            for spin in nspins:
+                for band in range(n_fermi[spin]):
+                    for n in range(n_cat):
+                        cmap_array[:,0:3,band,spin]+=np.outer(pdos_weights[n,ids[band,spin],:,0],basis[n,0:3])
+            cmap_array[:,3]=1
+            surface_fields["pdos"]=np.where(cmap_array>1,1,cmap_array)
+
+        # Array each surface is coloured by, recorded with exported meshes so they can be drawn the same way
+        surface_scalars=None
+        if holes:
+            surface_scalars="Carrier"
+        elif velocity or mass or exchange or pdos:
+            surface_scalars=list(surface_fields)[0]
+        elif plot_topology:
+            surface_scalars="Pocket"
+
+        surfaces={}
+        attributed={}
+        if not plot_slice:
+            # Stage surface: only depends on the mesh, so it is keyed on the unfolded bands and not on the fields of the grid
+            band_list=[(band,spin) for spin in nspins for band in range(0,n_fermi[spin]) if band in n_surf]
+            surfaces,surface_key=cache.run("surface",[unfold_key,offset,band_list,smooth,refine,prim],
+                                           lambda: pipeline.surface(interp,tets,energy,offset,band_list,smooth,refine,grid.get("e_grad"),None if prim else bril_zone))
+            # Stage attribute: the surfaces and grid keys cover the fields, the pdos weights come from their own file
+            attribute_inputs=[surface_key,grid_key,list(surface_fields),plot_topology,holes]
+            if pdos:
+                attribute_inputs+=[species,basis,pipeline.file_digest([seed+".pdos_bin"])]
+            attributed,attribute_key=cache.run("attribute",attribute_inputs,
+                                               lambda: pipeline.attribute(interp,surfaces,surface_fields,recip_latt,band_pockets if plot_topology else None,holes))
 
-
-        cloud=pv.PolyData(bs.kpoints)
-            
-        interp = cloud.delaunay_3d(alpha=100,progress_bar=verbose)
-        total_vol=interp.volume
-
+        if plot_slice:
+            # The cut, its projection and triangulation of each plane are the same for every band, so they are done once
+            interp.point_arrays["slice_energy"]=np.moveaxis(energy,1,0).reshape(len(interp.points),-1)
+            for plane in slice_planes:
+                plane["x"]=np.linspace(np.min(plane["outline"]),np.max(plane["outline"]),slice_res)
+                plane["y"]=np.linspace(np.min(plane["outline"]),np.max(plane["outline"]),slice_res)
+                (cut_energy,),plane["weights"]=slices.cut(interp,plane["origin"],plane["norm"],plane["R"],plane["x"],plane["y"],["slice_energy"])
+                plane["energy"]=cut_energy.reshape((-1,)+energy.shape[0:1]+energy.shape[2:])
+
+        # Stage render: never cached, every styling option only acts from here on
         for spin in nspins:
-
-            #Extract all the right stuf
-
-
-            
-            # get the indices to plot
-            if n_surf!=None:
-                n_surf=np.array(n_surf,dtype=int)
-            else:
-                n_surf=range(np.max(n_fermi))
-
             for band in range(0,n_fermi[spin]):
                 
                 c=next(colours)
@@ -752,62 +1001,39 @@ def main():
                 op=next(opacity)
                 if band in n_surf:
 
-                    interp.point_arrays["values"]=energy[band,:,spin]
                     if not plot_slice:
-                        contours=interp.contour([offset],scalars="values")                
-                        contours=contours.smooth(n_iter=smooth)
-
+                        if (band,spin) not in attributed:
+                            continue
+                        contours,pocket_type=attributed[(band,spin)]
+                        if export_h5:
+                            h5_surfaces[(band,spin)]=(np.array(contours.points),pockets.triangles(contours)[1],
+                                                      {name:np.array(contours.point_arrays[name]) for name in contours.point_arrays.keys() if name!="values"})
                     
-                        if not prim:
-                            for face in bril_zone.bz_vert:
-                                origin=face[0][0]
-                                direction=face[1]
-                                contours=contours.clip(origin=origin,normal=direction)
-                    
-                        cont_vol=contours.volume
-                        surf_vol=100*cont_vol/total_vol
+                        # Size of the pocket as a percentage of the zone, electron or hole like
+                        surf_vol=100*min(occupation[band,spin],1-occupation[band,spin])
                         if verbose:
-                            print("%2d  up    %2.3f %% " %(band,surf_vol))
+                            print("%2d  %4s  %2.3f %% " %(band,spin_names[spin],surf_vol))
+                            if holes:
+                                print("%2d  %4s  %d electron, %d hole pockets" %(band,spin_names[spin],np.sum(pocket_type>0),np.sum(pocket_type<0)))
 
 
                         if surf_vol<5 and smooth>10:
-                            print('\033[93m'+"Small Fermi surfaces may become distorted with large 'smooth' parameter, consider reducing.\u001b[0m")
-
-                    if plot_slice:
-
-                        p_slice=interp.slice(normal=norm).delaunay_2d()#.smooth(smooth)
-                        p.add_mesh(p_slice)
-                        val=np.array(p_slice['values'])
-                        proj_points=np.array(p_slice.points)
-
-
-                        for i in range(len(proj_points)):
-                            proj_points[i]=np.matmul(R,proj_points[i])
+                            print('\033[93m'+"Small Fermi surfaces may become distorted with large 'smooth' parameter, consider reducing or using --refine.\u001b[0m")
 
+                        if export_mesh is not None:
+                            mesh_manifest.append(meshes.write_surface(mesh_dir,"band_%04d_%s"%(ids[band,spin],spin_names[spin]),contours,mesh_formats,
+                                                                      scalars=surface_scalars,rgb=pdos,cmap=col,color=c,
+                                                                      band=int(ids[band,spin]),spin=spin_names[spin],opacity=op))
 
-                        proj_points=proj_points[:,0:2]
-                        X,Y=proj_points[:,0],proj_points[:,1]
-                        cmap=plt.get_cmap('viridis')
-
-                        
-
-                        f = LinearNDInterpolator(proj_points,val)
-
-                        N=300                    
-                        x_coords = np.linspace(np.min(outline),np.max(outline),N)
-                        y_coords = np.linspace(np.min(outline),np.max(outline),N)
-
-                        Z=np.ones((N,N))
-                        for i in range(N):
-                            for j in range(N):
-                                Z[j,i]=f(x_coords[i],y_coords[j])
+                    if plot_slice:
 
-                        Z = np.nan_to_num(Z,nan=1)        
                         if holes:
                             order=0
                         else:
                             order=1
-                        cs=ax.contour(x_coords,y_coords,Z,0,colors=c,zorder=order)
+                        for plane in slice_planes:
+                            Z=slices.resample(plane["energy"][:,band,spin],*plane["weights"],(slice_res,slice_res))
+                            cs=plane["ax"].contour(plane["x"],plane["y"],Z,[offset],colors=[c],zorder=order)
                         
                         '''
                         if holes:
@@ -847,98 +1073,43 @@ def main():
                                 ax.plot(path_points[:,0],path_points[:,1],color=elec_hole,zorder=0)
                            '''     
                     elif holes:
-                        grad=interp.compute_derivative(scalars="values")
-                        grad=grad.compute_derivative(scalars='gradient',divergence=True)
-                        #grad['divergence']=np.sign(grad['divergence'])
-                        contours=contours.interpolate(grad,radius=max_spacing)
-                        div=np.sum(contours['divergence'])
-
-                        if div<0:
-                            #hole
-                            elec_hole='blue'
-                        else:
-                            #electron
-                            elec_hole='red'
-                        if supercell!=None:
-                            trans(contours,color=elec_hole)
-                        else:
-                            p.add_mesh(contours,color=elec_hole,smooth_shading=True,show_scalar_bar=False,lighting=True,pickable=False,specular=specular,specular_power=specular_power,ambient=ambient,diffuse=diffuse,opacity=op)
+                        for n in range(len(pocket_type)):
+                            if pocket_type[n]<0:
+                                #hole
+                                elec_hole='blue'
+                            else:
+                                #electron
+                                elec_hole='red'
+                            pocket=contours.extract_points(contours.point_arrays["RegionId"]==n,adjacent_cells=False).extract_surface()
+                            if supercell!=None:
+                                trans(pocket,color=elec_hole)
+                            else:
+                                p.add_mesh(pocket,color=elec_hole,smooth_shading=True,show_scalar_bar=False,lighting=True,pickable=False,specular=specular,specular_power=specular_power,ambient=ambient,diffuse=diffuse,opacity=op)
                         
 
                     elif velocity:
-
-                        grad=interp.compute_derivative(scalars="values")
-                        grad['Fermi Velocity (m/s)']=np.sqrt(np.sum(grad['gradient']**2,axis=1))*1.6e-19*1e-10/(1.05e-34)
-
-                        std=np.std(grad['Fermi Velocity (m/s)'])
-                        mean=np.mean(grad['Fermi Velocity (m/s)'])
-                        above=np.where(grad['Fermi Velocity (m/s)']>mean+1*std)[0]
-                        grad['Fermi Velocity (m/s)'][above]=0#mean+1*std
-                        contours=contours.interpolate(grad,radius=max_spacing)
-
                         if supercell!=None:
                             trans(contours,scalars="Fermi Velocity (m/s)",cmap=col,scale_bar=True)
                         
                         else:
                             p.add_mesh(contours,scalars="Fermi Velocity (m/s)",cmap=col,smooth_shading=True,show_scalar_bar=True,lighting=True,pickable=False,specular=specular,specular_power=specular_power,ambient=ambient,diffuse=diffuse,opacity=op)
-                    #elif mass:
-                    #    grad=interp.compute_derivative(scalars="values")
-                    #    grad2=grad.compute_derivative(scalars="gradient")
-                    #    grad2['Effective Mass']=grad2['gradient']#np.sqrt(np.sum(grad['gradient']**2,axis=1))*1.6e-19*1e-10/(1.05e-34)
-
-                        #std=np.std(grad['Fermi Velocity (m/s)'])
-                        #mean=np.mean(grad['Fermi Velocity (m/s)'])
-                        #above=np.where(grad['Fermi Velocity (m/s)']>mean+1*std)[0]
-                        #grad['Fermi Velocity (m/s)'][above]=0#mean+1*std
-                        #contours=contours.interpolate(grad2,radius=max_spacing)
-                        
-                        #p.add_mesh(contours,scalars="Effective Mass",cmap=col,smooth_shading=True,show_scalar_bar=True,lighting=True,pickable=False,specular=specular,specular_power=specular_power,ambient=ambient,diffuse=diffuse,opacity=op)
-                        
-                    elif pdos:
-                        cmap_array=np.zeros((len(kpoints),4))
-                        kpoint_pick=924
-
-                        for n in range(n_cat):
-                            cmap_array[:,0]+=pdos_weights[n,ids[band,spin],:,0]*basis[n,0]
-                            cmap_array[:,1]+=pdos_weights[n,ids[band,spin],:,0]*basis[n,1]
-                            cmap_array[:,2]+=pdos_weights[n,ids[band,spin],:,0]*basis[n,2]
-
-                            
-                        
-                        cmap_array[:,3]=1
-                        max=np.max(cmap_array[:,0:3],axis=1)
-                        max_array=np.zeros((len(kpoints),3))
-                        max_array[:,0]=max
-                        max_array[:,1]=max
-                        max_array[:,2]=max
-                        #cmap_array[:,0:3]=cmap_array[:,0:3]/max_array
-                        
-                        cmap_array=np.where(cmap_array>1,1,cmap_array)
-
+                    elif mass:
+                        # Masses diverge where the band is flat, so the colour range excludes the extremes
+                        clim=np.nanpercentile(np.where(np.isfinite(contours["Effective Mass (m_e)"]),contours["Effective Mass (m_e)"],np.nan),[5,95])
+                        if supercell!=None:
+                            trans(contours,scalars="Effective Mass (m_e)",cmap=col,scale_bar=True,clim=clim)
+                        else:
+                            p.add_mesh(contours,scalars="Effective Mass (m_e)",cmap=col,clim=clim,smooth_shading=True,show_scalar_bar=True,lighting=True,pickable=False,specular=specular,specular_power=specular_power,ambient=ambient,diffuse=diffuse,opacity=op)
 
-                        interp.point_arrays["pdos"]=cmap_array
-                        
+                    elif exchange:
+                        # One symmetric colour range for every band and spin so the channels can be compared
+                        clim=[-split_lim,split_lim]
+                        if supercell!=None:
+                            trans(contours,scalars="Exchange Splitting (eV)",cmap=col,scale_bar=True,clim=clim)
+                        else:
+                            p.add_mesh(contours,scalars="Exchange Splitting (eV)",cmap=col,clim=clim,smooth_shading=True,show_scalar_bar=True,lighting=True,pickable=False,specular=specular,specular_power=specular_power,ambient=ambient,diffuse=diffuse,opacity=op)
 
-                        #for kpoint_pick in range(0,len(kpoints),5):
-                        #print("PDOS:",pdos_weights[:,ids[band,spin],kpoint_pick,spin])
-                        #print("CMAP_ARRAY:",cmap_array[kpoint_pick])
-                        #print("z:",z[kpoint_pick])
-                        #print(cmap(z[kpoint_pick]))
-                        #print()
-                        #p.add_mesh(pv.Sphere(0.01,kpoints[kpoint_pick]),color=cmap(z[kpoint_pick])) 
-                        
-                        #sys.exit()
-                        
-                        contours=interp.contour([offset],scalars="values")
-                        contours=contours.smooth(n_iter=smooth)
-                        if not prim:
-                            for face in bril_zone.bz_vert:
-                                origin=face[0][0]
-                                direction=face[1]
-                                contours=contours.clip(origin=origin,normal=direction)
-                        clim=100*[np.min(contours['pdos']),np.max(contours['pdos'])]
-                                
-                                
+                    elif pdos:
                         #p.add_mesh(contours,scalars="pdos",clim=clim,cmap=cmap,smooth_shading=True,show_scalar_bar = True,lighting=True,pickable=False,specular=specular,specular_power=specular_power,ambient=ambient,diffuse=diffuse,opacity=op)
                         if  supercell!=None:
 
@@ -950,6 +1121,12 @@ def main():
                         
                         #p.add_mesh_slice(interp,show_scalar_bar=False,cmap='Oranges',show_edges=False,implicit=False)
                         
+                    elif plot_topology:
+                        if supercell!=None:
+                            trans(contours,scalars="Pocket",cmap=col)
+                        else:
+                            p.add_mesh(contours,scalars="Pocket",cmap=col,categories=True,smooth_shading=True,show_scalar_bar=False,lighting=True,pickable=False,specular=specular,specular_power=specular_power,ambient=ambient,diffuse=diffuse,opacity=op)
+
                     else:
                         if  supercell!=None:
                             trans(contours)
@@ -957,7 +1134,51 @@ def main():
 
                             p.add_mesh(contours,color=c[0:3],smooth_shading=True,show_scalar_bar = False,lighting=True,pickable=False,specular=specular,specular_power=specular_power,ambient=ambient,diffuse=diffuse,opacity=op)
 
-    
+
+        if export_h5:
+            hdf5.write(seed+".h5",seed,bs,recip_latt,latt,offset,surfaces=h5_surfaces,symmetry=symmetry)
+            print("Bands and surfaces written to %s.h5"%seed)
+
+        if export_mesh is not None:
+            meshes.write_manifest(mesh_dir,{"seed":seed,"isovalue":offset,"primitive":prim,"surfaces":mesh_manifest})
+            print("Surfaces written to %s/"%mesh_dir)
+
+    # Nothing is drawn in a dry run, including an insulator or one without --fermi
+    if dry:
+        sys.exit()
+
+    if from_mesh is not None:
+        # Restyling only draws the saved surfaces, colours and opacities come from this run
+        mesh_info,cached=meshes.read(from_mesh)
+        if mesh_info["primitive"]!=prim:
+            print('\033[93m'+"Surfaces in %s were made %s the primitive cell.\u001b[0m"%(from_mesh,"for" if mesh_info["primitive"] else "without"))
+        split_lim=max([np.nanmax(np.abs(m["Exchange Splitting (eV)"])) for e,m in cached if e["scalars"]=="Exchange Splitting (eV)"],default=0)
+        for entry,contours in cached:
+            c=next(colours)
+            if color_spin:
+                c=[1.,0.,0.,1.] if entry["spin"]=="up" else [0.,0.,1.,1.]
+            op=next(opacity)
+            style=dict(smooth_shading=True,lighting=True,pickable=False,specular=specular,specular_power=specular_power,ambient=ambient,diffuse=diffuse,opacity=op)
+            scalars=entry["scalars"]
+            if scalars is None:
+                mesh_args=dict(color=c[0:3],show_scalar_bar=False)
+            elif entry["rgb"]:
+                mesh_args=dict(scalars=scalars,rgb=True,show_scalar_bar=False)
+            elif scalars=="Carrier":
+                mesh_args=dict(scalars=scalars,cmap=['blue','red'],clim=[-1,1],show_scalar_bar=False)
+            elif scalars=="Pocket":
+                mesh_args=dict(scalars=scalars,cmap=col,categories=True,show_scalar_bar=False)
+            elif scalars=="Effective Mass (m_e)":
+                mesh_args=dict(scalars=scalars,cmap=col,clim=np.nanpercentile(np.where(np.isfinite(contours[scalars]),contours[scalars],np.nan),[5,95]),show_scalar_bar=True)
+            elif scalars=="Exchange Splitting (eV)":
+                mesh_args=dict(scalars=scalars,cmap=col,clim=[-split_lim,split_lim],show_scalar_bar=True)
+            else:
+                mesh_args=dict(scalars=scalars,cmap=col,show_scalar_bar=True)
+            if supercell!=None:
+                trans(contours,rgb=mesh_args.get("rgb",False),cmap=mesh_args.get("cmap"),scalars=scalars,scale_bar=mesh_args["show_scalar_bar"],clim=mesh_args.get("clim"))
+            else:
+                p.add_mesh(contours,**mesh_args,**style)
+
     p.window_size = 1000, 1000
     
     if prim:
@@ -1047,9 +1268,11 @@ def main():
     print("Time %3.3f s"%end_time)
 
     if plot_slice:
-        mask_outside_polygon(list(outline),ax)
+        for plane in slice_planes:
+            mask_outside_polygon(list(plane["outline"]),plane["ax"])
         if save:
-            plt.savefig(seed+"_slice_%i_%i_%i.png"%(slice[0],slice[1],slice[2]))
+            for fig,hkl in slice_figs:
+                fig.savefig(seed+"_slice_%i_%i_%i.png"%(hkl[0],hkl[1],hkl[2]))
         else:
             plt.show(block=True)
         
@@ -1058,9 +1281,13 @@ def main():
             p.ren_win.SetOffScreenRendering(1)
             p.window_size=[3000,3000]
 
-            p.show(title=seed,screenshot=seed+"_BZ.png")
+            p.show(title=seed,screenshot=seed+"_BZ.png",auto_close=not export_gltf)
         else:
             p.show(title=seed,auto_close=False)
+        if export_gltf:
+            # The whole scene, zone included, as one file
+            p.export_gltf(os.path.join(mesh_dir,seed+".gltf"))
+            print("Scene written to %s"%os.path.join(mesh_dir,seed+".gltf"))
             
         if verbose:
             print("Final Camera Position:")
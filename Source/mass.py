@@ -0,0 +1,66 @@
+import numpy as np
+from Source import tetra
+from Source import nesting
+
+# Converts hbar^2/(d^2E/dk^2) with the curvature in eV*Angstrom^2 (k without the 2pi) to units of m_e
+mass_conv=tetra.hbar**2*(2*np.pi)**2/(tetra.e_charge*1e-20*tetra.m_e)
+
+
+def grid_hessians(grid,recip_latt):
+    '''Cartesian Hessians of the energies on the periodic grid by central differences, shape (band,spin,3,3,n1,n2,n3).
+
+    grid is the (band,spin,n1,n2,n3) array from nesting.periodic_grid. All bands and spins are
+    differenced together with periodic shifts of the grid, in fractional coordinates, and then
+    rotated into Cartesian coordinates.'''
+    n=np.array(grid.shape[2:])
+    h_frac=np.zeros(grid.shape[0:2]+(3,3)+grid.shape[2:])
+    for a in range(3):
+        ax=2+a
+        h_frac[:,:,a,a]=(np.roll(grid,-1,axis=ax)-2*grid+np.roll(grid,1,axis=ax))*n[a]**2
+        for b in range(a+1,3):
+            bx=2+b
+            plus=np.roll(grid,-1,axis=ax)
+            minus=np.roll(grid,1,axis=ax)
+            h_frac[:,:,a,b]=(np.roll(plus,-1,axis=bx)-np.roll(plus,1,axis=bx)
+                             -np.roll(minus,-1,axis=bx)+np.roll(minus,1,axis=bx))*n[a]*n[b]/4
+            h_frac[:,:,b,a]=h_frac[:,:,a,b]
+
+    # d/dk_i = sum_a inv(B)_ia d/df_a for fractional coordinates f=k.inv(B)
+    b_inv=np.linalg.inv(recip_latt)
+    return np.einsum('ia,nsab...,jb->nsij...',b_inv,h_frac,b_inv)
+
+
+def energy_hessians(kpoints,recip_latt,energy):
+    '''Hessians of the BandStructure energies (band,kpoint,spin) at the kpoints, shape (kpoint,3,3,band,spin)'''
+    grid,n,shift=nesting.periodic_grid(kpoints,recip_latt,energy)
+    hess=grid_hessians(grid,recip_latt)
+    index=nesting.grid_index(kpoints,recip_latt,n,shift)
+    return np.moveaxis(hess[:,:,:,:,index[:,0],index[:,1],index[:,2]],-1,0).transpose(0,3,4,1,2)
+
+
+def effective_masses(hess,direction=None,principal=None):
+    '''Effective mass in units of m_e from Hessians (kpoint,3,3,band,spin), shape (kpoint,band,spin).
+
+    With a direction this is the mass for motion along it, with principal="light" or "heavy" the principal
+    mass of smallest or largest magnitude, otherwise the harmonic mean of the principal masses, 3/tr(M^-1).
+    Points with no curvature are given an infinite mass.'''
+    if principal is not None:
+        masses=principal_masses(hess)
+        order=np.argsort(np.abs(masses),axis=1)
+        pick=order[:,0:1] if principal=="light" else order[:,-1:]
+        return np.take_along_axis(masses,pick,axis=1)[:,0]
+    if direction is None:
+        curvature=np.trace(hess,axis1=1,axis2=2)/3
+    else:
+        d=np.array(direction,dtype=float)
+        d=d/np.linalg.norm(d)
+        curvature=np.einsum('i,kij...,j->k...',d,hess,d)
+    with np.errstate(divide='ignore'):
+        return mass_conv/curvature
+
+
+def principal_masses(hess):
+    '''Principal effective masses in units of m_e, from the eigenvalues of the Hessians, shape (kpoint,3,band,spin)'''
+    eig=np.linalg.eigvalsh(np.moveaxis(hess,(1,2),(-2,-1)))
+    with np.errstate(divide='ignore'):
+        return np.moveaxis(mass_conv/eig,-1,1)
@@ -0,0 +1,49 @@
+import os
+import json
+import numpy as np
+import pyvista as pv
+from matplotlib import colors
+import matplotlib.pyplot as plt
+
+manifest_name="manifest.json"
+
+
+def bake_colours(mesh,scalars=None,rgb=False,cmap='viridis',clim=None,color=None):
+    '''RGB colours (0-255) of every point of a surface as it is drawn, for formats without colour maps'''
+    if scalars is None:
+        rgba=np.tile(colors.to_rgba(color if color is not None else 'grey'),(mesh.n_points,1))
+    elif rgb:
+        rgba=np.array(mesh.point_arrays[scalars])
+    else:
+        values=np.array(mesh.point_arrays[scalars],dtype=float)
+        if clim is None:
+            clim=[np.nanmin(values),np.nanmax(values)]
+        norm=colors.Normalize(vmin=clim[0],vmax=clim[1])
+        rgba=plt.get_cmap(cmap)(norm(values))
+    return np.round(255*np.clip(rgba[:,0:3],0,1)).astype(np.uint8)
+
+
+def write_surface(directory,name,mesh,formats=("vtp",),scalars=None,rgb=False,cmap='viridis',clim=None,color=None,**info):
+    '''Save a surface with all of its point arrays as <name>.vtp in directory, and as PLY with the colours baked in
+    if asked. Returns its manifest entry, info is stored with it (band, spin, opacity ...).'''
+    mesh.save(os.path.join(directory,name+".vtp"))
+    if "ply" in formats:
+        mesh.save(os.path.join(directory,name+".ply"),texture=bake_colours(mesh,scalars,rgb,cmap,clim,color))
+    entry={"file":name+".vtp","scalars":scalars,"rgb":bool(rgb)}
+    if color is not None:
+        entry["color"]=[float(x) for x in colors.to_rgba(color)]
+    entry.update(info)
+    return entry
+
+
+def write_manifest(directory,manifest):
+    '''Write the description of the saved surfaces, needed to render them again'''
+    with open(os.path.join(directory,manifest_name),'w') as f:
+        json.dump(manifest,f,indent=2)
+
+
+def read(directory):
+    '''Manifest of a mesh directory and the surfaces it lists, as a list of (entry,mesh)'''
+    with open(os.path.join(directory,manifest_name),'r') as f:
+        manifest=json.load(f)
+    return manifest,[(entry,pv.read(os.path.join(directory,entry["file"]))) for entry in manifest["surfaces"]]
@@ -0,0 +1,184 @@
+import numpy as np
+from scipy.ndimage import map_coordinates
+
+
+def _grid_axis(frac,max_n=200,tol=0.05):
+    '''Smallest Monkhorst-Pack size and offset (0 or 0.5) that the fractional coordinates lie on'''
+    for n in range(1,max_n+1):
+        for shift in [0.,0.5]:
+            x=frac*n-shift
+            if np.max(np.abs(x-np.round(x)))<tol:
+                return n,shift
+    raise Exception("K-points do not lie on a regular grid")
+
+
+def grid_index(kpoints,recip_latt,n,shift):
+    '''Indices of the Cartesian kpoints on the periodic grid of size n and offset shift, shape (kpoint,3)'''
+    frac=np.matmul(kpoints,np.linalg.inv(recip_latt))
+    return np.mod(np.round(frac*n-shift).astype(int),n)
+
+
+def periodic_grid(kpoints,recip_latt,energy):
+    '''Place the unfolded energies on the periodic Monkhorst-Pack grid of the reciprocal cell.
+
+    energy is the BandStructure array (band,kpoint,spin), the result is (band,spin,n1,n2,n3)
+    together with the grid size and offset. Grid points without a kpoint are filled from the
+    nearest filled grid point.'''
+    frac=np.matmul(kpoints,np.linalg.inv(recip_latt))
+    n=np.zeros(3,dtype=int)
+    shift=np.zeros(3)
+    for a in range(3):
+        n[a],shift[a]=_grid_axis(frac[:,a])
+
+    index=grid_index(kpoints,recip_latt,n,shift)
+    grid=np.full((energy.shape[0],energy.shape[2],n[0],n[1],n[2]),np.nan)
+    grid[:,:,index[:,0],index[:,1],index[:,2]]=np.moveaxis(energy,1,2)
+
+    missing=np.isnan(grid[0,0])
+    if missing.any():
+        filled=np.where(~missing)
+        for i,j,k in zip(*np.where(missing)):
+            d=np.abs(filled[0]-i)+np.abs(filled[1]-j)+np.abs(filled[2]-k)
+            m=np.argmin(d)
+            grid[:,:,i,j,k]=grid[:,:,filled[0][m],filled[1][m],filled[2][m]]
+    return grid,n,shift
+
+
+def _delta(x,sigma):
+    '''Gaussian broadened delta function'''
+    return np.exp(-(x/sigma)**2)/(sigma*np.sqrt(np.pi))
+
+
+def _fermi(x,sigma):
+    '''Fermi-Dirac occupation with smearing sigma'''
+    return 0.5*(1-np.tanh(0.5*x/sigma))
+
+
+def nesting_function(grid,level=0.,sigma=0.05,spin_degen=2):
+    '''Nesting function xi(q) = 1/N sum_k sum_nm delta(e_nk) delta(e_m,k+q) on the periodic grid, in states^2/eV^2/cell.
+
+    grid is the (band,spin,n1,n2,n3) array from periodic_grid, the cross-correlation over k is done
+    with FFTs so the cost is O(N log N) in the number of kpoints.'''
+    n_k=np.prod(grid.shape[2:])
+    xi=np.zeros(grid.shape[2:])
+    for s in range(grid.shape[1]):
+        d=np.sum(_delta(grid[:,s]-level,sigma),axis=0)
+        f=np.fft.fftn(d)
+        xi+=np.real(np.fft.ifftn(np.conj(f)*f))/n_k
+    return spin_degen*xi
+
+
+def lindhard(grid,level=0.,sigma=0.05,window=1.,n_bins=80,spin_degen=2):
+    '''Static Lindhard susceptibility chi(q) = 1/N sum_k sum_nm (f(e_nk)-f(e_m,k+q))/(e_m,k+q-e_nk) in states/eV/cell.
+
+    States within window (eV) of the level are assigned to n_bins energy bins with linear weights.
+    The susceptibility is then a sum of cross-correlations of the bin occupancies weighted by the
+    Lindhard kernel between bin energies. All correlations are formed in Fourier space, so only
+    n_bins forward FFTs and one inverse FFT are needed.'''
+    n_k=np.prod(grid.shape[2:])
+    bins=np.linspace(level-window,level+window,n_bins)
+    de=bins[1]-bins[0]
+
+    # Lindhard kernel between the bin energies, the diagonal is -df/dE
+    e1=bins[:,np.newaxis]
+    e2=bins[np.newaxis,:]
+    with np.errstate(divide='ignore',invalid='ignore'):
+        kernel=(_fermi(e1-level,sigma)-_fermi(e2-level,sigma))/(e2-e1)
+    kernel[np.diag_indices(n_bins)]=1/(4*sigma*np.cosh(0.5*(bins-level)/sigma)**2)
+
+    chi=np.zeros(grid.shape[2:])
+    k_index=tuple(np.indices(grid.shape[2:]))
+    for s in range(grid.shape[1]):
+        # Linear weights of each state on the two nearest bins
+        x=(grid[:,s]-bins[0])/de
+        inside=(x>=0)&(x<=n_bins-1)
+        lo=np.clip(np.floor(x).astype(int),0,n_bins-2)
+        w=np.where(inside,x-lo,0.)
+        occ=np.zeros((n_bins,)+grid.shape[2:])
+        for b in range(grid.shape[0]):
+            np.add.at(occ,(lo[b],)+k_index,np.where(inside[b],1-w[b],0.))
+            np.add.at(occ,(lo[b]+1,)+k_index,w[b])
+
+        f=np.fft.fftn(occ,axes=(1,2,3))
+        g=np.tensordot(kernel,f,axes=([1],[0]))
+        chi+=np.real(np.fft.ifftn(np.sum(np.conj(f)*g,axis=0)))/n_k
+    return spin_degen*chi
+
+
+def sample(field,recip_latt,qpoints,order=1,shift=0.):
+    '''Periodic interpolation of a grid field at Cartesian q-points, trilinear by default or a spline of the given order.
+    shift is the grid offset from periodic_grid, zero for fields on q-grids.'''
+    n=np.array(field.shape)
+    frac=np.matmul(np.atleast_2d(qpoints),np.linalg.inv(recip_latt))
+    coords=(frac*n-shift).T
+    return map_coordinates(field,coords,order=order,mode='grid-wrap')
+
+
+def path(points,n_points=200):
+    '''Cartesian q-points along straight segments joining the given points, with the cumulative distance'''
+    points=np.array(points)
+    if len(points)<2:
+        raise Exception("A path needs at least two points")
+    lengths=np.linalg.norm(np.diff(points,axis=0),axis=1)
+    total=np.sum(lengths)
+    qpoints=[]
+    distance=[]
+    ticks=[0.]
+    start=0.
+    for i in range(len(points)-1):
+        m=max(2,int(n_points*lengths[i]/total))
+        t=np.linspace(0,1,m,endpoint=(i==len(points)-2))
+        qpoints.append(points[i]+t[:,np.newaxis]*(points[i+1]-points[i]))
+        distance.append(start+t*lengths[i])
+        start+=lengths[i]
+        ticks.append(start)
+    return np.concatenate(qpoints),np.concatenate(distance),np.array(ticks)
+
+
+def plane(field,recip_latt,normal,extent,resolution=200):
+    '''Sample a q-grid field on a square of half-width extent through Gamma perpendicular to normal.
+
+    Returns the in-plane coordinates and the (resolution,resolution) map.'''
+    normal=np.array(normal,dtype=float)
+    normal=normal/np.linalg.norm(normal)
+    trial=np.array([1.,0.,0.]) if abs(normal[0])<0.9 else np.array([0.,1.,0.])
+    u=np.cross(normal,trial)
+    u=u/np.linalg.norm(u)
+    v=np.cross(normal,u)
+
+    x=np.linspace(-extent,extent,resolution)
+    X,Y=np.meshgrid(x,x)
+    q=X.reshape(-1,1)*u+Y.reshape(-1,1)*v
+    return x,sample(field,recip_latt,q).reshape(resolution,resolution)
+
+
+def plot_path(filename,distance,ticks,labels,xi,chi):
+    '''Plot the nesting function and susceptibility along a path of special points'''
+    import matplotlib.pyplot as plt
+    fig,axes=plt.subplots(2,1,figsize=(8,7),sharex=True)
+    axes[0].plot(distance,xi,'k-')
+    axes[0].set_ylabel(r"$\xi(q)$")
+    axes[1].plot(distance,chi,'k-')
+    axes[1].set_ylabel(r"$\chi(q)$ (states/eV)")
+    for ax in axes:
+        for t in ticks:
+            ax.axvline(t,color='grey',lw=0.5)
+    axes[1].set_xticks(ticks)
+    axes[1].set_xticklabels(labels)
+    axes[1].set_xlim(distance[0],distance[-1])
+    fig.savefig(filename)
+    plt.close(fig)
+
+
+def plot_plane(filename,x,xi,chi,cmap='viridis'):
+    '''Plot maps of the nesting function and susceptibility on a plane through Gamma'''
+    import matplotlib.pyplot as plt
+    fig,axes=plt.subplots(1,2,figsize=(12,6))
+    for ax,field,title in zip(axes,[xi,chi],[r"$\xi(q)$",r"$\chi(q)$"]):
+        im=ax.imshow(field,extent=[x[0],x[-1],x[0],x[-1]],origin='lower',cmap=cmap)
+        ax.set_title(title)
+        ax.set_aspect('equal')
+        ax.axis('off')
+        fig.colorbar(im,ax=ax,shrink=0.8)
+    fig.savefig(filename)
+    plt.close(fig)
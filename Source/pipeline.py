@@ -0,0 +1,370 @@
+import os
+import time
+import pickle
+import warnings
+import hashlib
+import numpy as np
+import pyvista as pv
+from pyvista import _vtk
+from vtkmodules.vtkCommonDataModel import vtkCellLocatorStrategy
+from Source import bands
+from Source import tetra
+from Source import dos
+from Source import dhva
+from Source import nesting
+from Source import transport
+from Source import mass as eff_mass
+from Source import pockets
+from Source import bandpath
+from Source import slices
+from Source import arpes
+from Source import analysis
+
+# Stages of a run in order, each one only depends on the ones before it
+stages=("read","unfold","grid","analysis","surface","attribute","render")
+
+
+def _update(h,obj):
+    '''Feed an input into a hash, arrays by their contents and containers item by item'''
+    if isinstance(obj,np.ndarray):
+        h.update(str((obj.dtype.str,obj.shape)).encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj,dict):
+        h.update(b"{")
+        for k in sorted(obj,key=repr):
+            _update(h,k)
+            _update(h,obj[k])
+        h.update(b"}")
+    elif isinstance(obj,(list,tuple,range)):
+        h.update(b"[")
+        for item in obj:
+            _update(h,item)
+        h.update(b"]")
+    else:
+        h.update(repr(obj).encode())
+        h.update(b";")
+
+
+def digest(*inputs):
+    '''Content hash of any number of inputs'''
+    h=hashlib.sha256()
+    for obj in inputs:
+        _update(h,obj)
+    return h.hexdigest()
+
+
+def file_digest(paths):
+    '''Content hash of files, a missing file hashes as absent rather than failing'''
+    h=hashlib.sha256()
+    for path in paths:
+        h.update(path.encode())
+        if os.path.isfile(path):
+            with open(path,'rb') as f:
+                for block in iter(lambda: f.read(1<<20),b""):
+                    h.update(block)
+        else:
+            h.update(b"absent")
+    return h.hexdigest()
+
+
+# The code a stage runs is one of its inputs, so editing a module only invalidates the stages that call it.
+# Later stages are keyed on the earlier ones, so their modules need not be listed again.
+stage_modules={"read":["bands","BZ","bxsf","nesting"],
+               "unfold":["pipeline","bands","doping","bxsf","nesting"],
+               "grid":["pipeline","analysis","tetra","mass","nesting","dos"],
+               "analysis":["pipeline","tetra","dos","transport","dhva","nesting","bandpath","pockets","slices","arpes"],
+               "surface":["pipeline","tetra"],
+               "attribute":["pipeline","pockets","main"],
+               "render":[]}
+code_digest={stage:file_digest([os.path.join(os.path.dirname(os.path.abspath(__file__)),name+".py") for name in modules])
+             for stage,modules in stage_modules.items()}
+
+
+class Cache:
+    '''On-disk results of the pipeline stages, keyed by the content hash of their declared inputs.
+
+    Each stage lists its inputs, including the key of the stage it builds on, so a change anywhere
+    upstream gives new keys for every later stage. With no directory the stages always run.'''
+    def __init__(self,directory=None,verbose=False):
+        self.directory=directory
+        self.verbose=verbose
+        if directory is not None:
+            os.makedirs(directory,exist_ok=True)
+
+    def key(self,stage,*inputs):
+        '''Key of a stage from its inputs'''
+        if stage not in stages:
+            raise Exception("Unknown stage "+stage)
+        return digest(stage,code_digest[stage],*inputs)
+
+    def run(self,stage,inputs,compute):
+        '''Result of a stage and its key, loaded from the cache when the inputs are unchanged, otherwise computed and stored'''
+        key=self.key(stage,*inputs)
+        start=time.time()
+        path=None
+        if self.directory is not None:
+            path=os.path.join(self.directory,"%s-%s.pkl"%(stage,key[0:16]))
+            if os.path.isfile(path):
+                with open(path,'rb') as f:
+                    result=pickle.load(f)
+                if self.verbose:
+                    print("Stage %-9s cached   %7.3f s"%(stage,time.time()-start))
+                return result,key
+
+        result=compute()
+        if path is not None:
+            # Written under a temporary name first so an interrupted run never leaves a broken entry
+            with open(path+".tmp",'wb') as f:
+                pickle.dump(result,f,protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path+".tmp",path)
+        if self.verbose:
+            print("Stage %-9s computed %7.3f s"%(stage,time.time()-start))
+        return result,key
+
+
+# The stages themselves. Every input is an argument, and main keys each stage on the same arguments,
+# with the key of the stage that made them standing in for the large objects.
+
+def unfold(cell,bril_zone,symmetry,data,prim=False,supercell=None,offset=0.,dope=None,smear=0.05):
+    '''Stage unfold: the BandStructure on the full zone, with the Fermi level shift of any doping (None without)'''
+    bs=bands.unfold(cell,bril_zone,symmetry,data,prim,supercell,offset)
+    # Rigid band doping moves the isovalue, the offset is then applied relative to the doped Fermi level
+    ef_shift=bs.dope(dope,smear) if dope is not None else None
+    return bs,ef_shift
+
+
+def grid(bs,bril_zone,offset,prim=False,gradients=False,masses=False,mass_dir=None,mass_principal=None,exchange=False):
+    '''Stage grid: the tetrahedral mesh over the unfolded kpoints, the one analyse uses, the occupations at the
+    isovalue and the fields on the mesh points asked for. Returns a dict, the fields end in the (band,spin) axes.'''
+    points,cells,in_zone=analysis.mesh(bs,bril_zone,prim)
+    result={"interp":pv.UnstructuredGrid({tetra.VTK_TETRA:cells},points),
+            "cells":cells,
+            "in_zone":in_zone,
+            "occupation":tetra.occupations(points,cells,bs.energy,offset,weights=in_zone)}
+
+    # Energy gradients and Fermi velocities for every band and spin in a single pass over the mesh
+    if gradients:
+        result["e_grad"]=tetra.energy_gradients(points,cells,bs.energy)
+        result["fermi_vel"]=tetra.fermi_velocities(points,cells,bs.energy,grad=result["e_grad"])
+
+    # Band Hessians by finite differences on the periodic grid, once for every band and spin
+    if masses:
+        e_hess=eff_mass.energy_hessians(bs.kpoints,bril_zone.recip_latt,bs.energy[:,:,0:bs.nspins])
+        result["band_mass"]=eff_mass.effective_masses(e_hess,direction=mass_dir,principal=mass_principal)
+
+    # Splittings of all bands on the shared mesh, so both spin channels probe the same field
+    if exchange:
+        result["band_split"]=bs.exchange_splitting()
+        result["split_fermi"]=dos.surface_average(points,cells,bs.energy,np.nan_to_num(result["band_split"]),offset,weights=in_zone)
+    return result
+
+
+def topology(bs,recip_latt,offset):
+    '''Stage analysis: the pockets of every Fermi surface band, as the vertices, labels and results of pockets.topology.
+    Surfaces on the periodic grid are closed across the zone boundary, so pockets and sheets are counted once.'''
+    t_grid,t_n,t_shift=nesting.periodic_grid(bs.kpoints,recip_latt,bs.energy[:,:,0:bs.nspins])
+    band_pockets={}
+    for sp in range(bs.nspins):
+        for i in range(bs.n_fermi[sp]):
+            t_vert,t_tri,t_corner=pockets.periodic_surface(t_grid[i,sp],t_shift,offset)
+            t_labels,t_res=pockets.topology(t_vert,t_tri,t_corner,recip_latt)
+            band_pockets[(i,sp)]=(t_vert,t_labels,t_res)
+    return band_pockets
+
+
+def dos_table(points,cells,energy,fermi_vel,offset,window,n_points,in_zone=None,spin_degen=2):
+    '''Stage analysis: the levels and DOS over the window about the isovalue, with the DOS and mean Fermi velocity at it'''
+    levels=offset+np.linspace(window[0],window[1],n_points)
+    band_dos=dos.density_of_states(points,cells,energy,levels,weights=in_zone,spin_degen=spin_degen)
+    dos_fermi=dos.density_of_states(points,cells,energy,offset,weights=in_zone,spin_degen=spin_degen)
+    mean_vel=dos.surface_average(points,cells,energy,fermi_vel,offset,weights=in_zone)
+    return levels,band_dos,dos_fermi,mean_vel
+
+
+def transport_table(points,cells,energy,e_grad,offset,cell_volume,tau,in_zone=None,spin_degen=2):
+    '''Stage analysis: the Fermi surface moments, squared plasma frequencies and conductivities of every band'''
+    n_ef,mean_speed,vv=transport.fermi_surface_moments(points,cells,energy,e_grad,offset,weights=in_zone,spin_degen=spin_degen)
+    plasma2=transport.plasma_frequency(n_ef,vv,cell_volume)
+    sigma=transport.conductivity(n_ef,vv,cell_volume,tau)
+    return n_ef,mean_speed,vv,plasma2,sigma
+
+
+def dhva_table(points,cells,bs,bril_zone,offset,direction,to=None,steps=10,n_planes=100):
+    '''Stage analysis: extremal orbits of every Fermi surface band for a field direction, or a sweep of them towards to.
+    Returns the directions, angles, (band,spin) pairs and the orbits of angular_sweep.'''
+    if to is not None:
+        directions,angles=dhva.rotation_directions(direction,to,steps)
+    else:
+        directions,angles=np.array([direction],dtype=float),np.array([0.])
+
+    band_list=[(i,sp) for sp in range(bs.nspins) for i in range(bs.n_fermi[sp])]
+    if bs.degen:
+        band_list=[(i,0) for i in range(bs.n_fermi[0])]
+    orbits=dhva.angular_sweep(points,cells,bs.energy,band_list,offset,directions,bril_zone,n_planes=n_planes)
+    return directions,angles,band_list,orbits
+
+
+def band_path(bs,recip_latt,path_points):
+    '''Stage analysis: the Fermi surface bands along a path interpolated from the periodic grid, other bands are nan.
+    Returns the kpoints, distances, ticks and the (band,spin,kpoint) energies.'''
+    p_grid,p_n,p_shift=nesting.periodic_grid(bs.kpoints,recip_latt,bs.energy[:,:,0:bs.nspins])
+    k_path,k_dist,k_ticks=nesting.path(path_points)
+    path_energy=bandpath.interpolate(p_grid,recip_latt,k_path,shift=p_shift)
+    for sp in range(bs.nspins):
+        path_energy[bs.n_fermi[sp]:,sp]=np.nan
+    return k_path,k_dist,k_ticks,path_energy
+
+
+def nesting_maps(bs,recip_latt,offset,sigma,corners,families,extent):
+    '''Stage analysis: nesting function and susceptibility on the q-grid, along the path joining corners and on a
+    plane through Gamma for each hkl of families. Returns the arrays as a dict, the same ones written to the npz.'''
+    spin_degen=3-bs.nspins
+    # Fermi surface bands on the periodic grid, the q-space maps then come from FFTs
+    k_grid,grid_n,grid_shift=nesting.periodic_grid(bs.kpoints,recip_latt,bs.energy[:,:,0:bs.nspins])
+    if bs.nspins==2:
+        grid_bands=[k_grid[0:bs.n_fermi[sp],sp:sp+1] for sp in range(2)]
+    else:
+        grid_bands=[k_grid]
+    xi=sum(nesting.nesting_function(g,offset,sigma,spin_degen) for g in grid_bands)
+    chi=sum(nesting.lindhard(g,offset,sigma,spin_degen=spin_degen) for g in grid_bands)
+    maps={"xi":xi,"chi":chi,"grid":grid_n}
+
+    if len(corners)>1:
+        q_path,q_dist,q_ticks=nesting.path(corners)
+        maps.update(path=q_path,path_distance=q_dist,path_ticks=q_ticks,
+                    xi_path=nesting.sample(xi,recip_latt,q_path),chi_path=nesting.sample(chi,recip_latt,q_path))
+
+    # One map through Gamma for each slice family, stacked in the order given
+    xi_plane=[]
+    chi_plane=[]
+    for hkl in families:
+        q_normal=np.matmul(recip_latt.T,hkl)
+        q_x,xi_map=nesting.plane(xi,recip_latt,q_normal,extent)
+        q_x,chi_map=nesting.plane(chi,recip_latt,q_normal,extent)
+        xi_plane.append(xi_map)
+        chi_plane.append(chi_map)
+    maps.update(plane=q_x,planes=np.array(families),xi_plane=np.array(xi_plane),chi_plane=np.array(chi_plane))
+    return maps
+
+
+def arpes_maps(interp,bs,recip_latt,border_mesh,offset,window,n_points,width,kz,kz_steps,families,offsets,res,R_corr=np.identity(3)):
+    '''Stage analysis: constant energy maps over the window on every plane of each hkl of families.
+
+    Every band with a state in the window, spins included, goes through each cut together. Returns the
+    levels, the kz spread, the number of states and for each family its grid, (offset,level,y,x) maps,
+    normal, rotation and the zone outline of each plane, None where there is no map.'''
+    a_bands=arpes.window_bands(bs.eigenvalues,offset+min(window),offset+max(window))
+    a_levels=offset+np.linspace(window[0],window[1],n_points)
+    a_energy=np.moveaxis(bs.eigenvalues[:,bs.kpoint_map,:],1,0)[:,a_bands]
+    interp.point_arrays["arpes_energy"]=np.where(np.isfinite(a_energy),a_energy,np.nan)
+    a_kz=np.linspace(-kz,kz,kz_steps) if kz_steps>1 else np.zeros(1)
+
+    a_families=[]
+    for hkl in families:
+        norm,R=slices.rotation(hkl,recip_latt,R_corr)
+        g_len=np.linalg.norm(np.matmul(recip_latt.T,hkl))
+        a_maps=np.full((len(offsets),n_points,res,res),np.nan)
+        a_x=np.full(res,np.nan)
+        outlines=[]
+        for i,s_off in enumerate(offsets):
+            outlines.append(None)
+            outline=slices.outline(border_mesh,norm,R,s_off*g_len*norm)
+            if outline is None:
+                continue
+            a_x=np.linspace(np.min(outline),np.max(outline),res)
+
+            # Maps of the planes spread along the normal are averaged, planes outside the zone give nan
+            kz_maps=[]
+            for dz in a_kz:
+                cut,weights=slices.cut(interp,(s_off+dz)*g_len*norm,norm,R,a_x,a_x,["arpes_energy"])
+                if cut is None:
+                    continue
+                cut_energy=cut[0].reshape(len(cut[0]),-1)
+                grid_energy=slices.resample(cut_energy,*weights,(res,res))
+                kz_maps.append(arpes.spectral_maps(grid_energy,a_levels,width))
+            if len(kz_maps)==0:
+                continue
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore',category=RuntimeWarning)
+                a_maps[i]=np.nanmean(kz_maps,axis=0)
+            outlines[i]=outline
+        a_families.append({"hkl":np.array(hkl),"x":a_x,"y":a_x,"maps":a_maps,"normal":norm,"rotation":R,"outlines":outlines})
+    return a_levels,a_kz,a_energy.shape[1],a_families
+
+
+def clip_zone(mesh,bril_zone):
+    '''Clip a surface to the Brillouin zone, keeping everything behind all of the faces'''
+    # The zone faces as a single implicit function so surfaces are clipped in one pass
+    bz_planes=_vtk.vtkPlanes()
+    bz_planes.SetPoints(pv.vtk_points(np.array([face[0][0] for face in bril_zone.bz_vert])))
+    bz_planes.SetNormals(_vtk.numpy_to_vtk(np.array([face[1] for face in bril_zone.bz_vert]),deep=True))
+    clipper=_vtk.vtkClipPolyData()
+    clipper.SetInputData(mesh)
+    clipper.SetClipFunction(bz_planes)
+    clipper.InsideOutOn()
+    clipper.Update()
+    return pv.wrap(clipper.GetOutput())
+
+
+def surface(interp,cells,energy,offset,band_list,smooth=0,refine=0,e_grad=None,bril_zone=None):
+    '''Stage surface: the contoured, smoothed and clipped Fermi surface of every (band,spin) of band_list that crosses
+    the isovalue. Refining needs the energy gradients, without bril_zone (the primitive cell) nothing is clipped.'''
+    # Only cells whose energy range brackets the isovalue can produce triangles, find them for all bands at once
+    active=tetra.active_cells(cells,np.moveaxis(energy,1,0),offset)
+    surfaces={}
+    for band,spin in band_list:
+        # Nothing to draw if no cell brackets the isovalue
+        if not active[:,band,spin].any():
+            continue
+        interp.point_arrays["values"]=energy[band,:,spin]
+        if refine>0:
+            r_points,r_values,r_cells=tetra.refine(interp.points,cells,energy[band,:,spin],e_grad[:,:,band,spin],offset,refine)
+            contours=pv.UnstructuredGrid({tetra.VTK_TETRA:r_cells},r_points)
+            contours.point_arrays["values"]=r_values
+        else:
+            contours=interp.extract_cells(np.where(active[:,band,spin])[0])
+        contours=contours.contour([offset],scalars="values")
+        contours=contours.smooth(n_iter=smooth)
+        surfaces[(band,spin)]=clip_zone(contours,bril_zone) if bril_zone is not None else contours
+    return surfaces
+
+
+def attribute(interp,surfaces,fields,recip_latt=None,band_pockets=None,holes=False):
+    '''Stage attribute: the colouring arrays, pocket labels and carrier types of every surface.
+
+    fields maps the name of each array moved onto the surfaces to its values on the mesh points, with the
+    (band,spin) axes last. Pocket labels come from the band_pockets of topology and the carrier types
+    of each pocket from the "Energy Gradient" field. Returns (surface,carrier types) for every surface.'''
+    # Cell locator over the mesh, built once and shared by every probe of the surfaces
+    locator=_vtk.vtkStaticCellLocator()
+    locator.SetDataSet(interp)
+    locator.BuildLocator()
+    strategy=vtkCellLocatorStrategy()
+    strategy.SetCellLocator(locator)
+
+    attributed={}
+    for (band,spin),contours in surfaces.items():
+        # Transfer the point arrays from the mesh onto the surface vertices using barycentric weights of the enclosing tetrahedra
+        for name,values in fields.items():
+            interp.point_arrays[name]=values[...,band,spin]
+        prober=_vtk.vtkProbeFilter()
+        prober.SetInputData(contours)
+        prober.SetSourceData(interp)
+        prober.SetFindCellStrategy(strategy)
+        prober.Update()
+        probed=pv.wrap(prober.GetOutput())
+        contours=contours.copy()
+        for name in fields:
+            contours.point_arrays[name]=probed.point_arrays[name]
+
+        if band_pockets is not None:
+            t_vert,t_labels,t_res=band_pockets[(band,spin)]
+            contours.point_arrays["Pocket"]=pockets.label_points(np.array(contours.points),recip_latt,t_vert,t_labels)
+        pocket_type=None
+        if holes:
+            # Each connected pocket is classified separately from the orientation of its normals
+            contours,n_pockets=pockets.regions(contours)
+            pocket_type=pockets.character(contours,"Energy Gradient",n_pockets)
+            contours.point_arrays["Carrier"]=pocket_type[np.array(contours.point_arrays["RegionId"])]
+        attributed[(band,spin)]=(contours,pocket_type)
+    return attributed
@@ -0,0 +1,153 @@
+import numpy as np
+
+
+def triangles(surface):
+    '''Points and (n_triangles,3) connectivity of a triangulated pyvista PolyData surface'''
+    surface=surface.triangulate()
+    return np.array(surface.points),np.array(surface.faces).reshape(-1,4)[:,1:]
+
+
+def regions(surface):
+    '''Label the connected pockets of a surface, returns the labelled surface and the number of pockets'''
+    surface=surface.connectivity(largest=False)
+    labels=np.array(surface.point_arrays["RegionId"])
+    return surface,(np.max(labels)+1 if len(labels)>0 else 0)
+
+
+def character(surface,gradient,n_pockets=None):
+    '''Electron (+1) or hole (-1) character of every connected pocket of a labelled surface.
+
+    gradient names the point array holding the energy gradient on the surface. Each triangle
+    normal is oriented along the gradient, i.e. towards higher energy, and the flux of
+    (x-c) through the pocket is summed with c the centroid of the pocket. This is three
+    times the signed enclosed volume for a closed pocket and keeps the right sign for the
+    open pieces left by clipping at the zone boundary: positive when the energy rises away
+    from the enclosed region (an electron pocket) and negative for a hole pocket.'''
+    labels=np.array(surface.point_arrays["RegionId"])
+    grad=np.array(surface.point_arrays[gradient])
+    if n_pockets is None:
+        n_pockets=np.max(labels)+1 if len(labels)>0 else 0
+
+    # The triangulated copy keeps the point ordering, so point arrays still apply
+    points,tri=triangles(surface)
+    x=points[tri]
+    normal=0.5*np.cross(x[:,1]-x[:,0],x[:,2]-x[:,0])
+    g=np.mean(grad[tri],axis=1)
+    normal=normal*np.sign(np.einsum('ij,ij->i',normal,g))[:,np.newaxis]
+
+    pocket=labels[tri[:,0]]
+    counts=np.bincount(labels,minlength=n_pockets)
+    safe=np.where(counts>0,counts,1)
+    centroid=np.stack([np.bincount(labels,weights=points[:,i],minlength=n_pockets) for i in range(3)],axis=1)/safe[:,np.newaxis]
+
+    flux=np.einsum('ij,ij->i',np.mean(x,axis=1)-centroid[pocket],normal)
+    total=np.bincount(pocket,weights=flux,minlength=n_pockets)
+    return np.where(total>=0,1,-1)
+
+
+def periodic_surface(values,shift,level,weld=1e6):
+    '''Isosurface of one band on the periodic grid, welded across the boundary of the reciprocal cell.
+
+    values is the (n1,n2,n3) grid of one band and spin from nesting.periodic_grid, shift its offset.
+    The grid is extended by one layer copied from the opposite side, so vertices on opposite faces
+    of the cell coincide modulo a lattice vector and are merged. Returns the fractional vertices in
+    [0,1), the (n_triangles,3) connectivity and the lattice shift of every triangle corner
+    (n_triangles,3,3), so that vertices[tri]+corner_shift is a contiguous triangle.'''
+    import pyvista as pv
+    n=np.array(values.shape)
+    wrapped=np.pad(values,[(0,1),(0,1),(0,1)],mode='wrap')
+    grid=pv.UniformGrid(dims=n+1,spacing=1/n,origin=np.array(shift)/n)
+    grid.point_arrays["values"]=wrapped.flatten(order='F')
+    surface=grid.contour([level],scalars="values")
+    if surface.n_points==0:
+        return np.zeros((0,3)),np.zeros((0,3),dtype=int),np.zeros((0,3,3),dtype=int)
+
+    points,tri=triangles(surface)
+    q=np.round(points*weld).astype(np.int64)
+    keys,inv=np.unique(np.mod(q,int(weld)),axis=0,return_inverse=True)
+    inv=inv.reshape(-1)
+    corner_shift=np.floor_divide(q,int(weld))[tri]
+    tri=inv[tri]
+
+    # Slivers collapsed by the weld carry no area
+    good=(tri[:,0]!=tri[:,1])&(tri[:,1]!=tri[:,2])&(tri[:,0]!=tri[:,2])
+    return keys/weld,tri[good],corner_shift[good]
+
+
+def topology(vertices,tri,corner_shift,recip_latt):
+    '''Connected pockets of a welded periodic surface and their area, volume, Euler characteristic and periodicity.
+
+    Each pocket is lifted from the 3-torus along a spanning tree of its edges. An edge that closes a
+    cycle with a non-zero lattice translation shows that the pocket is open in that direction, and
+    the rank of these translations is its periodic dimension (0 for a closed pocket, 3 for a sheet
+    connected across every face of the zone). Areas are in 1/A^2 and volumes in 1/A^3 (k without
+    the 2pi); the volume and character (+1 electron, -1 hole) of open sheets are not defined and
+    are given as nan and 0.
+
+    Returns the pocket label of every vertex and a list of dicts, one per pocket.'''
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components,breadth_first_order
+    n_vert=len(vertices)
+    if len(tri)==0:
+        return np.zeros(n_vert,dtype=int),[]
+
+    # Directed edges with the lattice translation from the first corner to the second
+    pairs=np.array([[0,1],[1,2],[2,0]])
+    a=tri[:,pairs[:,0]].reshape(-1)
+    b=tri[:,pairs[:,1]].reshape(-1)
+    d=(corner_shift[:,pairs[:,1]]-corner_shift[:,pairs[:,0]]).reshape(-1,3)
+
+    # Undirected edges of the torus, the same pair of vertices with another translation is another edge
+    flip=a>b
+    key=np.column_stack([np.where(flip,b,a),np.where(flip,a,b),np.where(flip[:,np.newaxis],-d,d)])
+    edges=np.unique(key,axis=0)
+
+    graph=coo_matrix((np.ones(len(edges)),(edges[:,0],edges[:,1])),shape=(n_vert,n_vert))
+    n_pockets,labels=connected_components(graph,directed=False)
+
+    # Lift every pocket from its first vertex along a spanning tree
+    sym=(graph+graph.T).tocsr()
+    lookup={}
+    for (i,j),dd in zip(edges[:,0:2],edges[:,2:]):
+        lookup.setdefault((i,j),dd)
+        lookup.setdefault((j,i),-dd)
+    lift=np.zeros((n_vert,3),dtype=np.int64)
+    for root in np.unique(labels,return_index=True)[1]:
+        order,pred=breadth_first_order(sym,root,directed=False)
+        for v in order[1:]:
+            lift[v]=lift[pred[v]]+lookup[(pred[v],v)]
+
+    cycles=lift[edges[:,0]]+edges[:,2:]-lift[edges[:,1]]
+    edge_pocket=labels[edges[:,0]]
+    tri_pocket=labels[tri[:,0]]
+
+    # Cartesian triangles placed by the lift of their first corner, so closed pockets are contiguous
+    x=np.matmul(vertices[tri]+corner_shift-corner_shift[:,0:1]+lift[tri[:,0:1]],recip_latt)
+    cross=np.cross(x[:,1]-x[:,0],x[:,2]-x[:,0])
+    area=0.5*np.linalg.norm(cross,axis=1)
+    # The contour filter winds triangles with their normals towards lower values, so an electron pocket has a negative volume
+    signed=-np.einsum('ij,ij->i',x[:,0],cross)/6
+
+    results=[]
+    for n in range(n_pockets):
+        periods=cycles[(edge_pocket==n)&np.any(cycles!=0,axis=1)]
+        dim=np.linalg.matrix_rank(periods) if len(periods)>0 else 0
+        mask=tri_pocket==n
+        euler=np.sum(labels==n)-np.sum(edge_pocket==n)+np.sum(mask)
+        volume=np.sum(signed[mask]) if dim==0 else np.nan
+        results.append({"area":float(np.sum(area[mask])),
+                        "volume":float(abs(volume)),
+                        "character":int(np.sign(volume)) if dim==0 else 0,
+                        "euler":int(euler),
+                        "genus":(2-int(euler))//2,
+                        "periodic":int(dim)})
+    return labels,results
+
+
+def label_points(points,recip_latt,vertices,labels):
+    '''Pocket labels of Cartesian surface points from the nearest vertex of the welded periodic surface'''
+    from scipy.spatial import cKDTree
+    tree=cKDTree(np.mod(vertices,1.),boxsize=1.)
+    frac=np.mod(np.matmul(points,np.linalg.inv(recip_latt)),1.)
+    _,nearest=tree.query(frac)
+    return labels[nearest]
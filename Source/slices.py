@@ -0,0 +1,100 @@
+import numpy as np
+from scipy.spatial import Delaunay
+
+
+def grid_weights(points,x_coords,y_coords):
+    '''Barycentric interpolation weights of a regular grid in the Delaunay triangulation of scattered 2D points.
+
+    Returns the (N,3) triangle corners and weights of every grid point, flattened in meshgrid order,
+    and a mask of the grid points inside the triangulation. The triangulation and point location are
+    done once, so any number of fields on the same points can then be resampled with resample.'''
+    tri=Delaunay(points)
+    X,Y=np.meshgrid(x_coords,y_coords)
+    xy=np.column_stack([X.ravel(),Y.ravel()])
+    simplex=tri.find_simplex(xy)
+    inside=simplex>=0
+    s=np.where(inside,simplex,0)
+    T=tri.transform[s]
+    b=np.einsum('ijk,ik->ij',T[:,:2],xy-T[:,2])
+    weights=np.column_stack([b,1-np.sum(b,axis=1)])
+    return tri.simplices[s],weights,inside
+
+
+def resample(values,corners,weights,inside,shape,fill=np.nan):
+    '''Field on the regular grid from its values at the triangulated points, shape (len(y_coords),len(x_coords)).
+    values may carry trailing axes (e.g. bands), which are kept after the grid axes.'''
+    z=np.einsum('ij,ij...->i...',weights,values[corners])
+    z[~inside]=fill
+    return z.reshape(tuple(shape)+z.shape[1:])
+
+
+def _skew(x):
+    '''Cross product matrix of a vector'''
+    return np.array([[0, -x[2], x[1]],
+                     [x[2], 0, -x[0]],
+                     [-x[1], x[0], 0]])
+
+
+def rotation(hkl,recip_latt,R_corr=np.identity(3)):
+    '''Unit normal of the hkl plane and the rotation taking it onto the page, followed by the user rotation R_corr'''
+    # Calculte norm
+    norm=hkl[0]*recip_latt.T[:,0]+hkl[1]*recip_latt.T[:,1]+hkl[2]*recip_latt.T[:,2]
+    norm=norm/np.linalg.norm(norm)
+
+    v_R=np.cross(norm,np.array([0,0,1]))
+    s_R=np.linalg.norm(v_R)
+    c_R=np.dot(norm,np.array([0,0,1]))
+    skew_R=_skew(v_R)
+
+    R=np.identity(3)+skew_R+np.dot(skew_R,skew_R)*(1-c_R)/(s_R**2)
+
+    if (v_R==0).all():
+        R=np.identity(3)
+
+    # Calculate the rotation for prettyness (project kx onto plane and rotate to y)
+    kx= recip_latt.T[:,0]/np.linalg.norm(recip_latt.T[:,0])
+    plane_vec=np.matmul(R,kx-np.dot(kx,norm)*norm)
+
+    if (np.array(hkl)==np.array([1,0,0])).all():
+        direction=np.array([0,1,0])
+    else:
+        direction=np.array([1,0,0])
+
+    v_P=np.cross(plane_vec,direction)
+    s_P=np.linalg.norm(v_P)
+    c_P=np.dot(plane_vec,direction)
+    skew_P=_skew(v_P)
+
+    R_P=np.identity(3)+skew_P+np.dot(skew_P,skew_P)*(1-c_P)/(s_P**2)
+
+    if (v_P==0).all() or abs(np.linalg.det(R_P))<0.001:
+        R_P=np.identity(3)
+
+    R=np.matmul(R_P,R)
+    R=np.matmul(R_corr,R)
+    return norm,R
+
+
+def outline(border_mesh,norm,R,origin):
+    '''Outline of the zone surface border_mesh on the plane through origin, rotated onto the page, or None if the plane misses it'''
+    import pyvista as pv
+    from scipy.spatial import ConvexHull
+    size=4*np.max(np.linalg.norm(np.array(border_mesh.points),axis=1))
+    plane=pv.Plane(center=origin,direction=norm,i_size=size,j_size=size)
+    plane=plane.triangulate()
+
+    border=border_mesh.intersection(plane)[0]
+    if border.n_points<3:
+        return None
+    points=np.matmul(np.array(border.points),R.T)[:,0:2]
+    hull=ConvexHull(points)
+    return points[hull.vertices,:]
+
+
+def cut(mesh,origin,norm,R,x_coords,y_coords,names):
+    '''Cut a mesh at a plane and return the named point arrays there with the grid interpolation weights, or None if the plane misses the mesh'''
+    p_slice=mesh.slice(normal=norm,origin=origin)
+    if p_slice.n_points<3:
+        return None,None
+    proj_points=np.matmul(np.array(p_slice.points),R.T)[:,0:2]
+    return [np.array(p_slice[name]) for name in names],grid_weights(proj_points,x_coords,y_coords)
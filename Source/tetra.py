@@ -0,0 +1,295 @@
+import numpy as np
+
+# Physical constants (SI)
+hbar=1.054571817e-34
+e_charge=1.602176634e-19
+m_e=9.1093837015e-31
+
+# VTK cell type id of a tetrahedron
+VTK_TETRA=10
+
+# Converts |grad E| in eV*Angstrom (k without the 2pi) to a velocity in m/s
+velocity_conv=e_charge*1e-10/(2*np.pi*hbar)
+
+
+def mesh_cells(mesh):
+    '''Return the (n_cells,4) connectivity of the tetrahedra in a pyvista UnstructuredGrid'''
+    return np.array(mesh.cells_dict[VTK_TETRA],dtype=int)
+
+
+def _edge_terms(points,cells,values):
+    '''Signed tetrahedron determinants and the un-normalised linear gradients of the values in each cell.
+
+    values has shape (n_points,...), any trailing axes (bands, spins) are carried through in one pass.'''
+    x=points[cells]
+    e1=x[:,1]-x[:,0]
+    e2=x[:,2]-x[:,0]
+    e3=x[:,3]-x[:,0]
+    c23=np.cross(e2,e3)
+    c31=np.cross(e3,e1)
+    c12=np.cross(e1,e2)
+    det=np.einsum('ij,ij->i',e1,c23)
+
+    v=values[cells]
+    dv1=v[:,1]-v[:,0]
+    dv2=v[:,2]-v[:,0]
+    dv3=v[:,3]-v[:,0]
+
+    # det*grad for each cell, shape (n_cells,3,...)
+    extra=(np.newaxis,)*(values.ndim-1)
+    num=(c23[(slice(None),slice(None))+extra]*dv1[:,np.newaxis]
+         +c31[(slice(None),slice(None))+extra]*dv2[:,np.newaxis]
+         +c12[(slice(None),slice(None))+extra]*dv3[:,np.newaxis])
+    return det,num
+
+
+def cell_gradients(points,cells,values,tol=1e-14):
+    '''Exact gradient of the linear interpolant in every tetrahedron, shape (n_cells,3,...).
+    Degenerate cells are given a zero gradient.'''
+    det,num=_edge_terms(points,cells,values)
+    good=np.abs(det)>tol
+    shape=(slice(None),)+(np.newaxis,)*(num.ndim-1)
+    safe=np.where(good,det,1.)
+    return np.where(good[shape],num/safe[shape],0.)
+
+
+def point_gradients(points,cells,values):
+    '''Volume weighted average of the cell gradients around each point, shape (n_points,3,...)'''
+    det,num=_edge_terms(points,cells,values)
+
+    # |det|*grad=sign(det)*num, so no division by small cell volumes is needed
+    shape=(slice(None),)+(np.newaxis,)*(num.ndim-1)
+    weighted=np.sign(det)[shape]*num
+
+    grad=np.zeros((len(points),)+num.shape[1:])
+    weight=np.zeros(len(points))
+    for i in range(4):
+        np.add.at(grad,cells[:,i],weighted)
+        np.add.at(weight,cells[:,i],np.abs(det))
+
+    weight=np.where(weight>0,weight,1.)
+    return grad/weight[shape]
+
+
+def cell_ranges(cells,values):
+    '''Minimum and maximum of the values over the corners of each cell, shape (n_cells,...)'''
+    v=values[cells]
+    return np.min(v,axis=1),np.max(v,axis=1)
+
+
+def active_cells(cells,values,isovalue):
+    '''Mask of the cells whose range of values brackets the isovalue, shape (n_cells,...)'''
+    v_min,v_max=cell_ranges(cells,values)
+    return (v_min<=isovalue)&(v_max>=isovalue)
+
+
+def cell_volumes(points,cells):
+    '''Volume of every tetrahedron'''
+    x=points[cells]
+    det=np.einsum('ij,ij->i',x[:,1]-x[:,0],np.cross(x[:,2]-x[:,0],x[:,3]-x[:,0]))
+    return np.abs(det)/6
+
+
+def _sorted_corners(cells,values):
+    '''Corner values of each cell sorted in ascending order, as four arrays of shape (n_cells,...)'''
+    v=np.sort(values[cells],axis=1)
+    return v[:,0],v[:,1],v[:,2],v[:,3]
+
+
+def _levels(level,ndim):
+    '''Broadcast a scalar or 1D array of levels against arrays with ndim axes, adding a leading axis for arrays'''
+    level=np.asarray(level,dtype=float)
+    return level.reshape(level.shape+(1,)*ndim)
+
+
+def occupied_fraction(cells,values,level):
+    '''Fraction of each tetrahedron where the linearly interpolated values lie below level, shape (n_cells,...).
+    An array of levels adds a leading axis to the result.
+
+    Uses the analytic expressions of the linear tetrahedron method (Bloechl, PRB 49, 16223).'''
+    e1,e2,e3,e4=_sorted_corners(cells,values)
+    e=_levels(level,e1.ndim)
+
+    with np.errstate(divide='ignore',invalid='ignore'):
+        f1=(e-e1)**3/((e2-e1)*(e3-e1)*(e4-e1))
+        f2=(( e2-e1)**2+3*(e2-e1)*(e-e2)+3*(e-e2)**2
+            -(e3-e1+e4-e2)*(e-e2)**3/((e3-e2)*(e4-e2)))/((e3-e1)*(e4-e1))
+        f3=1-(e4-e)**3/((e4-e1)*(e4-e2)*(e4-e3))
+
+    f=np.where(e>=e4,1.,np.zeros(np.broadcast(e,e1).shape))
+    f=np.where((e>e1)&(e<=e2),f1,f)
+    f=np.where((e>e2)&(e<=e3),f2,f)
+    f=np.where((e>e3)&(e<e4),f3,f)
+    return f
+
+
+def dos_fraction(cells,values,level):
+    '''Derivative of occupied_fraction with respect to level, i.e. the density of states of each tetrahedron
+    per unit of the values, shape (n_cells,...). An array of levels adds a leading axis to the result.'''
+    e1,e2,e3,e4=_sorted_corners(cells,values)
+    e=_levels(level,e1.ndim)
+
+    with np.errstate(divide='ignore',invalid='ignore'):
+        g1=3*(e-e1)**2/((e2-e1)*(e3-e1)*(e4-e1))
+        g2=(3*(e2-e1)+6*(e-e2)
+            -3*(e3-e1+e4-e2)*(e-e2)**2/((e3-e2)*(e4-e2)))/((e3-e1)*(e4-e1))
+        g3=3*(e4-e)**2/((e4-e1)*(e4-e2)*(e4-e3))
+
+    g=np.zeros(np.broadcast(e,e1).shape)
+    g=np.where((e>e1)&(e<=e2),g1,g)
+    g=np.where((e>e2)&(e<=e3),g2,g)
+    g=np.where((e>e3)&(e<e4),g3,g)
+    return g
+
+
+def occupations(points,cells,energy,level,weights=None):
+    '''Fraction of the zone occupied below level for every band and spin, shape (band,spin), or
+    (level,band,spin) for an array of levels.
+
+    weights optionally scales the volume of each cell, e.g. to exclude cells outside the BZ.'''
+    vol=cell_volumes(points,cells)
+    if weights is not None:
+        vol=vol*weights
+    f=occupied_fraction(cells,np.moveaxis(energy,1,0),level)
+    return np.tensordot(vol,f,axes=([0],[f.ndim-energy.ndim]))/np.sum(vol)
+
+
+# Edges, as pairs of corners sorted by value, that the isosurface crosses for one, three or two corners below the level
+_cross_one=np.array([[[0,1],[0,2],[0,3]]])
+_cross_three=np.array([[[0,3],[1,3],[2,3]]])
+_cross_two=np.array([[[0,2],[0,3],[1,3]],[[0,2],[1,3],[1,2]]])
+
+
+def isosurface(points,cells,values,level):
+    '''Triangulated isosurface of the point values on a tetrahedral mesh by marching tetrahedra, without VTK.
+
+    Every active cell is handled at once from the order of its corner values. Vertices are interpolated
+    once per crossed edge, so triangles of neighbouring cells share them. Returns the vertices and the
+    (n_triangles,3) connectivity, the triangles are not consistently oriented.'''
+    v=values[cells]
+    below=np.sum(v<level,axis=1)
+    active=(below>0)&(below<4)
+    corners=np.take_along_axis(cells[active],np.argsort(v[active],axis=1),axis=1)
+    below=below[active]
+
+    # (triangle,corner,edge end) point ids, the first end of each edge is below the level
+    ends=[]
+    for n,cross in [(1,_cross_one),(3,_cross_three),(2,_cross_two)]:
+        ends.append(corners[below==n][:,cross].reshape(-1,3,2))
+    ends=np.concatenate(ends)
+    if len(ends)==0:
+        return np.zeros((0,3)),np.zeros((0,3),dtype=int)
+
+    edges,tri=np.unique(ends.reshape(-1,2),axis=0,return_inverse=True)
+    t=(level-values[edges[:,0]])/(values[edges[:,1]]-values[edges[:,0]])
+    vertices=points[edges[:,0]]+t[:,np.newaxis]*(points[edges[:,1]]-points[edges[:,0]])
+    return vertices,tri.reshape(-1,3)
+
+
+def energy_gradients(points,cells,energy):
+    '''Point gradients of the BandStructure energies (band,kpoint,spin), the result is (kpoint,3,band,spin)'''
+    return point_gradients(points,cells,np.moveaxis(energy,1,0))
+
+
+def fermi_velocities(points,cells,energy,grad=None):
+    '''Fermi velocity magnitudes (m/s) at every point for all bands and spins.
+
+    energy is the BandStructure array (band,kpoint,spin), the result is (kpoint,band,spin).'''
+    if grad is None:
+        grad=energy_gradients(points,cells,energy)
+    return np.linalg.norm(grad,axis=1)*velocity_conv
+
+
+# Corner pairs of the six edges of a tetrahedron
+_tet_edges=np.array([[0,1],[0,2],[0,3],[1,2],[1,3],[2,3]])
+
+# Corner triples of the four faces of a tetrahedron
+_tet_faces=np.array([[1,2,3],[0,2,3],[0,1,3],[0,1,2]])
+
+# Eight children of a tetrahedron in terms of corners 0-3 and edge midpoints 4-9 (in _tet_edges order)
+_tet_children=np.array([[0,4,5,6],
+                        [1,4,7,8],
+                        [2,5,7,9],
+                        [3,6,8,9],
+                        [5,8,4,7],
+                        [5,8,7,9],
+                        [5,8,9,6],
+                        [5,8,6,4]])
+
+
+def _hermite_spread(points,cells,values,grads):
+    '''Largest deviation of the cubic Hermite edge midpoints from the linear midpoints in each cell'''
+    a=cells[:,_tet_edges[:,0]]
+    b=cells[:,_tet_edges[:,1]]
+    e=points[b]-points[a]
+    m0=np.einsum('ijk,ijk->ij',grads[a],e)
+    m1=np.einsum('ijk,ijk->ij',grads[b],e)
+    return np.max(np.abs(m0-m1),axis=1)/8
+
+
+def refine(points,cells,values,grads,isovalue,levels):
+    '''Adaptively subdivide the cells crossed by the isosurface.
+
+    Each level splits the cells that the isosurface may cross into eight children. New
+    values at the edge midpoints come from cubic Hermite interpolation along the edge
+    using the point gradients, so the refined surface follows the curvature of the band
+    rather than the original linear interpolant. Edges on the boundary of the refined
+    region are split linearly so the surface stays closed across it.
+
+    Returns the points, values and the cells of the finest level that bracket the isovalue.'''
+    points=np.array(points,dtype=float)
+    values=np.array(values,dtype=float)
+    grads=np.array(grads,dtype=float)
+    cells=np.array(cells,dtype=int)
+
+    for level in range(levels):
+        # Cells the surface crosses, or may cross once the midpoints are refined
+        v_min,v_max=cell_ranges(cells,values)
+        spread=_hermite_spread(points,cells,values,grads)
+        cells=cells[(v_min-spread<=isovalue)&(v_max+spread>=isovalue)]
+        if len(cells)==0:
+            break
+
+        # Unique edges of the selected cells, and those lying on faces at the edge of the region
+        n_cells=len(cells)
+        cell_edges=np.sort(cells[:,_tet_edges],axis=2).reshape(-1,2)
+        faces=np.sort(cells[:,_tet_faces],axis=2).reshape(-1,3)
+        uni_faces,counts=np.unique(faces,axis=0,return_counts=True)
+        outer=uni_faces[counts==1]
+        outer_edges=np.sort(outer[:,[[0,1],[0,2],[1,2]]],axis=2).reshape(-1,2)
+
+        edges,inv=np.unique(np.append(cell_edges,outer_edges,axis=0),axis=0,return_inverse=True)
+        inv=inv.reshape(-1)
+        linear=np.zeros(len(edges),dtype=bool)
+        linear[inv[6*n_cells:]]=True
+
+        # Midpoint values and gradients
+        a,b=edges[:,0],edges[:,1]
+        e=points[b]-points[a]
+        m0=np.einsum('ij,ij->i',grads[a],e)
+        m1=np.einsum('ij,ij->i',grads[b],e)
+        mid_points=0.5*(points[a]+points[b])
+        mid_values=0.5*(values[a]+values[b])+np.where(linear,0.,(m0-m1)/8)
+        mid_grads=0.5*(grads[a]+grads[b])
+        slope=1.5*(values[b]-values[a])-0.25*(m0+m1)
+        slope=np.where(linear,values[b]-values[a],slope)
+        e_len=np.einsum('ij,ij->i',e,e)
+        e_len=np.where(e_len>0,e_len,1.)
+        mid_grads+=e*((slope-np.einsum('ij,ij->i',mid_grads,e))/e_len)[:,np.newaxis]
+
+        # Children of every cell, flipped where needed to keep a positive orientation
+        mids=len(points)+inv[:6*n_cells].reshape(n_cells,6)
+        nodes=np.append(cells,mids,axis=1)
+        cells=nodes[:,_tet_children].reshape(-1,4)
+
+        points=np.append(points,mid_points,axis=0)
+        values=np.append(values,mid_values)
+        grads=np.append(grads,mid_grads,axis=0)
+
+        x=points[cells]
+        det=np.einsum('ij,ij->i',x[:,1]-x[:,0],np.cross(x[:,2]-x[:,0],x[:,3]-x[:,0]))
+        flip=det<0
+        cells[flip]=cells[flip][:,[1,0,2,3]]
+
+    cells=cells[active_cells(cells,values,isovalue)]
+    return points,values,cells
@@ -0,0 +1,67 @@
+import json
+import numpy as np
+from Source import tetra
+from Source.dos import _zone_volumes
+
+# Vacuum permittivity (F/m)
+epsilon_0=8.8541878128e-12
+
+
+def fermi_surface_moments(points,cells,energy,grad,level,weights=None,spin_degen=2):
+    '''Density of states and velocity moments on the isosurface at level for every band and spin.
+
+    grad is the point gradient array (kpoint,3,band,spin) used for velocity colouring. Each cell
+    contributes the mean velocity of its corners weighted by its share of the density of states.
+    Returns N(E) in states/eV/cell (band,spin), <|v|> in m/s (band,spin) and <v_a v_b> in
+    (m/s)^2 with shape (3,3,band,spin).'''
+    vol=_zone_volumes(points,cells,weights)
+    g=tetra.dos_fraction(cells,np.moveaxis(energy,1,0),level)*vol[:,np.newaxis,np.newaxis]
+    norm=np.sum(g,axis=0)
+    safe=np.where(norm>0,norm,1.)
+
+    v=np.mean(grad[cells],axis=1)*tetra.velocity_conv
+    speed=np.einsum('cbs,cbs->bs',g,np.linalg.norm(v,axis=1))/safe
+    vv=np.einsum('cbs,cibs,cjbs->ijbs',g,v,v)/safe
+
+    n_ef=spin_degen*norm/np.sum(vol)
+    return n_ef,speed,vv
+
+
+def plasma_frequency(n_ef,vv,cell_volume):
+    '''Plasma frequency tensor squared in eV^2, (hbar omega_p)^2, from N(Ef) (states/eV/cell),
+    <v_a v_b> ((m/s)^2) and the cell volume (A^3)'''
+    omega2=tetra.e_charge*n_ef*vv/(epsilon_0*cell_volume*1e-30)
+    return omega2*(tetra.hbar/tetra.e_charge)**2
+
+
+def conductivity(n_ef,vv,cell_volume,tau):
+    '''Constant relaxation time Boltzmann conductivity tensor in S/m for a relaxation time tau (s)'''
+    return tetra.e_charge*n_ef*vv*tau/(cell_volume*1e-30)
+
+
+def write_json(filename,seed,bs,n_ef,speed,plasma2,sigma,tau):
+    '''Write the transport quantities of every band and spin, and their totals, to a JSON file'''
+    spin_names=["up","down"]
+    report={"seed":seed,
+            "units":{"dos":"states/eV/cell","velocity":"m/s","plasma_frequency":"eV","conductivity":"S/m","tau":"s"},
+            "tau":tau,
+            "bands":[]}
+
+    total_plasma2=np.zeros((3,3))
+    total_sigma=np.zeros((3,3))
+    for s in range(bs.nspins):
+        for i in range(bs.n_fermi[s]):
+            report["bands"].append({"band":int(bs.ids[i,s]),
+                                    "spin":spin_names[s],
+                                    "dos_at_fermi":float(n_ef[i,s]),
+                                    "fermi_velocity":float(speed[i,s]),
+                                    "plasma_frequency_squared":plasma2[:,:,i,s].tolist(),
+                                    "conductivity":sigma[:,:,i,s].tolist()})
+            total_plasma2+=plasma2[:,:,i,s]
+            total_sigma+=sigma[:,:,i,s]
+    report["plasma_frequency_squared"]=total_plasma2.tolist()
+    report["plasma_frequency"]=np.sqrt(np.abs(np.diag(total_plasma2))).tolist()
+    report["conductivity"]=total_sigma.tolist()
+
+    with open(filename,'w') as f:
+        json.dump(report,f,indent=2)
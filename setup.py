@@ -15,6 +15,7 @@ setup(name="castep2fs",
                         "ase>=3.18.1",
                         "pyvista==0.37.0",
                         "vtk","spglib","argparse","tqdm"],
+      extras_require={"hdf5":["h5py"]},
 
       entry_points={"console_scripts":["castep2fs=Source.main:main",]
                     }
@@ -0,0 +1,66 @@
+import os
+import numpy as np
+import pyvista as pv
+from scipy.spatial import Delaunay
+from Source import dhva
+from Source import tetra
+
+examples=os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","Examples")
+
+
+def free_electron_mesh(k_f=0.25,extent=0.35,n=36,seed=0):
+    '''Mesh of a free electron band about Gamma with its Fermi level at zero, kpoints in 1/A without the 2pi.
+    The grid is jittered so the Delaunay tessellation is unique.'''
+    rng=np.random.default_rng(seed)
+    x=np.linspace(-extent,extent,n)
+    points=np.stack(np.meshgrid(x,x,x,indexing='ij'),axis=-1).reshape(-1,3)
+    points=points+rng.uniform(-0.1,0.1,points.shape)*(x[1]-x[0])
+    cells=Delaunay(points).simplices
+    # E = hbar^2 (2 pi k)^2 / 2 m_e in eV
+    scale=tetra.hbar**2*dhva.area_conv/(2*tetra.m_e*tetra.e_charge)
+    values=scale*(np.sum(points**2,axis=1)-k_f**2)
+    return pv.UnstructuredGrid({tetra.VTK_TETRA:cells},points),values
+
+
+def test_sphere_single_maximal_orbit():
+    k_f=0.25
+    mesh,values=free_electron_mesh(k_f)
+    heights=np.linspace(-0.3,0.3,81)
+    orbits=dhva.extremal_orbits(mesh,values,0.,[0,0,1],heights)
+
+    assert len(orbits)==1
+    orbit=orbits[0]
+    assert orbit["extremum"]=="max"
+    assert abs(orbit["height"])<heights[1]-heights[0]
+
+    # Onsager: F = hbar A / (2 pi e) for the equatorial area pi k_f^2
+    frequency=tetra.hbar*np.pi*k_f**2*dhva.area_conv/(2*np.pi*tetra.e_charge)
+    assert abs(orbit["frequency"]-frequency)<0.01*frequency
+    assert abs(orbit["mass"]-1)<0.03
+
+
+def test_sphere_tilted_field():
+    k_f=0.25
+    mesh,values=free_electron_mesh(k_f)
+    heights=np.linspace(-0.3,0.3,81)
+    orbits=dhva.extremal_orbits(mesh,values,0.,[1,1,1],heights)
+
+    assert len(orbits)==1
+    frequency=tetra.hbar*np.pi*k_f**2*dhva.area_conv/(2*np.pi*tetra.e_charge)
+    assert abs(orbits[0]["frequency"]-frequency)<0.01*frequency
+
+
+def test_copper_belly_001():
+    from Source import bands
+    from Source import analysis
+    cell,bril_zone,symmetry,bs=bands.load(os.path.join(examples,"Cu","Cu"),False,None,0.,None)
+    points,cells,in_zone=analysis.mesh(bs,bril_zone)
+    orbits=dhva.angular_sweep(points,cells,bs.energy,[(0,0)],0.,[[0,0,1]],bril_zone)[0][0]
+
+    # The Gamma belly is the only large orbit, the loops joining the necks give no extrema
+    belly=[o for o in orbits if o["frequency"]>30000]
+    assert len(belly)==1
+    assert belly[0]["extremum"]=="max"
+    assert abs(belly[0]["height"])<0.01
+    assert abs(belly[0]["frequency"]-61960)<0.005*61960
+    assert abs(belly[0]["mass"]-1.45)<0.05